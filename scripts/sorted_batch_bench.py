@@ -0,0 +1,90 @@
+# =============================================================================
+# Sorted Batch Benchmark
+# =============================================================================
+#
+# Indexing the same random crawl of a large single site with & without the
+# sorted batch ingestion, checking that the reports are the same.
+#
+import random
+import time
+from traph import Traph
+
+webentity_creation_rules_regexp = {
+    "domain": b"(s:[a-zA-Z]+\\|(t:[0-9]+\\|)?(h:[^\\|]+\\|(h:[^\\|]+\\|)|h:(localhost|(\\d{1,3}\\.){3}\\d{1,3}|\\[[\\da-f]*:[\\da-f:]*\\])\\|))",
+    "path1": b"(s:[a-zA-Z]+\\|(t:[0-9]+\\|)?(h:[^\\|]+\\|(h:[^\\|]+\\|)+|h:(localhost|(\\d{1,3}\\.){3}\\d{1,3}|\\[[\\da-f]*:[\\da-f:]*\\])\\|)(p:[^\\|]+\\|){1})",
+}
+
+default_webentity_creation_rule = webentity_creation_rules_regexp["domain"]
+
+webentity_creation_rules = {
+    b"s:http|h:com|h:twitter|": webentity_creation_rules_regexp["path1"],
+}
+
+root_lru = "s:https|h:com|h:large_website|h:www|"
+
+BATCHES = 20
+PAGES_PER_BATCH = 100
+LINKS_PER_PAGE = 50
+
+voc = ["news", "blog", "archive", "tag", "author", "page", "section", "topic"]
+
+
+def random_lru():
+    path = ""
+
+    for _ in range(random.randint(1, 5)):
+        path += "p:%s%i|" % (random.choice(voc), random.randint(0, 30))
+
+    return root_lru + path
+
+
+random.seed(42)
+
+batches = []
+
+for _ in range(BATCHES):
+    batch_crawl = {}
+
+    for _ in range(PAGES_PER_BATCH):
+        batch_crawl[random_lru()] = [random_lru() for _ in range(LINKS_PER_PAGE)]
+
+    batches.append(batch_crawl)
+
+print(
+    "Indexing %i batches of %i pages with %i links each"
+    % (BATCHES, PAGES_PER_BATCH, LINKS_PER_PAGE)
+)
+
+reports = {}
+
+for sorted_batch in [False, True]:
+    traph = Traph(
+        overwrite=True,
+        folder="./scripts/data/",
+        default_webentity_creation_rule=default_webentity_creation_rule,
+        webentity_creation_rules=webentity_creation_rules,
+    )
+
+    start = time.time()
+
+    reports[sorted_batch] = [
+        traph.index_batch_crawl(batch_crawl, sorted_batch=sorted_batch).__dict__()
+        for batch_crawl in batches
+    ]
+
+    duration = time.time() - start
+
+    print(
+        "sorted_batch=%s: %s ms (%i pages, %i links)"
+        % (
+            sorted_batch,
+            format(1000 * duration, ",.0f"),
+            traph.count_pages(),
+            traph.link_store.count_links(),
+        )
+    )
+    print("  descent cache: %s" % traph.cache_metrics()["descent"])
+
+    traph.close()
+
+print("Identical reports: %s" % (reports[False] == reports[True]))
@@ -12,3 +12,5 @@ from test.suites.twitter_family_test import TestTwitterFamily
 from test.suites.creation_rules_test import TestCreationRules
 from test.suites.hugo_links_test import TestHugoLinks
 from test.suites.webentities_test import TestWebentities
+from test.suites.storage_test import TestStorage, TestCachedTraph
+from test.suites.bulk_loader_test import TestBulkLoader
@@ -0,0 +1,105 @@
+# =============================================================================
+# Bulk Loader Unit Tests
+# =============================================================================
+#
+# Testing the Traph bulk loader.
+#
+from os import path
+from test.test_cases import TraphTestCase, TraphTransaction
+from test.config import DEFAULT_WEBENTITY_CREATION_RULE, WEBENTITY_CREATION_RULES
+from traph import TraphException
+from traph.bulk_loader import bulk_load
+
+CRAWL = {
+    b"s:http|h:com|h:twitter|p:medialab|": [
+        b"s:https|h:com|h:twitter|p:paulanomalie|",
+        b"s:http|h:fr|h:sciences-po|h:medialab|p:people|",
+        b"s:http|h:fr|h:sciences-po|h:medialab|p:people|",
+    ],
+    b"s:http|h:fr|h:sciences-po|h:medialab|": [
+        b"s:http|h:fr|h:sciences-po|h:medialab|p:people|",
+        b"s:http|h:fr|h:sciences-po|h:medialab|p:" + b"tools" * 40 + b"|",
+        b"s:http|h:com|h:twitter|p:medialab|",
+    ],
+}
+
+
+class TestBulkLoader(TraphTestCase):
+    def bulk_load(self, pages, links=None, webentities=None):
+        return bulk_load(
+            path.join(self.folder, "bulk"),
+            pages,
+            links,
+            webentities,
+            default_webentity_creation_rule=DEFAULT_WEBENTITY_CREATION_RULE,
+            webentity_creation_rules=WEBENTITY_CREATION_RULES,
+        )
+
+    def test_bulk_load(self):
+        with self.open_traph() as traph:
+            traph.index_batch_crawl(CRAWL)
+
+            pages = sorted((lru, node.is_crawled()) for node, lru in traph.pages_iter())
+            links = [(source, target) for source in CRAWL for target in CRAWL[source]]
+            webentities = {}
+
+            for node, lru in traph.webentity_prefix_iter():
+                webentities.setdefault(node.webentity(), []).append(lru)
+
+            bulk_traph, report = self.bulk_load(pages, links, webentities)
+
+            with TraphTransaction(bulk_traph):
+                self.assertEqual(report.nb_created_pages, len(pages))
+                self.assertEqual(report.created_webentities, {})
+                self.assertSameTraphState(bulk_traph, traph)
+                self.assertEqual(bulk_traph.count_links(), traph.count_links())
+
+                # Sibling BSTs are balanced
+                self.assertEqual(bulk_traph.lru_trie.bst_metrics()["max_bst_ratio"], 1)
+
+                # Blocks are laid out in depth-first order
+                blocks = [node.block for node, _ in bulk_traph.lru_trie.dfs_iter()]
+                self.assertEqual(blocks, sorted(blocks))
+
+    def test_creation_rules(self):
+        with self.open_traph() as traph:
+            lrus = sorted({lru for lrus in CRAWL.values() for lru in lrus})
+            traph.add_pages(lrus)
+
+            bulk_traph, report = self.bulk_load([(lru, True) for lru in lrus])
+
+            with TraphTransaction(bulk_traph):
+                self.assertEqual(len(report.created_webentities), 3)
+                self.assertSameTraphState(bulk_traph, traph)
+
+                # The created prefixes are laid out along with the other nodes
+                self.assertEqual(bulk_traph.lru_trie.bst_metrics()["max_bst_ratio"], 1)
+
+                blocks = [node.block for node, _ in bulk_traph.lru_trie.dfs_iter()]
+                self.assertEqual(blocks, sorted(blocks))
+
+    def test_invalid_creation_rules(self):
+        with self.assertRaises(TraphException):
+            bulk_load(
+                path.join(self.folder, "bulk"),
+                [(b"s:http|h:fr|", False)],
+                default_webentity_creation_rule="s:http|",
+                webentity_creation_rules=WEBENTITY_CREATION_RULES,
+            )
+
+        self.assertFalse(path.exists(path.join(self.folder, "bulk")))
+
+    def test_debug(self):
+        bulk_traph, report = bulk_load(
+            path.join(self.folder, "bulk"),
+            [(b"s:http|h:fr|h:lemonde|", True)],
+            debug=True,
+        )
+
+        with TraphTransaction(bulk_traph):
+            self.assertEqual(report.created_webentities, {})
+            self.assertEqual(bulk_traph.count_pages(), 1)
+
+    def test_unsorted_pages(self):
+        with self.assertRaises(TraphException):
+            self.bulk_load([(b"s:http|h:fr|", False), (b"s:http|h:com|", False)])
@@ -18,6 +18,7 @@ from traph.helpers import (
     int_to_base4,
     base4_to_ops,
     ops_to_base4,
+    balance_bst,
 )
 
 
@@ -67,6 +68,16 @@ class TestHelpers(TestCase):
             [b"s:http|", b"h:fr|h:", b"science", b"s-po|h:", b"mediala", b"b|"],
         )
 
+    def test_balance_bst(self):
+        lefts = {}
+        rights = {}
+
+        self.assertEqual(balance_bst([1, 2, 3, 4, 5, 6, 7], lefts, rights), 4)
+        self.assertEqual(lefts, {4: 2, 2: 1, 6: 5})
+        self.assertEqual(rights, {4: 6, 2: 3, 6: 7})
+
+        self.assertEqual(balance_bst([], {}, {}, -1), -1)
+
     def test_base4_append(self):
         n = base4_int("13213")
 
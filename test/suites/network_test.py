@@ -177,7 +177,7 @@ class TestNetwork(TraphTestCase):
                     [
                         (b"s:http|h:com|h:world|p:africa|p:raba|", 3),
                         (b"s:http|h:com|h:world|p:africa|p:tunis|", 2),
-                        (b"s:http|h:com|h:world|p:africa|", 1),
+                        (b"s:http|h:com|h:world|p:africa|", 0),
                         (b"s:http|h:com|h:world|p:africa|p:bamako|", 1),
                     ]
                 ),
@@ -203,7 +203,7 @@ class TestNetwork(TraphTestCase):
 
             self.assertEqual(
                 set((page["lru"], page["indegree"]) for page in most_linked_pages),
-                set([(b"s:http|h:com|h:world|p:africa|", 1)]),
+                set([(b"s:http|h:com|h:world|p:africa|", 0)]),
             )
 
     def test_network_with_multiple_root_stems(self):
@@ -245,3 +245,25 @@ class TestNetwork(TraphTestCase):
                     ],
                 },
             )
+
+    def test_most_linked_pages_without_inlinks(self):
+        with self.open_traph(overwrite=True) as traph:
+            traph.index_batch_crawl(
+                {b"s:http|h:com|h:site|p:x|": [b"s:http|h:com|h:site|p:y|"]}
+            )
+
+        # The link store's header must never be read as a link stub
+        with self.open_traph() as traph:
+            weid = traph.retrieve_webentity(b"s:http|h:com|h:site|p:x|")
+
+            most_linked_pages = traph.get_webentity_most_linked_pages(weid)
+
+            self.assertEqual(
+                set((page["lru"], page["indegree"]) for page in most_linked_pages),
+                set(
+                    [
+                        (b"s:http|h:com|h:site|p:x|", 0),
+                        (b"s:http|h:com|h:site|p:y|", 1),
+                    ]
+                ),
+            )
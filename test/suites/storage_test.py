@@ -0,0 +1,544 @@
+# =============================================================================
+# Storage Unit Tests
+# =============================================================================
+#
+# Testing the storage backends.
+#
+import sys
+from os import path
+from tempfile import TemporaryFile
+from threading import Thread
+from unittest import TestCase
+from test.test_cases import TraphTestCase
+from traph.lru_trie.header import LRUTrieHeader
+from traph.lru_trie.node import (
+    LRUTrieNode,
+    LRU_TRIE_NODE_BLOCK_SIZE,
+    LRU_TRIE_NODE_FLAGS,
+)
+from traph.storage import (
+    FileStorage,
+    MemMapStorage,
+    MemoryStorage,
+    PositionalStorage,
+    SplitStorage,
+)
+from traph.traph import TraphException
+
+BLOCK_SIZE = 4
+
+# Long path stems shared by the tests below
+LONG_STEMS = (
+    b"p:thisisaveryveryveryverylooooooooooooooooongstem|"
+    b"p:thisalsoisquitethelongstemisntitnotsomuchtobehonest|"
+)
+
+
+def blocks(*chars):
+    return [(c * BLOCK_SIZE).encode() for c in chars]
+
+
+class TestStorage(TestCase):
+    def test_block_cache(self):
+        with TemporaryFile() as f:
+            storage = FileStorage(BLOCK_SIZE, f, cache_size=2 * BLOCK_SIZE)
+            a, b, c, d = blocks("a", "b", "c", "d")
+
+            self.assertEqual(storage.write(a), 0)
+            self.assertEqual(storage.write(b), 4)
+            self.assertEqual(storage.write(c), 8)
+
+            # Only the last two blocks should remain cached
+            self.assertEqual(storage.read(8), c)
+            self.assertEqual(storage.read(4), b)
+            self.assertEqual(storage.read(0), a)
+
+            metrics = storage.cache_metrics()
+            self.assertEqual(metrics["hits"], 2)
+            self.assertEqual(metrics["misses"], 1)
+            self.assertEqual(metrics["nb_blocks"], 2)
+
+            # Writes must keep the cache coherent
+            storage.write(d, 4)
+            self.assertEqual(storage.read(4), d)
+            self.assertEqual(storage.read(12), None)
+
+            # Reading without a block should follow the last read one
+            storage.read(0)
+            self.assertEqual(storage.read(), d)
+
+    def test_append_buffer(self):
+        with TemporaryFile() as f:
+            storage = FileStorage(BLOCK_SIZE, f, buffer_size=3 * BLOCK_SIZE)
+            a, b, c, d = blocks("a", "b", "c", "d")
+
+            self.assertEqual(storage.write(a), 0)
+            self.assertEqual(storage.write(b), 4)
+            self.assertEqual(len(storage), 8)
+
+            # Nothing should have reached the file yet
+            f.seek(0)
+            self.assertEqual(f.read(), b"")
+
+            # Updates should be applied in the buffer
+            storage.write(d, 0)
+            self.assertEqual(storage.read(0), d)
+
+            # A full buffer should be flushed in one go
+            self.assertEqual(storage.write(c), 8)
+            f.seek(0)
+            self.assertEqual(f.read(), d + b + c)
+
+            self.assertEqual(storage.write(a), 12)
+            self.assertEqual(storage.read(12), a)
+            self.assertEqual(storage.read(16), None)
+
+            storage.write(b, 4)
+            storage.flush()
+            f.seek(0)
+            self.assertEqual(f.read(), d + b + c + a)
+
+    def test_writable_memmap(self):
+        with TemporaryFile() as f:
+            storage = MemMapStorage(BLOCK_SIZE, f, writable=True, extent=BLOCK_SIZE)
+            a, b, c = blocks("a", "b", "c")
+
+            self.assertEqual(len(storage), 0)
+            self.assertEqual(storage.read(0), None)
+
+            # The map should grow when needed
+            self.assertEqual(storage.write(a), 0)
+            self.assertEqual(storage.write(b), 4)
+            self.assertEqual(storage.write(c), 8)
+            self.assertEqual(storage.read(4), b)
+            self.assertEqual(storage.read(), c)
+            self.assertEqual(storage.read(12), None)
+
+            storage.write(c, 0)
+            self.assertEqual(storage.read(0), c)
+            storage.close()
+
+            f.seek(0)
+            self.assertEqual(f.read(), c + b + c)
+
+            # Trailing null blocks left by a crash should be ignored
+            f.write(b"\0" * 3 * BLOCK_SIZE)
+            f.flush()
+
+            storage = MemMapStorage(BLOCK_SIZE, f, writable=True, extent=BLOCK_SIZE)
+            self.assertEqual(len(storage), 12)
+            self.assertEqual(storage.write(a), 12)
+            storage.close()
+
+            f.seek(0)
+            self.assertEqual(f.read(), c + b + c + a)
+
+    def test_iter_blocks(self):
+        data = blocks("a", "b", "c", "d", "e")
+
+        def assertBlocks(storage, start=0):
+            for chunk_bytes in [1, BLOCK_SIZE, 2 * BLOCK_SIZE + 1, 1024]:
+                self.assertEqual(
+                    [
+                        (block, bytes(d))
+                        for block, d in storage.iter_blocks(start, chunk_bytes)
+                    ],
+                    [(i * BLOCK_SIZE, d) for i, d in enumerate(data)][
+                        start // BLOCK_SIZE :
+                    ],
+                )
+
+        memory_storage = MemoryStorage(BLOCK_SIZE)
+
+        for d in data:
+            memory_storage.write(d)
+
+        assertBlocks(memory_storage)
+        assertBlocks(memory_storage, 2 * BLOCK_SIZE)
+
+        with TemporaryFile() as f:
+            storage = FileStorage(BLOCK_SIZE, f, buffer_size=3 * BLOCK_SIZE)
+
+            # Some blocks are on file and some still in the buffer
+            for d in data:
+                storage.write(d)
+
+            assertBlocks(storage)
+            assertBlocks(storage, 4 * BLOCK_SIZE)
+
+            storage.flush()
+            assertBlocks(PositionalStorage(BLOCK_SIZE, f), BLOCK_SIZE)
+
+            storage = MemMapStorage(BLOCK_SIZE, f, writable=True)
+            assertBlocks(storage)
+            storage.close()
+
+        with TemporaryFile() as f, TemporaryFile() as g:
+            storage = SplitStorage(BLOCK_SIZE, 1, f, g)
+
+            for d in data:
+                storage.write(d)
+
+            assertBlocks(storage)
+            assertBlocks(storage, 3 * BLOCK_SIZE)
+
+            self.assertEqual(
+                [(block, bytes(d)) for block, d in storage.iter_registers()],
+                [(i * BLOCK_SIZE, b"\0" + d[1:]) for i, d in enumerate(data)],
+            )
+
+    def test_write_at(self):
+        a, b = blocks("a", "b")
+
+        def assertWriteAt(storage):
+            storage.write(a)
+            storage.write(b)
+            storage.write_at(5, b"xy")
+
+            self.assertEqual(storage.read(0), a)
+            self.assertEqual(storage.read(4), b"bxyb")
+
+        assertWriteAt(MemoryStorage(BLOCK_SIZE))
+
+        with TemporaryFile() as f:
+            assertWriteAt(FileStorage(BLOCK_SIZE, f, cache_size=2 * BLOCK_SIZE))
+
+        with TemporaryFile() as f:
+            assertWriteAt(FileStorage(BLOCK_SIZE, f, buffer_size=3 * BLOCK_SIZE))
+
+        with TemporaryFile() as f:
+            assertWriteAt(PositionalStorage(BLOCK_SIZE, f))
+
+        with TemporaryFile() as f, TemporaryFile() as g:
+            assertWriteAt(SplitStorage(BLOCK_SIZE, 2, f, g))
+
+        with TemporaryFile() as f:
+            storage = MemMapStorage(BLOCK_SIZE, f, writable=True)
+            assertWriteAt(storage)
+            storage.close()
+
+    def test_partial_node_writes(self):
+        storage = MemoryStorage(LRU_TRIE_NODE_BLOCK_SIZE)
+        LRUTrieHeader(storage)
+
+        node = LRUTrieNode(storage, stem=b"s:http|")
+        node.write()
+
+        other = LRUTrieNode(storage, stem=b"h:com|")
+        other.write()
+
+        # Two objects updating different registers of the same block
+        first = LRUTrieNode(storage, block=node.block)
+        second = LRUTrieNode(storage, block=node.block)
+
+        first.set_child(other.block)
+        first.flag_as_page()
+        second.set_webentity(4)
+
+        first.write()
+        second.write()
+
+        node.refresh()
+        self.assertEqual(node.stem(), b"s:http|")
+        self.assertEqual(node.child(), other.block)
+        self.assertTrue(node.is_page())
+        self.assertEqual(node.webentity(), 4)
+        self.assertEqual(len(storage), 3 * LRU_TRIE_NODE_BLOCK_SIZE)
+
+
+class TestCachedTraph(TraphTestCase):
+    def test_cached_traph(self):
+        lrus = [
+            b"s:http|h:fr|h:sciences-po|h:medialab|",
+            b"s:http|h:fr|h:sciences-po|h:medialab|p:people|",
+            b"s:http|h:fr|h:sciences-po|" + LONG_STEMS,
+        ]
+
+        with self.open_traph(cache_size=4096) as traph:
+            traph.index_batch_crawl({lrus[0]: lrus[1:]})
+
+            self.assertEqual(set(lru for _, lru in traph.pages_iter()), set(lrus))
+            self.assertEqual(traph.count_links(), 2)
+
+            metrics = traph.cache_metrics()
+            self.assertTrue(metrics["lru_trie"]["hits"] > 0)
+
+        # Data should have reached the disk
+        self.assertTrue(path.getsize(path.join(self.folder, "lru_trie.dat")) > 0)
+
+        with self.open_traph() as traph:
+            self.assertEqual(set(lru for _, lru in traph.pages_iter()), set(lrus))
+
+    def test_buffered_traph(self):
+        lrus = [
+            b"s:http|h:fr|h:sciences-po|h:medialab|",
+            b"s:http|h:fr|h:sciences-po|h:medialab|p:people|",
+            b"s:http|h:com|h:twitter|p:medialab_scpo|",
+        ]
+
+        with self.open_traph(buffer_size=1 << 20) as traph:
+            traph.index_batch_crawl({lrus[0]: lrus[1:]})
+
+            self.assertEqual(traph.count_pages(), 3)
+            self.assertEqual(traph.count_links(), 2)
+
+            traph.flush()
+
+            self.assertEqual(
+                path.getsize(path.join(self.folder, "lru_trie.dat")),
+                len(traph.lru_trie_storage),
+            )
+
+            traph.add_page(b"s:http|h:fr|h:sciences-po|h:medialab|p:projects|")
+
+        # Closing should flush the pending blocks
+        with self.open_traph() as traph:
+            self.assertEqual(traph.count_pages(), 4)
+            self.assertEqual(traph.count_links(), 2)
+
+    def test_memmap_traph(self):
+        lrus = [
+            b"s:http|h:fr|h:sciences-po|h:medialab|",
+            b"s:http|h:fr|h:sciences-po|h:medialab|p:people|",
+            b"s:http|h:fr|h:sciences-po|" + LONG_STEMS,
+        ]
+
+        with self.open_traph(storage="mmap") as traph:
+            traph.index_batch_crawl({lrus[0]: lrus[1:]})
+
+            self.assertEqual(set(lru for _, lru in traph.pages_iter()), set(lrus))
+            self.assertEqual(traph.count_links(), 2)
+            length = len(traph.lru_trie_storage)
+
+        # The files should have been trimmed to their real size
+        self.assertEqual(path.getsize(path.join(self.folder, "lru_trie.dat")), length)
+
+        with self.open_traph() as traph:
+            self.assertEqual(set(lru for _, lru in traph.pages_iter()), set(lrus))
+
+        with self.open_traph(storage="mmap") as traph:
+            traph.clear()
+            self.assertEqual(traph.count_pages(), 0)
+
+            traph.add_page(lrus[0])
+            self.assertEqual(traph.count_pages(), 1)
+
+    def test_memmap_traph_not_closed(self):
+        lrus = [
+            b"s:http|h:fr|h:sciences-po|h:medialab|",
+            b"s:http|h:fr|h:sciences-po|h:medialab|p:people|",
+            b"s:http|h:fr|h:sciences-po|h:medialab|p:tools|",
+        ]
+
+        with self.open_traph(storage="mmap") as traph:
+            traph.index_batch_crawl({lrus[0]: lrus[1:2]})
+            nb_blocks = traph.lru_trie_storage.count_blocks()
+
+        # Leaving the files as if the process had died without closing them
+        for name in ["lru_trie.dat", "link_store.dat"]:
+            with open(path.join(self.folder, name), "ab") as f:
+                f.write(bytes(LRU_TRIE_NODE_BLOCK_SIZE * 16))
+
+        with self.open_traph() as traph:
+            self.assertEqual(traph.lru_trie_storage.count_blocks(), nb_blocks)
+            self.assertEqual(traph.count_links(), 1)
+
+            # New blocks are written right after the actual ones
+            traph.add_page(lrus[2])
+
+            self.assertEqual(
+                traph.lru_trie.lru_node(lrus[2]).block,
+                nb_blocks * LRU_TRIE_NODE_BLOCK_SIZE,
+            )
+            self.assertEqual(set(lru for _, lru in traph.pages_iter()), set(lrus))
+
+    def test_positional_traph(self):
+        lrus = [
+            b"s:http|h:fr|h:sciences-po|h:medialab|p:page%i|" % i for i in range(50)
+        ]
+        lrus.append(b"s:http|h:fr|h:sciences-po|h:medialab|" + LONG_STEMS)
+
+        with self.open_traph(storage="pread") as traph:
+            traph.index_batch_crawl({lrus[0]: lrus[1:]})
+
+            prefixes = [b"s:http|h:fr|h:sciences-po|"]
+            expected = traph.get_webentity_pages(1, prefixes)
+            results = []
+
+            def read():
+                for _ in range(10):
+                    results.append(traph.get_webentity_pages(1, prefixes))
+
+            threads = [Thread(target=read) for _ in range(4)]
+
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(len(expected), len(lrus))
+            self.assertEqual(len(results), 40)
+
+            for result in results:
+                self.assertEqual(result, expected)
+
+        with self.open_traph() as traph:
+            self.assertEqual(set(lru for _, lru in traph.pages_iter()), set(lrus))
+
+    def test_positional_traph_concurrent_readers(self):
+        lrus = [
+            b"s:http|h:com|h:site%i|p:page%i|p:sub%i|" % (i % 20, i, i % 7)
+            for i in range(1000)
+        ]
+
+        # Tiny caches so that readers keep evicting each other's entries
+        options = {
+            "storage": "pread",
+            "descent_cache_size": 4,
+            "windup_cache_size": 1024,
+            "webentity_cache_size": 4,
+        }
+
+        with self.open_traph(**options) as traph:
+            traph.index_batch_crawl({lrus[i]: [lrus[i + 1]] for i in range(0, 1000, 2)})
+
+            expected = {
+                lru: (
+                    traph.lru_trie.lru_node(lru).block,
+                    traph.retrieve_webentity(lru),
+                    traph.get_page_links(lru),
+                )
+                for lru in lrus
+            }
+
+            errors = []
+            results = []
+
+            def read(offset):
+                try:
+                    for lru in lrus[offset:] + lrus[:offset]:
+                        results.append(
+                            expected[lru]
+                            == (
+                                traph.lru_trie.lru_node(lru).block,
+                                traph.retrieve_webentity(lru),
+                                traph.get_page_links(lru),
+                            )
+                        )
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [Thread(target=read, args=(i * 125,)) for i in range(8)]
+            switch_interval = sys.getswitchinterval()
+            sys.setswitchinterval(1e-6)
+
+            try:
+                for thread in threads:
+                    thread.start()
+
+                for thread in threads:
+                    thread.join()
+            finally:
+                sys.setswitchinterval(switch_interval)
+
+            self.assertEqual(errors, [])
+            self.assertEqual(len(results), 8 * len(lrus))
+            self.assertTrue(all(results))
+
+    def test_split_traph(self):
+        lrus = [
+            b"s:http|h:fr|h:sciences-po|h:medialab|p:page%i|" % i for i in range(50)
+        ]
+        lrus.append(b"s:http|h:fr|h:sciences-po|h:medialab|" + LONG_STEMS)
+
+        with self.open_traph(storage="split") as traph:
+            traph.index_batch_crawl({lrus[0]: lrus[1:]})
+
+            expected = traph.get_webentity_pages(1, [b"s:http|h:fr|h:sciences-po|"])
+
+            self.assertEqual(traph.count_pages(), len(lrus))
+
+        self.assertTrue(path.isfile(path.join(self.folder, "lru_trie.stems.dat")))
+
+        # Split Traphs cannot be opened by other storages
+        with self.assertRaises(TraphException):
+            self.get_traph()
+
+        with self.open_traph(storage="split") as traph:
+            self.assertEqual(set(lru for _, lru in traph.pages_iter()), set(lrus))
+            self.assertEqual(
+                traph.get_webentity_pages(1, [b"s:http|h:fr|h:sciences-po|"]),
+                expected,
+            )
+
+    def test_memory_traph_long_stems(self):
+        lru = b"s:http|h:fr|h:sciences-po|" + LONG_STEMS
+
+        with self.open_traph(folder=None) as traph:
+            traph.add_page(lru)
+
+            self.assertEqual([lru for _, lru in traph.pages_iter()], [lru])
+
+    def test_node_views(self):
+        lru = b"s:http|h:fr|h:sciences-po|" + LONG_STEMS
+        other_lru = b"s:http|h:fr|h:sciences-po|h:medialab|"
+
+        for storage in ["file", "mmap", "pread", None]:
+            folder = self.folder if storage else None
+            options = {"storage": storage} if storage else {}
+
+            with self.open_traph(folder=folder, overwrite=True, **options) as traph:
+                traph.index_batch_crawl({lru: [other_lru]})
+
+                for node, _ in traph.lru_trie.dfs_iter():
+                    view = traph.lru_trie.node_view(block=node.block)
+                    node = traph.lru_trie.node(block=node.block)
+
+                    self.assertTrue(view.exists)
+                    self.assertEqual(view.stem(), node.stem())
+                    self.assertEqual(view.flags(), node.data[LRU_TRIE_NODE_FLAGS])
+                    self.assertEqual(view.webentity(), node.webentity())
+                    self.assertEqual(view.left(), node.left())
+                    self.assertEqual(view.right(), node.right())
+                    self.assertEqual(view.child(), node.child())
+                    self.assertEqual(view.parent(), node.parent())
+                    self.assertEqual(view.outlinks(), node.outlinks())
+                    self.assertEqual(view.inlinks(), node.inlinks())
+
+                page = traph.lru_trie.lru_node(lru)
+                links = traph.link_store.node_view(block=page.outlinks())
+                self.assertEqual(
+                    links.target(), traph.lru_trie.lru_node(other_lru).block
+                )
+                self.assertEqual(links.previous(), None)
+
+                view = traph.lru_trie.node_view(block=1 << 40)
+                self.assertFalse(view.exists)
+                self.assertEqual(view.webentity(), None)
+                self.assertEqual(view.stem(), b"")
+
+    def test_skipped_writes(self):
+        lrus = [
+            b"s:http|h:fr|h:sciences-po|h:medialab|",
+            b"s:http|h:fr|h:sciences-po|h:medialab|p:people|",
+            b"s:http|h:com|h:twitter|p:medialab_scpo|",
+        ]
+
+        with self.open_traph() as traph:
+            traph.index_batch_crawl({lrus[0]: lrus[1:]})
+            traph.add_pages(lrus, crawled=True)
+
+            before = traph.write_metrics()["lru_trie"]
+            length = len(traph.lru_trie_storage)
+
+            # Recrawling the same pages should not write anything
+            traph.add_pages(lrus, crawled=True)
+            traph.add_page(lrus[1])
+
+            after = traph.write_metrics()["lru_trie"]
+
+            self.assertEqual(after["writes"], before["writes"])
+            self.assertEqual(after["partial_writes"], before["partial_writes"])
+            self.assertEqual(after["skipped_writes"], before["skipped_writes"] + 3)
+            self.assertEqual(len(traph.lru_trie_storage), length)
@@ -5,8 +5,10 @@
 #
 # Testing the Traph class itself.
 #
-from test.test_cases import TraphTestCase
+from os import path
+from test.test_cases import TraphTestCase, TraphTransaction
 from traph.traph import TraphException
+from traph.format_v2 import export_v2, load_v2
 
 
 class TestTraph(TraphTestCase):
@@ -264,6 +266,182 @@ class TestTraph(TraphTestCase):
                 ),
             )
 
+    def test_very_long_stems(self):
+        prefix = b"s:http|h:fr|h:sciences-po|"
+        query = b"q:" + b"verylongquerystring" * 12
+        stems = [query + b"|", query + b"a|", query + b"b|", query[:100] + b"|"]
+        lrus = [prefix + stem for stem in stems]
+
+        with self.open_traph() as traph:
+            for lru in lrus:
+                traph.add_page(lru)
+
+            # Adding the pages again should not create anything
+            for lru in lrus:
+                report = traph.add_page(lru)
+                self.assertEqual(report.nb_created_pages, 0)
+
+            self.assertEqual(set(lru for _, lru in traph.pages_iter()), set(lrus))
+
+            for lru in lrus:
+                node = traph.lru_trie.lru_node(lru)
+
+                # The tail should only be read when needed
+                self.assertEqual(node.tail, None)
+
+                stem = lru[len(prefix) :]
+                self.assertEqual(node.compare_stem(stem), 0)
+                self.assertEqual(node.compare_stem(stem[:-1]), 1)
+                self.assertEqual(node.compare_stem(stem + b"a"), -1)
+                self.assertEqual(node.compare_stem(b"q:z"), -1)
+                self.assertEqual(node.stem(), stem)
+
+    def test_descent_cache(self):
+        prefix = b"s:http|h:com|h:example|"
+        lrus = [prefix + b"p:%i|" % i for i in range(10)]
+
+        with self.open_traph() as traph:
+            for lru in lrus:
+                traph.add_page(lru)
+
+            metrics = traph.cache_metrics()["descent"]
+            self.assertTrue(metrics["hits"] >= len(lrus) - 1)
+
+            node, history = traph.lru_trie.follow_lru(lrus[3])
+            self.assertEqual(node.stem(), b"p:3|")
+            self.assertEqual(history.webentity_prefix, prefix)
+
+            # Creating a webentity below a cached prefix must invalidate it
+            report = traph.create_webentity([lrus[3]])
+            weid = list(report.created_webentities.keys())[0]
+
+            _, history = traph.lru_trie.follow_lru(lrus[3])
+            self.assertEqual(history.webentity, weid)
+            self.assertEqual(history.webentity_prefix, lrus[3])
+
+            traph.delete_webentity(weid, [lrus[3]])
+
+            _, history = traph.lru_trie.follow_lru(lrus[3])
+            self.assertEqual(history.webentity_prefix, prefix)
+
+            self.assertEqual(traph.lru_trie.lru_node(prefix + b"p:unknown|"), None)
+
+    def test_windup_cache(self):
+        prefix = b"s:http|h:com|h:example|"
+        lrus = [prefix + b"p:%i|" % i for i in range(10)]
+        lrus.append(prefix + b"p:0|p:deeper|")
+
+        with self.open_traph(windup_cache_size=0) as traph:
+            for lru in lrus:
+                traph.add_page(lru)
+
+            self.assertEqual(traph.cache_metrics()["windup"], None)
+
+            uncached = [
+                traph.lru_trie.windup_lru(traph.lru_trie.lru_node(lru).block)
+                for lru in lrus
+            ]
+
+        self.assertEqual(uncached, lrus)
+
+        with self.open_traph(windup_cache_size=1024) as traph:
+            for lru in lrus:
+                traph.add_page(lru)
+
+            for _ in range(2):
+                for lru in lrus:
+                    block = traph.lru_trie.lru_node(lru).block
+                    self.assertEqual(traph.lru_trie.windup_lru(block), lru)
+
+            metrics = traph.cache_metrics()["windup"]
+            self.assertTrue(metrics["hits"] >= 2 * len(lrus) - 2)
+            self.assertTrue(metrics["size"] <= 1024)
+
+            # A tiny budget evicts entries but keeps windups exact
+            traph.lru_trie.windup_cache.budget = 0
+            traph.lru_trie.windup_cache.clear()
+
+            for lru in lrus:
+                block = traph.lru_trie.lru_node(lru).block
+                self.assertEqual(traph.lru_trie.windup_lru(block), lru)
+
+            self.assertEqual(len(traph.lru_trie.windup_cache), 0)
+
+    def test_webentity_cache(self):
+        prefix = b"s:http|h:com|h:example|"
+        section = prefix + b"p:section|"
+        lrus = [section + b"p:%i|" % i for i in range(5)]
+
+        with self.open_traph() as traph:
+            for lru in lrus:
+                traph.add_page(lru)
+
+            def webentities():
+                return [
+                    traph.lru_trie.windup_lru_for_webentity(
+                        traph.lru_trie.lru_node(lru)
+                    )
+                    for lru in lrus
+                ]
+
+            weid = traph.lru_trie.lru_node(prefix).webentity()
+            self.assertEqual(webentities(), [weid] * len(lrus))
+            self.assertEqual(webentities(), [weid] * len(lrus))
+
+            metrics = traph.cache_metrics()["webentity"]
+            self.assertTrue(metrics["hits"] >= len(lrus))
+
+            # Entries must be invalidated when prefixes change
+            traph.add_prefix_to_webentity(section, 999)
+            self.assertEqual(webentities(), [999] * len(lrus))
+
+            traph.remove_prefix_from_webentity(section)
+            self.assertEqual(webentities(), [weid] * len(lrus))
+
+            traph.add_prefix_to_webentity(section, 999)
+            traph.delete_webentity(999, [section])
+            self.assertEqual(webentities(), [weid] * len(lrus))
+
+    def test_sorted_batch(self):
+        data = {
+            b"s:http|h:com|h:twitter|p:medialab|": [
+                b"s:https|h:com|h:twitter|p:paulanomalie|",
+                b"s:http|h:com|h:twitter|p:medialab|p:status|",
+                b"s:http|h:fr|h:sciences-po|h:medialab|p:people|",
+            ],
+            b"s:http|h:fr|h:sciences-po|h:medialab|": [
+                b"s:http|h:fr|h:sciences-po|h:medialab|p:people|",
+                b"s:http|h:fr|h:sciences-po|h:medialab|p:tools|",
+                b"s:http|h:com|h:twitter|p:medialab|",
+                b"s:http|h:com|h:linkedin|p:company|p:medialab|",
+            ],
+            b"s:http|h:fr|h:sciences-po|h:medialab|p:tools|": [
+                b"s:http|h:fr|h:sciences-po|h:medialab|",
+            ],
+        }
+
+        pages = [
+            b"s:http|h:fr|h:sciences-po|h:medialab|p:tools|",
+            b"s:http|h:fr|h:lemonde|p:article|",
+            b"s:http|h:fr|h:lemonde|",
+            b"s:http|h:fr|h:lemonde|p:article|",
+        ]
+
+        with self.open_traph() as traph:
+            sorted_folder = path.join(self.folder, "sorted")
+
+            with self.open_traph(folder=sorted_folder) as sorted_traph:
+                report = traph.index_batch_crawl(data)
+                sorted_report = sorted_traph.index_batch_crawl(data, sorted_batch=True)
+
+                self.assertEqual(report.__dict__(), sorted_report.__dict__())
+
+                report = traph.add_pages(pages)
+                sorted_report = sorted_traph.add_pages(pages, sorted_batch=True)
+
+                self.assertEqual(report.__dict__(), sorted_report.__dict__())
+                self.assertSameTraphState(traph, sorted_traph)
+
     def test_get_webentity_child_webentities(self):
         with self.open_traph() as traph:
             lru_trie = traph.lru_trie
@@ -386,3 +564,277 @@ class TestTraph(TraphTestCase):
             traph.clear()
 
             self.assertEqual(traph.count_pages(), 0)
+
+    def test_counters(self):
+        prefix = b"s:http|h:com|h:example|"
+        long_page = prefix + b"p:" + b"a" * 200 + b"|"
+
+        with self.open_traph() as traph:
+            traph.add_page(prefix + b"p:1|")
+            traph.add_page(long_page)
+            traph.index_batch_crawl(
+                {prefix + b"p:2|": [prefix + b"p:1|", prefix + b"p:3|"]}
+            )
+            traph.add_links([(prefix + b"p:1|", prefix + b"p:3|")] * 2)
+            traph.add_prefix_to_webentity(prefix + b"p:1|", 999)
+            traph.remove_prefix_from_webentity(prefix + b"p:1|")
+
+            counters = traph.counters()
+            metrics = traph.lru_trie.metrics()
+
+            self.assertEqual(counters["nb_pages"], 4)
+            self.assertEqual(counters["nb_crawled_pages"], 1)
+            self.assertEqual(counters["nb_nodes"], metrics["nb_nodes"])
+            self.assertEqual(counters["nb_tail_nodes"], metrics["nb_tail_nodes"])
+            self.assertTrue(counters["nb_tail_nodes"] > 0)
+            self.assertEqual(
+                counters["nb_webentity_prefixes"],
+                sum(1 for _ in traph.lru_trie.webentity_prefix_iter()),
+            )
+            self.assertEqual(counters["nb_links"], 4)
+
+        # Cleanly closed files can be trusted
+        with self.open_traph() as traph:
+            self.assertTrue(traph.lru_trie.exact_counters)
+            self.assertEqual(traph.counters(), counters)
+
+            # While a Traph is open, its counters are flagged as not exact
+            with self.open_traph() as other_traph:
+                self.assertFalse(other_traph.lru_trie.exact_counters)
+                self.assertEqual(other_traph.counters(), counters)
+
+                self.assertEqual(other_traph.rebuild_counters(), counters)
+                self.assertTrue(other_traph.lru_trie.exact_counters)
+
+    def test_subtree_counters(self):
+        prefix = b"s:http|h:fr|h:sciences-po|h:medialab|"
+        nested_prefix = prefix + b"p:tools|"
+        lrus = [prefix + b"p:%s|" % stem for stem in [b"a", b"z", b"m", b"b", b"y"]]
+
+        with self.open_traph(subtree_counters=True) as traph:
+            traph.add_pages(lrus[:3], crawled=True)
+            traph.add_page(lrus[3])
+            traph.add_page(lrus[4])
+            traph.add_page(nested_prefix + b"p:hammer|")
+            traph.add_prefix_to_webentity(nested_prefix, 999)
+            traph.index_batch_crawl({lrus[3]: [prefix]})
+            traph.rebalance(max_ratio=1.0)
+
+            expected = traph.paginate_webentity_pages(1, [prefix])
+
+            self.assertEqual(
+                traph.count_webentity_pages(1, [prefix]),
+                {"count": expected["count"], "count_crawled": 4},
+            )
+
+            for offset in range(expected["count"] + 1):
+                pages = traph.paginate_webentity_pages(
+                    1, [prefix], page_count=2, offset=offset
+                )
+
+                self.assertEqual(pages["pages"], expected["pages"][offset : offset + 2])
+
+            crawled_pages = traph.paginate_webentity_pages(
+                1, [prefix], offset=3, crawled_only=True
+            )
+
+            self.assertEqual(crawled_pages["count"], 1)
+
+        # The setting is kept & the counters are reused once reopened
+        with self.open_traph() as traph:
+            self.assertIsNotNone(traph.lru_trie.subtree_counters)
+            self.assertEqual(
+                traph.count_webentity_pages(1, [prefix])["count"], expected["count"]
+            )
+
+    def test_prefix_index(self):
+        medialab = b"s:http|h:fr|h:sciences-po|h:medialab|"
+        lemonde = b"s:http|h:fr|h:lemonde|"
+
+        with self.open_traph() as traph:
+            traph.add_page(medialab + b"p:people|")
+            traph.add_page(lemonde)
+            traph.add_prefix_to_webentity(lemonde + b"p:blogs|", 999)
+            traph.move_prefix_to_webentity(lemonde + b"p:blogs|", 1, 999)
+
+            webentities = traph.get_webentities()
+            expected = {}
+
+            for node, prefix in traph.webentity_prefix_iter():
+                expected.setdefault(node.webentity(), set()).add(prefix)
+
+            self.assertEqual(
+                {weid: set(prefixes) for weid, prefixes in webentities.items()},
+                expected,
+            )
+            self.assertIn(lemonde + b"p:blogs|", webentities[1])
+            self.assertIn(lemonde, webentities[2])
+            self.assertNotIn(999, webentities)
+
+            # The webentity's prefixes can be omitted
+            self.assertEqual(
+                traph.get_webentity_pages(1),
+                traph.get_webentity_pages(1, webentities[1]),
+            )
+
+            traph.delete_webentity(2)
+
+            with self.assertRaises(TraphException):
+                traph.get_webentity_prefixes(2)
+
+        # The index is read back as is once cleanly closed
+        with self.open_traph() as traph:
+            self.assertEqual(traph.get_webentities(), {1: webentities[1]})
+
+            # While a Traph is open, its index is rebuilt from the trie
+            with self.open_traph() as other_traph:
+                index = other_traph.lru_trie.prefix_index
+
+                self.assertEqual(index.nb_records, len(webentities[1]))
+                self.assertEqual(
+                    {weid: set(blocks) for weid, blocks in index.prefixes.items()},
+                    {1: {traph.lru_trie.lru_node(p).block for p in webentities[1]}},
+                )
+
+    def test_compact(self):
+        data = {
+            b"s:http|h:fr|h:sciences-po|h:medialab|": [
+                b"s:http|h:fr|h:sciences-po|h:medialab|p:people|",
+                b"s:http|h:fr|h:sciences-po|h:medialab|p:" + b"tools" * 40 + b"|",
+                b"s:http|h:com|h:twitter|p:medialab|",
+                b"s:http|h:com|h:twitter|p:medialab|",
+            ],
+            b"s:http|h:fr|h:sciences-po|h:medialab|p:people|": [
+                b"s:http|h:fr|h:sciences-po|h:medialab|",
+                b"s:http|h:fr|h:lemonde|p:article|",
+            ],
+            b"s:http|h:com|h:twitter|p:medialab|": [
+                b"s:http|h:fr|h:sciences-po|h:medialab|p:people|",
+            ],
+        }
+
+        prefixes = [
+            b"s:http|h:fr|h:sciences-po|h:medialab|",
+            b"s:https|h:fr|h:sciences-po|h:medialab|",
+        ]
+
+        def read_extra_state(traph):
+            return (
+                traph.get_webentity_pagelinks(
+                    1, prefixes, include_inbound=True, include_outbound=True
+                ),
+                traph.lru_trie.bst_metrics(),
+            )
+
+        with self.open_traph() as traph:
+            traph.create_webentity(prefixes)
+
+            for lru in data:
+                traph.index_batch_crawl({lru: data[lru]})
+
+            compacted_folder = path.join(self.folder, "compacted")
+
+            with TraphTransaction(traph.compact(compacted_folder)) as compacted_traph:
+                self.assertSameTraphState(
+                    compacted_traph, traph, extra=read_extra_state
+                )
+
+                # Nodes are laid out in depth-first order, tails included
+                blocks = [node.block for node, _ in compacted_traph.lru_trie.dfs_iter()]
+                self.assertEqual(blocks, sorted(blocks))
+                self.assertTrue(
+                    compacted_traph.lru_trie_storage.count_blocks()
+                    <= traph.lru_trie_storage.count_blocks()
+                )
+
+            # Compacting into an existing Traph is not possible
+            with self.assertRaises(TraphException):
+                traph.compact(compacted_folder)
+
+    def test_rebalance(self):
+        lrus = [b"s:http|h:fr|h:sciences-po|p:%03d|" % i for i in range(100)]
+
+        with self.open_traph() as traph:
+            # Sorted insertions degenerate the BST of the paths into a list
+            for lru in lrus:
+                traph.add_page(lru)
+
+            traph.add_links([(lrus[0], lrus[-1]), (lrus[-1], lrus[50])])
+
+            self.assertEqual(traph.lru_trie.bst_metrics()["max_bst_height"], 100)
+
+            pages = sorted(lru for _, lru in traph.pages_iter())
+            links = traph.get_webentities_links()
+
+            report = traph.rebalance()
+
+            self.assertEqual(report["nb_rebalanced_bst"], 1)
+            self.assertEqual(traph.lru_trie.bst_metrics()["max_bst_height"], 7)
+            self.assertEqual(sorted(lru for _, lru in traph.pages_iter()), pages)
+            self.assertEqual(traph.get_webentities_links(), links)
+
+            for lru in lrus:
+                self.assertIsNotNone(traph.lru_trie.lru_node(lru))
+
+            # Balanced BSTs are left untouched
+            report = traph.rebalance()
+
+            self.assertEqual(report["nb_rebalanced_bst"], 0)
+
+    def test_v2_format(self):
+        for subtree_counters in [False, True]:
+            self.tearDown()
+
+            with self.subTest(subtree_counters=subtree_counters):
+                self.check_v2_format(subtree_counters)
+
+    def check_v2_format(self, subtree_counters):
+        data = {
+            b"s:http|h:com|h:twitter|p:medialab|": [
+                b"s:http|h:fr|h:sciences-po|h:medialab|p:people|",
+                b"s:http|h:fr|h:sciences-po|h:medialab|p:" + b"tools" * 40 + b"|",
+            ],
+        }
+
+        def read_nodes(traph):
+            return [(lru, node.webentity()) for node, lru in traph.lru_trie.dfs_iter()]
+
+        with self.open_traph(subtree_counters=subtree_counters) as traph:
+            traph.index_batch_crawl(data)
+            traph.flush()
+
+            export_v2(traph, path.join(self.folder, "v2"))
+
+            self.assertTrue(
+                path.getsize(path.join(self.folder, "v2", "lru_trie.v2.dat"))
+                < path.getsize(path.join(self.folder, "lru_trie.dat"))
+            )
+
+            loaded_traph = load_v2(
+                path.join(self.folder, "v2"),
+                path.join(self.folder, "loaded"),
+                debug=True,
+            )
+
+            with TraphTransaction(loaded_traph):
+                self.assertSameTraphState(loaded_traph, traph, extra=read_nodes)
+
+                header = loaded_traph.lru_trie.header
+                self.assertEqual(header.has_subtree_counters(), subtree_counters)
+
+            # Loading into an existing Traph is not possible
+            with self.assertRaises(TraphException):
+                load_v2(path.join(self.folder, "v2"), path.join(self.folder, "loaded"))
+
+        # The round trip yields identical files, rebuilt counters included
+        names = ["lru_trie.dat", "link_store.dat"]
+
+        if subtree_counters:
+            names.append("lru_trie.counts.dat")
+
+        for name in names:
+            with open(path.join(self.folder, name), "rb") as f:
+                original = f.read()
+
+            with open(path.join(self.folder, "loaded", name), "rb") as f:
+                self.assertEqual(f.read(), original)
@@ -9,6 +9,8 @@ from test.test_cases import TraphTestCase
 from test.config import WEBENTITY_CREATION_RULES_REGEXES
 
 from traph.helpers import ops_to_base4, build_pagination_token
+from traph.lru_trie.node import LRUTrieNodeTraversalException
+from traph.lru_trie.inorder import LRUTrieInorderTraversal
 
 WEBENTITY_CREATION_RULES = {
     b"s:http|h:com|h:world|": WEBENTITY_CREATION_RULES_REGEXES["path1"],
@@ -230,6 +232,49 @@ class TestTraversal(TraphTestCase):
                 webentity_inorder,
             )
 
+    def test_inorder_traversal(self):
+        with self.open_traph() as traph:
+            prefix = b"s:http|h:com|h:world|"
+
+            for page in [b"europe", b"asia", b"oceania", b"africa", b"america"]:
+                traph.add_page(prefix + b"p:" + page + b"|")
+                traph.add_page(prefix + b"p:" + page + b"|p:capital|")
+
+            prefix_node = traph.lru_trie.lru_node(prefix)
+            traversal = LRUTrieInorderTraversal(
+                traph.lru_trie_storage, prefix_node.block, b"s:http|h:com|"
+            )
+
+            items = [(lru, path) for _, lru, path in traversal]
+
+            self.assertEqual(
+                items,
+                [
+                    (lru, path)
+                    for _, lru, path in traph.lru_trie.webentity_inorder_iter(
+                        prefix_node, prefix
+                    )
+                ],
+            )
+            self.assertEqual(len(items), 11)
+            self.assertEqual(items[0], (prefix, 0))
+
+            # Frames are only allocated for the deepest levels walked, the
+            # right siblings reusing the frame of their left neighbour
+            self.assertEqual(traversal.depth, 0)
+            self.assertTrue(len(traversal.frames) < len(items))
+
+            # Resuming right after any node should yield the remaining ones
+            for i, (_, path) in enumerate(items):
+                traversal.resume(path)
+
+                self.assertEqual(
+                    [(lru, path) for _, lru, path in traversal], items[i + 1 :]
+                )
+
+            with self.assertRaises(LRUTrieNodeTraversalException):
+                traversal.resume(ops_to_base4("CCCCCC"))
+
     def test_paginated_webentity_inorder_iter(self):
         with self.open_traph(
             default_webentity_creation_rule=WEBENTITY_CREATION_RULES_REGEXES["domain"]
@@ -69,5 +69,29 @@ class TraphTestCase(CustomAssertionsTestCase):
 
         return TraphTransaction(traph)
 
+    # Method reading what two Traphs holding the same data should share,
+    # along with whatever the given extra function reads
+    def read_traph_state(self, traph, extra=None):
+        state = {
+            "pages": sorted(
+                (lru, node.is_crawled()) for node, lru in traph.pages_iter()
+            ),
+            "webentities": sorted(
+                (lru, node.webentity()) for node, lru in traph.webentity_prefix_iter()
+            ),
+            "links": traph.get_webentities_links(),
+            "last_webentity_id": traph.lru_trie.header.last_webentity_id(),
+        }
+
+        if extra is not None:
+            state["extra"] = extra(traph)
+
+        return state
+
+    def assertSameTraphState(self, traph1, traph2, extra=None):
+        self.assertEqual(
+            self.read_traph_state(traph1, extra), self.read_traph_state(traph2, extra)
+        )
+
     def tearDown(self):
         shutil.rmtree(self.folder, ignore_errors=True)
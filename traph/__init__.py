@@ -5,3 +5,5 @@
 from .traph import Traph, TraphException
 from .traph_write_report import TraphWriteReport
 from .traph_iterator_state import TraphIteratorState
+from .bulk_loader import bulk_load
+from .format_v2 import export_v2, load_v2
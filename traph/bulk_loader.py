@@ -0,0 +1,508 @@
+# =============================================================================
+# Traph Bulk Loader
+# =============================================================================
+#
+# Function building a brand new Traph from a sorted stream of pages, rather
+# than replaying every page & link through the regular, random access, path.
+#
+# The trie is first laid out in memory, one record per node, so that every
+# block address is known before anything is written. Sibling BSTs are then
+# perfectly balanced and the blocks are written sequentially, in the same
+# depth-first order the trie's traversals follow, along with the link store's
+# stubs, grouped by page.
+#
+import errno
+import heapq
+import os
+import re
+import warnings
+from traph.traph import Traph, TraphException
+from traph.traph_write_report import TraphWriteReport
+from traph.helpers import balance_bst, lru_iter, lru_variations
+from traph.storage import FileStorage
+from traph.lru_trie.header import (
+    LRUTrieHeader,
+    LRU_TRIE_HEADER_BLOCKS,
+    LRU_TRIE_HEADER_NB_PAGES,
+    LRU_TRIE_HEADER_NB_CRAWLED_PAGES,
+    LRU_TRIE_HEADER_NB_NODES,
+    LRU_TRIE_HEADER_NB_TAIL_NODES,
+    LRU_TRIE_HEADER_NB_WEBENTITY_PREFIXES,
+)
+from traph.lru_trie.node import (
+    LRUTrieNode,
+    LRU_TRIE_NODE_BLOCK_SIZE,
+    LRU_TRIE_FIRST_DATA_BLOCK,
+    nb_blocks_for_stem,
+)
+from traph.link_store.header import LinkStoreHeader
+from traph.link_store.node import LinkStoreNode, LINK_STORE_NODE_BLOCK_SIZE
+
+# Size in bytes of the append buffers used to write the files
+BULK_LOAD_BUFFER_SIZE = 1 << 20
+
+# Kinds of entries found in the merged stream
+PAGE = 0
+WEBENTITY_PREFIX = 1
+WEBENTITY_CREATION_RULE = 2
+
+# Record flags
+RECORD_PAGE = 1 << 0
+RECORD_CRAWLED = 1 << 1
+RECORD_WEBENTITY_CREATION_RULE = 1 << 2
+RECORD_CAN_HAVE_CHILD_WEBENTITIES = 1 << 3
+
+
+def bulk_load(
+    folder,
+    pages,
+    links=None,
+    webentities=None,
+    overwrite=False,
+    encoding="utf-8",
+    default_webentity_creation_rule=None,
+    webentity_creation_rules=None,
+    buffer_size=BULK_LOAD_BUFFER_SIZE,
+    **kwargs,
+):
+    """
+    Builds a new Traph in the given folder & returns it, along with the
+    write report of the load.
+
+    pages must be an iterable of (lru, crawled) tuples sorted by lru, links
+    an iterable of (source_lru, target_lru) tuples whose lrus are pages &
+    webentities a dict mapping webentity ids to their prefixes.
+
+    The webentity prefixes & the prefixes of the creation rules are flagged
+    in the same pass, in which the pages that are not covered by any of the
+    given webentities are also handed to the creation rules, as the regular
+    path would do. The prefixes of the created webentities are then laid out
+    along with the other nodes.
+
+    Remaining kwargs are given to the Traph once loaded.
+    """
+
+    def encode(string):
+        if isinstance(string, bytes):
+            return string
+
+        return string.encode(encoding)
+
+    debug = kwargs.get("debug", False)
+
+    # Checking the creation rules before writing anything
+    if debug:
+        webentity_creation_rules = webentity_creation_rules or {}
+    else:
+        if not isinstance(default_webentity_creation_rule, bytes):
+            raise TraphException("Given default webentity creation rule is not bytes!")
+
+        if not isinstance(webentity_creation_rules, dict):
+            raise TraphException("Given webentity creation rules is not a dict!")
+
+        default_rule = re.compile(default_webentity_creation_rule, re.I)
+        rules = {
+            encode(prefix): re.compile(pattern, re.I)
+            for prefix, pattern in webentity_creation_rules.items()
+        }
+
+    lru_trie_path = os.path.join(folder, "lru_trie.dat")
+    link_store_path = os.path.join(folder, "link_store.dat")
+
+    if not overwrite and (
+        os.path.isfile(lru_trie_path) or os.path.isfile(link_store_path)
+    ):
+        raise TraphException("Cannot bulk load into an existing Traph.")
+
+    # The prefix index of an overwritten Traph refers to its former trie
+    lru_trie_webentities_path = os.path.join(folder, "lru_trie.webentities.dat")
+
+    if os.path.isfile(lru_trie_webentities_path):
+        os.remove(lru_trie_webentities_path)
+
+    webentities = webentities or {}
+
+    # Merging the pages with the prefixes to flag
+    prefixes = []
+
+    for weid, weid_prefixes in webentities.items():
+        for prefix in weid_prefixes:
+            prefixes.append((encode(prefix), WEBENTITY_PREFIX, weid))
+
+    for prefix in webentity_creation_rules:
+        prefixes.append((encode(prefix), WEBENTITY_CREATION_RULE, None))
+
+    prefixes.sort()
+
+    # NOTE: prefixes come first so that a page is only handled once the
+    # webentity its own lru could be a prefix of is known
+    entries = heapq.merge(
+        prefixes,
+        ((encode(lru), PAGE, crawled) for lru, crawled in pages),
+        key=lambda entry: entry[0],
+    )
+
+    # 1) Gathering one record per node, along with the prefixes created by
+    # the creation rules
+    stems = []
+    parents = []
+    flags = []
+    weids = []
+    children = {}
+    top_level = {}
+
+    page_records = {}
+    last_webentity_id = 0
+
+    # NOTE: the ids of the created webentities are only known once the given
+    # ones all are, their records are therefore marked with -(index + 1)
+    created_webentities = []
+
+    def add_record(parent, stem):
+        siblings = top_level if parent == -1 else children.setdefault(parent, {})
+        record = siblings.get(stem)
+
+        if record is None:
+            record = len(stems)
+            siblings[stem] = record
+
+            stems.append(stem)
+            parents.append(parent)
+            flags.append(0)
+            weids.append(0)
+
+        return record
+
+    def create_webentity(prefix):
+        valid_prefixes = []
+        valid_records = []
+
+        for variation in lru_variations(prefix):
+            record = -1
+            ancestors = []
+
+            for stem in lru_iter(variation):
+                if record != -1:
+                    ancestors.append(record)
+
+                record = add_record(record, stem)
+
+            for ancestor in ancestors:
+                flags[ancestor] |= RECORD_CAN_HAVE_CHILD_WEBENTITIES
+
+            if not weids[record]:
+                valid_prefixes.append(variation)
+                valid_records.append(record)
+
+        if not valid_prefixes:
+            return
+
+        created_webentities.append(valid_prefixes)
+
+        for record in valid_records:
+            weids[record] = -len(created_webentities)
+
+    def apply_webentity_creation_rules(lru, lru_stems):
+        # NOTE: this follows Traph.__apply_webentity_creation_rules_to_page
+        webentity_position = -1
+        longest_candidate_prefix = b""
+
+        for i in range(len(path) - 1, -1, -1):
+            record = path[i]
+
+            if weids[record] and webentity_position == -1:
+                webentity_position = len(b"".join(lru_stems[: i + 1]))
+
+            if flags[record] & RECORD_WEBENTITY_CREATION_RULE:
+                match = rules[b"".join(lru_stems[: i + 1])].search(lru)
+
+                if match and len(match.group()) > len(longest_candidate_prefix):
+                    longest_candidate_prefix = match.group()
+
+        if longest_candidate_prefix:
+            if len(longest_candidate_prefix) > webentity_position:
+                create_webentity(longest_candidate_prefix)
+
+            return
+
+        match = default_rule.search(lru)
+
+        if not match or not match.group():
+            warnings.warn(
+                'Default rule failed to find a prefix for "%s"!' % lru, RuntimeWarning
+            )
+        else:
+            create_webentity(match.group())
+
+    path = []
+    previous_stems = []
+    previous_lru = b""
+
+    # Whether each record of the path belongs to a webentity
+    path_has_webentity = []
+
+    for lru, kind, value in entries:
+        if lru < previous_lru:
+            raise TraphException("Pages must be sorted: %s" % lru)
+
+        previous_lru = lru
+
+        lru_stems = list(lru_iter(lru))
+
+        i = 0
+        m = min(len(lru_stems), len(previous_stems))
+
+        while i < m and lru_stems[i] == previous_stems[i]:
+            i += 1
+
+        del path[i:]
+        del path_has_webentity[i:]
+
+        for stem in lru_stems[i:]:
+            record = add_record(path[-1] if path else -1, stem)
+
+            path.append(record)
+            path_has_webentity.append(
+                bool(path_has_webentity) and path_has_webentity[-1]
+            )
+
+        previous_stems = lru_stems
+
+        if not path:
+            continue
+
+        record = path[-1]
+
+        if kind == PAGE:
+            if not flags[record] & RECORD_PAGE:
+                page_records[lru] = record
+
+                if not debug and not path_has_webentity[-1]:
+                    apply_webentity_creation_rules(lru, lru_stems)
+
+            flags[record] |= RECORD_PAGE
+
+            if value:
+                flags[record] |= RECORD_CRAWLED
+
+        elif kind == WEBENTITY_PREFIX:
+            # A given prefix cannot be claimed by a created webentity, since
+            # the regular path would have known it beforehand
+            if weids[record] < 0:
+                created_webentities[-weids[record] - 1].remove(lru)
+
+            weids[record] = value
+            last_webentity_id = max(last_webentity_id, value)
+
+            path_has_webentity[-1] = True
+
+            for ancestor in path[:-1]:
+                flags[ancestor] |= RECORD_CAN_HAVE_CHILD_WEBENTITIES
+
+        else:
+            flags[record] |= RECORD_WEBENTITY_CREATION_RULE
+
+    report = TraphWriteReport()
+
+    for index, weid_prefixes in enumerate(created_webentities):
+        report.created_webentities[last_webentity_id + index + 1] = weid_prefixes
+
+    for record, weid in enumerate(weids):
+        if weid < 0:
+            weids[record] = last_webentity_id - weid
+
+    last_webentity_id += len(created_webentities)
+
+    # 2) Balancing the sibling BSTs
+    nb_records = len(stems)
+    lefts = [-1] * nb_records
+    rights = [-1] * nb_records
+    child_roots = [-1] * nb_records
+
+    def sorted_records(siblings):
+        return [siblings[stem] for stem in sorted(siblings)]
+
+    for parent, siblings in children.items():
+        child_roots[parent] = balance_bst(sorted_records(siblings), lefts, rights, -1)
+
+    children.clear()
+
+    # 3) Laying the blocks out in depth-first order
+    order = []
+    stack = (
+        [balance_bst(sorted_records(top_level), lefts, rights, -1)] if top_level else []
+    )
+
+    while stack:
+        record = stack.pop()
+        order.append(record)
+
+        if rights[record] != -1:
+            stack.append(rights[record])
+
+        if lefts[record] != -1:
+            stack.append(lefts[record])
+
+        if child_roots[record] != -1:
+            stack.append(child_roots[record])
+
+    blocks = [0] * nb_records
+    block = LRU_TRIE_FIRST_DATA_BLOCK
+
+    for record in order:
+        blocks[record] = block
+        block += LRU_TRIE_NODE_BLOCK_SIZE * nb_blocks_for_stem(stems[record])
+
+    # Ensuring the given folder exists
+    try:
+        os.makedirs(folder)
+    except OSError as exception:
+        if exception.errno == errno.EEXIST and os.path.isdir(folder):
+            pass
+        else:
+            raise
+
+    # 4) Writing the link store, grouping the stubs of each page
+    outlinks = {}
+    inlinks = {}
+
+    for source_lru, target_lru in links or ():
+        source_lru = encode(source_lru)
+        target_lru = encode(target_lru)
+
+        if source_lru not in page_records:
+            raise TraphException("Link source is not a page: %s" % source_lru)
+
+        if target_lru not in page_records:
+            raise TraphException("Link target is not a page: %s" % target_lru)
+
+        source = page_records[source_lru]
+        target = page_records[target_lru]
+
+        outlinks.setdefault(source, []).append(target)
+        inlinks.setdefault(target, []).append(source)
+
+    del page_records
+
+    outlinks_heads = {}
+    inlinks_heads = {}
+
+    with open(link_store_path, "wb+") as link_store_file:
+        storage = FileStorage(
+            LINK_STORE_NODE_BLOCK_SIZE, link_store_file, buffer_size=buffer_size
+        )
+
+        header = LinkStoreHeader(storage)
+
+        for record in order:
+            for records_links, heads in [
+                (outlinks, outlinks_heads),
+                (inlinks, inlinks_heads),
+            ]:
+                previous = 0
+
+                for target in records_links.get(record, ()):
+                    node = LinkStoreNode(storage)
+                    node.set_target(blocks[target])
+
+                    if previous:
+                        node.set_previous(previous)
+
+                    node.write()
+
+                    previous = node.block
+
+                if previous:
+                    heads[record] = previous
+
+        header.set_nb_links(sum(len(targets) for targets in outlinks.values()))
+        header.write()
+
+        storage.close()
+
+    del outlinks
+    del inlinks
+
+    # 5) Writing the trie
+    with open(lru_trie_path, "wb+") as lru_trie_file:
+        storage = FileStorage(
+            LRU_TRIE_NODE_BLOCK_SIZE, lru_trie_file, buffer_size=buffer_size
+        )
+
+        header = LRUTrieHeader(storage)
+        header.set_last_webentity_id(last_webentity_id)
+
+        header.write()
+
+        for record in order:
+            stem = stems[record]
+            node = LRUTrieNode(storage, stem=stem)
+            record_flags = flags[record]
+
+            if record_flags & RECORD_PAGE:
+                node.flag_as_page()
+
+            if record_flags & RECORD_CRAWLED:
+                node.flag_as_crawled()
+
+            if record_flags & RECORD_WEBENTITY_CREATION_RULE:
+                node.flag_as_webentity_creation_rule()
+
+            if record_flags & RECORD_CAN_HAVE_CHILD_WEBENTITIES:
+                node.flag_can_have_child_webentities()
+
+            if weids[record]:
+                node.set_webentity(weids[record])
+
+            if parents[record] != -1:
+                node.set_parent(blocks[parents[record]])
+
+            if lefts[record] != -1:
+                node.set_left(blocks[lefts[record]])
+
+            if rights[record] != -1:
+                node.set_right(blocks[rights[record]])
+
+            if child_roots[record] != -1:
+                node.set_child(blocks[child_roots[record]])
+
+            if record in outlinks_heads:
+                node.set_outlinks(outlinks_heads[record])
+
+            if record in inlinks_heads:
+                node.set_inlinks(inlinks_heads[record])
+
+            node.write()
+
+            assert node.block == blocks[record]
+
+        nb_nodes = int(storage.count_blocks()) - LRU_TRIE_HEADER_BLOCKS
+
+        header.set_counter(LRU_TRIE_HEADER_NB_NODES, nb_nodes)
+        header.set_counter(LRU_TRIE_HEADER_NB_TAIL_NODES, nb_nodes - len(order))
+        header.set_counter(
+            LRU_TRIE_HEADER_NB_PAGES, sum(1 for f in flags if f & RECORD_PAGE)
+        )
+        header.set_counter(
+            LRU_TRIE_HEADER_NB_CRAWLED_PAGES,
+            sum(1 for f in flags if f & RECORD_PAGE and f & RECORD_CRAWLED),
+        )
+        header.set_counter(
+            LRU_TRIE_HEADER_NB_WEBENTITY_PREFIXES, sum(1 for weid in weids if weid)
+        )
+        header.write()
+
+        storage.close()
+
+    # 6) Opening the Traph
+    traph = Traph(
+        folder=folder,
+        encoding=encoding,
+        default_webentity_creation_rule=default_webentity_creation_rule,
+        webentity_creation_rules=webentity_creation_rules,
+        **kwargs,
+    )
+
+    report.nb_created_pages = sum(1 for f in flags if f & RECORD_PAGE)
+
+    return traph, report
@@ -0,0 +1,104 @@
+# =============================================================================
+# Traph Compaction
+# =============================================================================
+#
+# Function copying a Traph's LRU Trie & Link Store into new storages, using a
+# layout whose locality matches the way they are traversed.
+#
+# Trie nodes are written in the same depth-first order the trie's traversals
+# follow, each one directly followed by its tail blocks, and the link stubs
+# of each page are written contiguously, in the order of the pages. Nodes
+# keep their stem, flags, webentity & sibling BST shape, only their pointers
+# are rewritten. Blocks no longer reachable from the root are dropped.
+#
+from traph.lru_trie import LRUTrie
+from traph.lru_trie.node import (
+    LRUTrieNode,
+    LRU_TRIE_FIRST_DATA_BLOCK,
+    LRU_TRIE_NODE_BLOCK_SIZE,
+    nb_blocks_for_stem,
+)
+from traph.link_store import LinkStore
+
+
+# Main function
+def compact(lru_trie, link_store, lru_trie_storage, link_store_storage):
+    # 1) Computing the new address of every reachable node
+    order = []
+    blocks = {}
+    block = LRU_TRIE_FIRST_DATA_BLOCK
+
+    for node, _ in lru_trie.dfs_iter():
+        order.append(node.block)
+        blocks[node.block] = block
+        block += LRU_TRIE_NODE_BLOCK_SIZE * nb_blocks_for_stem(node.stem())
+
+    # 2) Writing the link stubs of each page contiguously, oldest first so
+    # that the lists keep their order
+    target_link_store = LinkStore(link_store_storage)
+    heads = {}
+
+    for block in order:
+        node = lru_trie.node_view(block=block)
+
+        if not node.has_outlinks() and not node.has_inlinks():
+            continue
+
+        node_heads = []
+
+        for out in [True, False]:
+            head = 0
+
+            if node.has_links(out=out):
+                targets = [
+                    stub.target()
+                    for stub in link_store.link_nodes_iter(node.links(out=out))
+                ]
+
+                for target in reversed(targets):
+                    stub = target_link_store.node()
+                    stub.set_target(blocks[target])
+
+                    if head:
+                        stub.set_previous(head)
+
+                    stub.write()
+                    head = stub.block
+
+            node_heads.append(head)
+
+        heads[block] = node_heads
+
+    # 3) Writing the trie's nodes
+    target_lru_trie = LRUTrie(lru_trie_storage, descent_cache_size=0)
+    target_lru_trie.header.set_last_webentity_id(lru_trie.header.last_webentity_id())
+    target_lru_trie.header.write()
+
+    for block in order:
+        source = lru_trie.node(block=block)
+
+        node = LRUTrieNode(lru_trie_storage, data=source.pack())
+        node.set_stem(source.stem())
+
+        if source.has_left():
+            node.set_left(blocks[source.left()])
+
+        if source.has_right():
+            node.set_right(blocks[source.right()])
+
+        if source.has_child():
+            node.set_child(blocks[source.child()])
+
+        node.set_parent(blocks.get(source.parent(), 0))
+
+        outlinks, inlinks = heads.get(block, (0, 0))
+        node.set_outlinks(outlinks)
+        node.set_inlinks(inlinks)
+
+        node.write()
+
+        assert node.block == blocks[block]
+
+    # 4) Counting what was written
+    target_lru_trie.rebuild_counters()
+    target_link_store.rebuild_counters()
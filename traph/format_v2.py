@@ -0,0 +1,400 @@
+# =============================================================================
+# Traph v2 Binary Format
+# =============================================================================
+#
+# Functions converting a Traph's files from & to a more compact, versioned,
+# binary format whose pointers are 32-bit block indices rather than 64-bit
+# byte offsets.
+#
+# Trie file (64 bytes blocks, little-endian):
+#   - header: magic, format version, last webentity id, traph version &
+#     whether the trie maintains subtree counters.
+#   - head blocks: flags, webentity, left, right, child, parent, outlinks &
+#     inlinks registers, then the first 34 chars of the stem.
+#   - tail blocks: flags, then 62 more chars of the stem. Contrary to the v1
+#     format, they do not waste room on registers they do not use.
+#
+# Link store file (8 bytes blocks, little-endian):
+#   - header: magic & format version.
+#   - stubs: target & previous registers.
+#
+# Flags keep the same meaning as in v1 and the block of index 0, being the
+# header, still stands for the NULL pointer. Both conversions only read &
+# write the files sequentially: blocks keep their order, so that files can
+# be converted back & forth without altering the Traph.
+#
+import errno
+import os
+import struct
+from traph.traph import Traph, TraphException
+from traph.storage import FileStorage
+from traph.lru_trie import LRUTrie, LRU_TRIE_NODE_BLOCK_SIZE
+from traph.lru_trie.node import (
+    LRUTrieNode,
+    LRU_TRIE_FIRST_DATA_BLOCK,
+    LRU_TRIE_NODE_FLAGS,
+    LRU_TRIE_NODE_WEBENTITY,
+    LRU_TRIE_NODE_LEFT_BLOCK,
+    LRU_TRIE_NODE_RIGHT_BLOCK,
+    LRU_TRIE_NODE_CHILD_BLOCK,
+    LRU_TRIE_NODE_PARENT_BLOCK,
+    LRU_TRIE_NODE_OUTLINKS_BLOCK,
+    LRU_TRIE_NODE_INLINKS_BLOCK,
+    LRU_TRIE_NODE_FLAG_HAS_TAIL,
+    LRU_TRIE_NODE_FLAG_IS_TAIL,
+    nb_blocks_for_stem,
+)
+from traph.link_store import LinkStore, LINK_STORE_NODE_BLOCK_SIZE
+from traph.link_store.node import LinkStoreNode
+
+TRAPH_V2_FORMAT_VERSION = 2
+
+# Trie file
+TRAPH_V2_LRU_TRIE_MAGIC = b"TRIE"
+TRAPH_V2_LRU_TRIE_HEADER_STRUCT = struct.Struct("<4sBI12pB42x")
+TRAPH_V2_LRU_TRIE_HEAD_STRUCT = struct.Struct("<B7I35p")
+TRAPH_V2_LRU_TRIE_TAIL_STRUCT = struct.Struct("<B63p")
+TRAPH_V2_LRU_TRIE_BLOCK_SIZE = TRAPH_V2_LRU_TRIE_HEAD_STRUCT.size
+TRAPH_V2_LRU_TRIE_HEAD_STEM_SIZE = 34
+TRAPH_V2_LRU_TRIE_TAIL_STEM_SIZE = 62
+
+assert TRAPH_V2_LRU_TRIE_HEADER_STRUCT.size == TRAPH_V2_LRU_TRIE_BLOCK_SIZE
+assert TRAPH_V2_LRU_TRIE_TAIL_STRUCT.size == TRAPH_V2_LRU_TRIE_BLOCK_SIZE
+
+# Link store file
+TRAPH_V2_LINK_STORE_MAGIC = b"LINK"
+TRAPH_V2_LINK_STORE_HEADER_STRUCT = struct.Struct("<4sB3x")
+TRAPH_V2_LINK_STORE_NODE_STRUCT = struct.Struct("<II")
+TRAPH_V2_LINK_STORE_BLOCK_SIZE = TRAPH_V2_LINK_STORE_NODE_STRUCT.size
+
+assert TRAPH_V2_LINK_STORE_HEADER_STRUCT.size == TRAPH_V2_LINK_STORE_BLOCK_SIZE
+
+# Size in bytes of the append buffers used to write the files
+TRAPH_V2_BUFFER_SIZE = 1 << 20
+
+# Registers of the v1 nodes stored as pointers, in v2 order
+POINTERS = (
+    LRU_TRIE_NODE_LEFT_BLOCK,
+    LRU_TRIE_NODE_RIGHT_BLOCK,
+    LRU_TRIE_NODE_CHILD_BLOCK,
+    LRU_TRIE_NODE_PARENT_BLOCK,
+)
+
+HAS_TAIL = 1 << LRU_TRIE_NODE_FLAG_HAS_TAIL
+IS_TAIL = 1 << LRU_TRIE_NODE_FLAG_IS_TAIL
+
+LRU_TRIE_PATH = "lru_trie.v2.dat"
+LINK_STORE_PATH = "link_store.v2.dat"
+
+
+# Helpers
+def nb_v2_blocks_for_stem(stem):
+    if len(stem) <= TRAPH_V2_LRU_TRIE_HEAD_STEM_SIZE:
+        return 1
+
+    tail = len(stem) - TRAPH_V2_LRU_TRIE_HEAD_STEM_SIZE
+
+    return 1 + -(-tail // TRAPH_V2_LRU_TRIE_TAIL_STEM_SIZE)
+
+
+def link_store_index(block):
+    return block // LINK_STORE_NODE_BLOCK_SIZE
+
+
+def v2_lru_trie_iter(storage):
+    """
+    Yields the index, flags, webentity, pointers & full stem of each node
+    stored in the given v2 trie storage.
+    """
+    header = storage.read(0)
+
+    if header is None:
+        raise TraphException("Empty v2 LRU Trie file.")
+
+    magic, version = TRAPH_V2_LRU_TRIE_HEADER_STRUCT.unpack(header)[:2]
+
+    if magic != TRAPH_V2_LRU_TRIE_MAGIC or version != TRAPH_V2_FORMAT_VERSION:
+        raise TraphException("Not a v2 LRU Trie file.")
+
+    head = None
+    chunks = []
+
+    for block, data in storage.iter_blocks(TRAPH_V2_LRU_TRIE_BLOCK_SIZE):
+        if head is None:
+            index = block // TRAPH_V2_LRU_TRIE_BLOCK_SIZE
+            head = TRAPH_V2_LRU_TRIE_HEAD_STRUCT.unpack(data)
+            flags = head[0]
+            chunks.append(head[8])
+        else:
+            flags, chunk = TRAPH_V2_LRU_TRIE_TAIL_STRUCT.unpack(data)
+
+            if not flags & IS_TAIL:
+                raise TraphException("Corrupted v2 LRU Trie file.")
+
+            chunks.append(chunk)
+
+        # Waiting for the last tail block of the node
+        if flags & HAS_TAIL:
+            continue
+
+        yield index, head[0], head[1], head[2:8], b"".join(chunks)
+
+        head = None
+        chunks = []
+
+    if head is not None:
+        raise TraphException("Truncated v2 LRU Trie file.")
+
+
+# Main functions
+def write_v2(lru_trie, link_store, lru_trie_storage, link_store_storage):
+    """
+    Streams the given v1 LRU Trie & Link Store into the given storages, which
+    must use the v2 block sizes.
+    """
+    # 1) Computing the index of every v1 node in the v2 trie
+    indices = {}
+    index = 1
+
+    for node in lru_trie.nodes_iter():
+        if node.is_tail():
+            continue
+
+        indices[node.block] = index
+        index += nb_v2_blocks_for_stem(node.stem())
+
+    # 2) Writing the trie
+    header = lru_trie.header
+
+    lru_trie_storage.write(
+        TRAPH_V2_LRU_TRIE_HEADER_STRUCT.pack(
+            TRAPH_V2_LRU_TRIE_MAGIC,
+            TRAPH_V2_FORMAT_VERSION,
+            header.last_webentity_id(),
+            header.get_version(),
+            int(header.has_subtree_counters()),
+        ),
+        0,
+    )
+
+    for node in lru_trie.nodes_iter():
+        if node.is_tail():
+            continue
+
+        data = node.data
+        stem = node.stem()
+        head = stem[:TRAPH_V2_LRU_TRIE_HEAD_STEM_SIZE]
+        tail = stem[TRAPH_V2_LRU_TRIE_HEAD_STEM_SIZE:]
+
+        flags = data[LRU_TRIE_NODE_FLAGS] & ~HAS_TAIL
+
+        if tail:
+            flags |= HAS_TAIL
+
+        lru_trie_storage.write(
+            TRAPH_V2_LRU_TRIE_HEAD_STRUCT.pack(
+                flags,
+                data[LRU_TRIE_NODE_WEBENTITY],
+                *[indices.get(data[register], 0) for register in POINTERS],
+                link_store_index(data[LRU_TRIE_NODE_OUTLINKS_BLOCK]),
+                link_store_index(data[LRU_TRIE_NODE_INLINKS_BLOCK]),
+                head,
+            )
+        )
+
+        for start in range(0, len(tail), TRAPH_V2_LRU_TRIE_TAIL_STEM_SIZE):
+            end = start + TRAPH_V2_LRU_TRIE_TAIL_STEM_SIZE
+
+            lru_trie_storage.write(
+                TRAPH_V2_LRU_TRIE_TAIL_STRUCT.pack(
+                    IS_TAIL | HAS_TAIL if end < len(tail) else IS_TAIL,
+                    tail[start:end],
+                )
+            )
+
+    # 3) Writing the link store
+    link_store_storage.write(
+        TRAPH_V2_LINK_STORE_HEADER_STRUCT.pack(
+            TRAPH_V2_LINK_STORE_MAGIC, TRAPH_V2_FORMAT_VERSION
+        ),
+        0,
+    )
+
+    for stub in link_store.nodes_iter():
+        link_store_storage.write(
+            TRAPH_V2_LINK_STORE_NODE_STRUCT.pack(
+                indices[stub.target()], link_store_index(stub.previous() or 0)
+            )
+        )
+
+
+def read_v2(
+    lru_trie_storage,
+    link_store_storage,
+    target_lru_trie_storage,
+    target_link_store_storage,
+):
+    """
+    Streams the v2 files of the given storages back into v1 storages.
+    """
+    # 1) Computing the v1 block of every v2 node
+    blocks = {}
+    block = LRU_TRIE_FIRST_DATA_BLOCK
+
+    for index, _, _, _, stem in v2_lru_trie_iter(lru_trie_storage):
+        blocks[index] = block
+        block += LRU_TRIE_NODE_BLOCK_SIZE * nb_blocks_for_stem(stem)
+
+    # 2) Writing the trie
+    header = TRAPH_V2_LRU_TRIE_HEADER_STRUCT.unpack(lru_trie_storage.read(0))
+
+    lru_trie = LRUTrie(target_lru_trie_storage, descent_cache_size=0)
+    lru_trie.header.set_last_webentity_id(header[2])
+    lru_trie.header.set_subtree_counters(header[4])
+
+    for index, flags, webentity, pointers, stem in v2_lru_trie_iter(lru_trie_storage):
+        node = LRUTrieNode(target_lru_trie_storage)
+        node.data[LRU_TRIE_NODE_FLAGS] = flags & ~HAS_TAIL
+        node.data[LRU_TRIE_NODE_WEBENTITY] = webentity
+        node.set_stem(stem)
+
+        for register, pointer in zip(POINTERS, pointers):
+            node.data[register] = blocks.get(pointer, 0)
+
+        node.data[LRU_TRIE_NODE_OUTLINKS_BLOCK] = (
+            pointers[4] * LINK_STORE_NODE_BLOCK_SIZE
+        )
+        node.data[LRU_TRIE_NODE_INLINKS_BLOCK] = (
+            pointers[5] * LINK_STORE_NODE_BLOCK_SIZE
+        )
+
+        node.write()
+
+        assert node.block == blocks[index]
+
+    # 3) Writing the link store
+    data = link_store_storage.read(0)
+
+    if data is None or TRAPH_V2_LINK_STORE_HEADER_STRUCT.unpack(data) != (
+        TRAPH_V2_LINK_STORE_MAGIC,
+        TRAPH_V2_FORMAT_VERSION,
+    ):
+        raise TraphException("Not a v2 Link Store file.")
+
+    link_store = LinkStore(target_link_store_storage)
+
+    for _, data in link_store_storage.iter_blocks(TRAPH_V2_LINK_STORE_BLOCK_SIZE):
+        target, previous = TRAPH_V2_LINK_STORE_NODE_STRUCT.unpack(data)
+
+        stub = LinkStoreNode(target_link_store_storage)
+        stub.set_target(blocks[target])
+
+        if previous:
+            stub.set_previous(previous * LINK_STORE_NODE_BLOCK_SIZE)
+
+        stub.write()
+
+    # 4) Counting what was written, the v2 format not storing the counters
+    lru_trie.rebuild_counters()
+    link_store.rebuild_counters()
+
+
+def export_v2(traph, folder):
+    """
+    Writes the given Traph's files, in the v2 format, into the given folder.
+    """
+    lru_trie_path = os.path.join(folder, LRU_TRIE_PATH)
+    link_store_path = os.path.join(folder, LINK_STORE_PATH)
+
+    if os.path.isfile(lru_trie_path) or os.path.isfile(link_store_path):
+        raise TraphException("Cannot export into an existing v2 Traph.")
+
+    # Ensuring the folder exists
+    try:
+        os.makedirs(folder)
+    except OSError as exception:
+        if exception.errno == errno.EEXIST and os.path.isdir(folder):
+            pass
+        else:
+            raise
+
+    lru_trie_file = open(lru_trie_path, "wb+")
+    link_store_file = open(link_store_path, "wb+")
+
+    lru_trie_storage = FileStorage(
+        TRAPH_V2_LRU_TRIE_BLOCK_SIZE, lru_trie_file, buffer_size=TRAPH_V2_BUFFER_SIZE
+    )
+
+    link_store_storage = FileStorage(
+        TRAPH_V2_LINK_STORE_BLOCK_SIZE,
+        link_store_file,
+        buffer_size=TRAPH_V2_BUFFER_SIZE,
+    )
+
+    try:
+        write_v2(traph.lru_trie, traph.link_store, lru_trie_storage, link_store_storage)
+    finally:
+        lru_trie_storage.close()
+        link_store_storage.close()
+        lru_trie_file.close()
+        link_store_file.close()
+
+
+def load_v2(folder, target_folder, **kwargs):
+    """
+    Converts the v2 files of the given folder back into a Traph, stored in the
+    target folder, & returns it. Remaining kwargs are given to the Traph.
+
+    The subtree counters, which the v2 format does not store, are rebuilt
+    when the Traph is opened if the trie maintains them.
+    """
+    lru_trie_path = os.path.join(target_folder, "lru_trie.dat")
+    link_store_path = os.path.join(target_folder, "link_store.dat")
+
+    if os.path.isfile(lru_trie_path) or os.path.isfile(link_store_path):
+        raise TraphException("Cannot load into an existing Traph.")
+
+    # The files derived from a former trie would be trusted by the Traph
+    for name in ["lru_trie.counts.dat", "lru_trie.webentities.dat"]:
+        derived_path = os.path.join(target_folder, name)
+
+        if os.path.isfile(derived_path):
+            os.remove(derived_path)
+
+    # Ensuring the target folder exists
+    try:
+        os.makedirs(target_folder)
+    except OSError as exception:
+        if exception.errno == errno.EEXIST and os.path.isdir(target_folder):
+            pass
+        else:
+            raise
+
+    files = [
+        open(os.path.join(folder, LRU_TRIE_PATH), "rb"),
+        open(os.path.join(folder, LINK_STORE_PATH), "rb"),
+        open(lru_trie_path, "wb+"),
+        open(link_store_path, "wb+"),
+    ]
+
+    storages = [
+        FileStorage(TRAPH_V2_LRU_TRIE_BLOCK_SIZE, files[0]),
+        FileStorage(TRAPH_V2_LINK_STORE_BLOCK_SIZE, files[1]),
+        FileStorage(
+            LRU_TRIE_NODE_BLOCK_SIZE, files[2], buffer_size=TRAPH_V2_BUFFER_SIZE
+        ),
+        FileStorage(
+            LINK_STORE_NODE_BLOCK_SIZE, files[3], buffer_size=TRAPH_V2_BUFFER_SIZE
+        ),
+    ]
+
+    try:
+        read_v2(*storages)
+    finally:
+        for storage in storages:
+            storage.close()
+
+        for f in files:
+            f.close()
+
+    return Traph(folder=target_folder, **kwargs)
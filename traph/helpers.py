@@ -79,6 +79,36 @@ def lru_dirname(lru: bytes):
     return b"".join(list(lru_iter(lru))[:-1])
 
 
+def balance_bst(items, lefts, rights, empty=0):
+    """
+    Links the given sorted items as a perfectly balanced BST, by filling the
+    lefts & rights mappings, and returns its root, or empty if there is none.
+    """
+    root = empty
+    stack = [(0, len(items), None, False)]
+
+    while stack:
+        start, end, parent, is_right = stack.pop()
+
+        if start >= end:
+            continue
+
+        middle = (start + end) // 2
+        item = items[middle]
+
+        if parent is None:
+            root = item
+        elif is_right:
+            rights[parent] = item
+        else:
+            lefts[parent] = item
+
+        stack.append((start, middle, item, False))
+        stack.append((middle + 1, end, item, True))
+
+    return root
+
+
 def detailed_chunks_iter(chunk_size: int, string: bytes):
     """
     Returning an iterator over a string's chunks of the given size.
@@ -15,7 +15,9 @@ from traph.version import __version__ as TRAPH_VERSION
 # some rules (namely have even addresses or addresses divisible by 4 on some
 # architecture).
 # NOTE: the size of the header struct MUST match the node's one.
-LINK_STORE_HEADER_FORMAT = "12p4x"
+# NOTE: the version is stored on 8 bytes so that the number of links can be
+# stored on 8 bytes too.
+LINK_STORE_HEADER_FORMAT = "8pQ"
 LINK_STORE_HEADER_BLOCK_SIZE = struct.calcsize(LINK_STORE_HEADER_FORMAT)
 
 # Header blocks
@@ -26,6 +28,7 @@ LINK_STORE_HEADER_BLOCKS = 1
 
 # Positions
 LINK_STORE_HEADER_TRAPH_VERSION = 0
+LINK_STORE_HEADER_NB_LINKS = 1
 
 
 # Main class
@@ -37,8 +40,9 @@ class LinkStoreHeader(object):
         # Properties
         self.storage = storage
         self.data = [
-            TRAPH_VERSION.encode()  # Traph version
-        ] * LINK_STORE_HEADER_BLOCKS
+            TRAPH_VERSION.encode(),  # Traph version
+            0,  # Number of links, weights included
+        ]
 
         self.__ensure()
         self.read()
@@ -46,9 +50,10 @@ class LinkStoreHeader(object):
     def __repr__(self):
         class_name = self.__class__.__name__
 
-        return ("<%(class_name)s" " version=%(version)s>") % {
+        return ("<%(class_name)s version=%(version)s nb_links=%(nb_links)s>") % {
             "class_name": class_name,
             "version": self.get_version(),
+            "nb_links": self.nb_links(),
         }
 
     def __ensure(self):
@@ -89,3 +94,12 @@ class LinkStoreHeader(object):
     # =========================================================================
     def get_version(self):
         return self.data[LINK_STORE_HEADER_TRAPH_VERSION]
+
+    def nb_links(self):
+        return self.data[LINK_STORE_HEADER_NB_LINKS]
+
+    def set_nb_links(self, nb):
+        self.data[LINK_STORE_HEADER_NB_LINKS] = nb
+
+    def increment_nb_links(self, number=1):
+        self.data[LINK_STORE_HEADER_NB_LINKS] += number
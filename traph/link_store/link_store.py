@@ -8,6 +8,7 @@
 #
 from collections import Counter
 from traph.link_store.node import LinkStoreNode, LINK_STORE_FIRST_DATA_BLOCK
+from traph.link_store.view import LinkStoreNodeView
 from traph.link_store.header import LinkStoreHeader, LINK_STORE_HEADER_BLOCKS
 
 
@@ -28,6 +29,10 @@ class LinkStore(object):
         # Reading headers
         self.header = LinkStoreHeader(storage)
 
+        # Every link being stored as an outlink & an inlink stub, the header's
+        # counter can be checked against the number of blocks
+        self.exact_counters = self.header.nb_links() * 2 == self.count_stubs()
+
     # =========================================================================
     # Read methods
     # =========================================================================
@@ -36,6 +41,10 @@ class LinkStore(object):
     def node(self, **kwargs):
         return LinkStoreNode(self.storage, **kwargs)
 
+    # Method returning a read-only view over a node
+    def node_view(self, **kwargs):
+        return LinkStoreNodeView(self.storage, **kwargs)
+
     # Method returning the root
     def root(self):
         return self.node(block=LINK_STORE_FIRST_DATA_BLOCK)
@@ -60,6 +69,9 @@ class LinkStore(object):
 
             link_node.write()
 
+            if out:
+                self.header.increment_nb_links()
+
             tail_node = link_node
 
         if not empty:
@@ -75,19 +87,35 @@ class LinkStore(object):
     def add_inlinks(self, source_node, target_blocks):
         return self.add_links(source_node, target_blocks, out=False)
 
+    # =========================================================================
+    # Maintenance methods
+    # =========================================================================
+
+    # Method persisting the counters
+    def write_counters(self):
+        self.header.write()
+
+    # Method recomputing the counters from the number of stubs
+    def rebuild_counters(self):
+        self.header.set_nb_links(self.count_stubs() // 2)
+        self.exact_counters = True
+        self.header.write()
+
+        return self.header.nb_links()
+
     # =========================================================================
     # Iteration methods
     # =========================================================================
     def nodes_iter(self):
-        node = self.root()
+        node = self.node()
 
-        while node.exists:
+        for block, data in self.storage.iter_blocks(LINK_STORE_FIRST_DATA_BLOCK):
+            node.load(block, data)
             yield node
-            node.read(node.block + self.storage.block_size)
 
     # NOTE: this method will yield blocks as is, so expect duplication!
     def link_nodes_iter(self, block):
-        node = self.node(block=block)
+        node = self.node_view(block=block)
 
         if not node.exists:
             raise LinkStoreTraversalException("Block does not exist.")
@@ -99,7 +127,7 @@ class LinkStore(object):
             yield node
 
     def weighted_link_nodes_iter(self, block):
-        node = self.node(block=block)
+        node = self.node_view(block=block)
 
         if not node.exists:
             raise LinkStoreTraversalException("Block does not exist.")
@@ -116,7 +144,7 @@ class LinkStore(object):
             yield target, weight
 
     def deduped_link_nodes_iter(self, block):
-        node = self.node(block=block)
+        node = self.node_view(block=block)
 
         if not node.exists:
             raise LinkStoreTraversalException("Block does not exist.")
@@ -142,10 +170,14 @@ class LinkStore(object):
     # =========================================================================
     # Counting methods
     # =========================================================================
+    def count_stubs(self):
+        return int(self.storage.count_blocks()) - LINK_STORE_HEADER_BLOCKS
+
     def count_links(self):
-        blocks = self.storage.count_blocks() - LINK_STORE_HEADER_BLOCKS
+        if self.exact_counters:
+            return self.header.nb_links()
 
-        return blocks / 2
+        return self.count_stubs() // 2
 
     def metrics(self):
         nb_links = self.count_links()
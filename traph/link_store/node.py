@@ -19,13 +19,18 @@ from traph.lru_trie.node import LRU_TRIE_FIRST_DATA_BLOCK
 # architecture).
 # NOTE: the size of the header struct MUST match the node's one.
 LINK_STORE_NODE_FORMAT = "QQ"
-LINK_STORE_NODE_BLOCK_SIZE = struct.calcsize(LINK_STORE_NODE_FORMAT)
+LINK_STORE_NODE_STRUCT = struct.Struct(LINK_STORE_NODE_FORMAT)
+LINK_STORE_NODE_BLOCK_SIZE = LINK_STORE_NODE_STRUCT.size
 LINK_STORE_FIRST_DATA_BLOCK = LINK_STORE_HEADER_BLOCKS * LINK_STORE_NODE_BLOCK_SIZE
 
 # Positions
 LINK_STORE_NODE_TARGET = 0
 LINK_STORE_NODE_PREVIOUS = 1
 
+# Format of each register, used to decode or encode a single one in place
+LINK_STORE_NODE_FIELD_STRUCT = struct.Struct("Q")
+LINK_STORE_NODE_FIELD_OFFSETS = [0, LINK_STORE_NODE_FIELD_STRUCT.size]
+
 
 # Exceptions
 class LinkStoreNodeTraversalException(Exception):
@@ -38,6 +43,8 @@ class LinkStoreNodeUsageException(Exception):
 
 # Main class
 class LinkStoreNode(object):
+    __slots__ = ("storage", "block", "exists", "data", "dirty")
+
     # =========================================================================
     # Constructor
     # =========================================================================
@@ -46,6 +53,7 @@ class LinkStoreNode(object):
         self.storage = storage
         self.block = None
         self.exists = False
+        self.dirty = 0
 
         # Loading node from storage
         if block is not None:
@@ -62,6 +70,7 @@ class LinkStoreNode(object):
             0,  # Target
             0,  # Previous
         ]
+        self.dirty = 0
 
     def __repr__(self):
         class_name = self.__class__.__name__
@@ -83,7 +92,7 @@ class LinkStoreNode(object):
 
     # Method used to unpack data
     def unpack(self, data):
-        return list(struct.unpack(LINK_STORE_NODE_FORMAT, data))
+        return list(LINK_STORE_NODE_STRUCT.unpack(data))
 
     # Method used to set a switch to another block
     def read(self, block):
@@ -96,16 +105,49 @@ class LinkStoreNode(object):
             self.exists = True
             self.data = self.unpack(data)
             self.block = block
+            self.dirty = 0
+
+    # Method used to set the node's data from an already read block
+    def load(self, block, data):
+        self.exists = True
+        self.data = self.unpack(data)
+        self.block = block
+        self.dirty = 0
 
     # Method used to pack the node to binary form
     def pack(self):
-        return struct.pack(LINK_STORE_NODE_FORMAT, *self.data)
+        return LINK_STORE_NODE_STRUCT.pack(*self.data)
+
+    # Method used to set a register's value, marking it as dirty if it changed
+    def __set(self, register, value):
+        if self.data[register] == value:
+            return
+
+        self.data[register] = value
+        self.dirty |= 1 << register
 
     # Method used to write the node's data to storage
     def write(self):
+        # Existing nodes only need their modified registers to be written
+        if self.exists:
+            if not self.dirty:
+                self.storage.counters.skipped_writes += 1
+                return
+
+            for register, offset in enumerate(LINK_STORE_NODE_FIELD_OFFSETS):
+                if (self.dirty >> register) & 1:
+                    self.storage.write_at(
+                        self.block + offset,
+                        LINK_STORE_NODE_FIELD_STRUCT.pack(self.data[register]),
+                    )
+
+            self.dirty = 0
+            return
+
         block = self.storage.write(self.pack(), self.block)
         self.block = block
         self.exists = True
+        self.dirty = 0
 
     # Method returning whether this node is the root
     def is_root(self):
@@ -133,7 +175,7 @@ class LinkStoreNode(object):
         if block < LINK_STORE_FIRST_DATA_BLOCK:
             raise LinkStoreNodeUsageException("Previous node cannot be the root.")
 
-        self.data[LINK_STORE_NODE_PREVIOUS] = block
+        self.__set(LINK_STORE_NODE_PREVIOUS, block)
 
     # Method used to read the previous sibling
     def read_previous(self):
@@ -171,4 +213,4 @@ class LinkStoreNode(object):
         if block < LRU_TRIE_FIRST_DATA_BLOCK:
             raise LinkStoreNodeUsageException("Target node cannot be the root.")
 
-        self.data[LINK_STORE_NODE_TARGET] = block
+        self.__set(LINK_STORE_NODE_TARGET, block)
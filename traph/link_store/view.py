@@ -0,0 +1,121 @@
+# =============================================================================
+# Link Store Node View
+# =============================================================================
+#
+# Class representing a read-only view over a single node from the link store.
+#
+# The view decodes its registers on demand, directly from the storage's
+# buffer, rather than unpacking the whole block into a list.
+#
+from traph.lru_trie.node import LRU_TRIE_FIRST_DATA_BLOCK
+from traph.link_store.node import (
+    LINK_STORE_FIRST_DATA_BLOCK,
+    LINK_STORE_NODE_FIELD_OFFSETS,
+    LINK_STORE_NODE_FIELD_STRUCT,
+    LINK_STORE_NODE_TARGET,
+    LINK_STORE_NODE_PREVIOUS,
+    LinkStoreNodeTraversalException,
+)
+
+
+# Main class
+class LinkStoreNodeView(object):
+    __slots__ = ("storage", "block", "exists", "buffer", "offset")
+
+    # =========================================================================
+    # Constructor
+    # =========================================================================
+    def __init__(self, storage, block=None):
+        # Properties
+        self.storage = storage
+        self.block = None
+        self.exists = False
+        self.buffer = None
+        self.offset = 0
+
+        if block is not None:
+            self.read(block)
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+
+        return (
+            "<%(class_name)s block=%(block)s exists=%(exists)s"
+            " target=%(target)s previous=%(previous)s>"
+        ) % {
+            "class_name": class_name,
+            "block": self.block,
+            "exists": self.exists,
+            "target": self.target(),
+            "previous": self.previous(),
+        }
+
+    # =========================================================================
+    # Utilities
+    # =========================================================================
+
+    # Method used to set the view on another block
+    def read(self, block):
+        result = self.storage.read_buffer(block)
+
+        if result is None:
+            self.exists = False
+            self.buffer = None
+            self.offset = 0
+        else:
+            self.exists = True
+            self.buffer, self.offset = result
+            self.block = block
+
+    # Method used to decode a register
+    def register(self, register):
+        if self.buffer is None:
+            return 0
+
+        return LINK_STORE_NODE_FIELD_STRUCT.unpack_from(
+            self.buffer, self.offset + LINK_STORE_NODE_FIELD_OFFSETS[register]
+        )[0]
+
+    # Method returning whether this node is the root
+    def is_root(self):
+        return self.block == LINK_STORE_FIRST_DATA_BLOCK
+
+    # =========================================================================
+    # Previous block methods
+    # =========================================================================
+    def has_previous(self):
+        return self.register(LINK_STORE_NODE_PREVIOUS) != 0
+
+    def previous(self):
+        block = self.register(LINK_STORE_NODE_PREVIOUS)
+
+        if block < LINK_STORE_FIRST_DATA_BLOCK:
+            return None
+
+        return block
+
+    def read_previous(self):
+        if not self.has_previous():
+            raise LinkStoreNodeTraversalException("Node has no previous sibling.")
+
+        self.read(self.previous())
+
+    def previous_node(self):
+        if not self.has_previous():
+            raise LinkStoreNodeTraversalException("Node has no previous sibling.")
+
+        return LinkStoreNodeView(self.storage, block=self.previous())
+
+    # =========================================================================
+    # Target block methods
+    # =========================================================================
+    def has_target(self):
+        return self.register(LINK_STORE_NODE_TARGET) != 0
+
+    def target(self):
+        block = self.register(LINK_STORE_NODE_TARGET)
+
+        if block < LRU_TRIE_FIRST_DATA_BLOCK:
+            return None
+
+        return block
@@ -2,5 +2,10 @@
 # LRUTrie Endpoint
 # =============================================================================
 #
-from traph.lru_trie.lru_trie import LRUTrie
-from traph.lru_trie.node import LRU_TRIE_NODE_BLOCK_SIZE
+from traph.lru_trie.lru_trie import LRUTrie, LRU_TRIE_MAX_BST_RATIO
+from traph.lru_trie.node import LRU_TRIE_NODE_BLOCK_SIZE, LRU_TRIE_STEM_FIELD_SIZE
+from traph.lru_trie.descent_cache import LRU_TRIE_DESCENT_CACHE_SIZE
+from traph.lru_trie.windup_cache import LRU_TRIE_WINDUP_CACHE_SIZE
+from traph.lru_trie.webentity_cache import LRU_TRIE_WEBENTITY_CACHE_SIZE
+from traph.lru_trie.subtree_counters import LRU_TRIE_SUBTREE_COUNTERS_BLOCK_SIZE
+from traph.lru_trie.prefix_index import LRU_TRIE_PREFIX_INDEX_BLOCK_SIZE
@@ -0,0 +1,125 @@
+# =============================================================================
+# LRU Trie Descent Cache Class
+# =============================================================================
+#
+# Class representing a bounded cache mapping LRU prefixes to the block of
+# their last node in the trie, along with the webentity & creation rules
+# state a walk would have gathered on its way there.
+#
+# Since LRUs are most of the time added by batches sharing a long common
+# prefix, a descent can then resume from the deepest cached prefix instead
+# of searching every sibling BST from the root again.
+#
+# Note that a node never moves once written, so entries can only become
+# stale when a webentity or a creation rule is set on or removed from a node,
+# in which case the entries of the node's prefix and of its descendants must
+# be invalidated.
+#
+# The cache being shared by every reader of the Traph, its entries are only
+# ever accessed under a lock.
+#
+from collections import OrderedDict
+from threading import Lock
+
+# Default number of prefixes kept in the cache
+LRU_TRIE_DESCENT_CACHE_SIZE = 1024
+
+
+# Main class
+class LRUTrieDescentCache(object):
+    def __init__(self, capacity=LRU_TRIE_DESCENT_CACHE_SIZE):
+        # Properties
+        self.capacity = max(capacity, 1)
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+
+        return (
+            "<%(class_name)s size=%(size)s/%(capacity)s"
+            " hits=%(hits)s misses=%(misses)s>"
+        ) % {
+            "class_name": class_name,
+            "size": len(self.entries),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    # Method finding the deepest cached prefix of the given stems, restoring
+    # the walk history gathered until there. Returns the number of stems
+    # covered and the block of the last one's node, or (0, None).
+    def resume(self, stems, history):
+        prefixes = []
+        prefix = b""
+
+        for stem in stems:
+            prefix += stem
+            prefixes.append(prefix)
+
+        with self.lock:
+            for i in range(len(prefixes) - 1, -1, -1):
+                entry = self.entries.get(prefixes[i])
+
+                if entry is None:
+                    continue
+
+                self.hits += 1
+                self.entries.move_to_end(prefixes[i])
+
+                block, snapshot = entry
+                history.restore(snapshot)
+
+                return i + 1, block
+
+            self.misses += 1
+
+        return 0, None
+
+    # Method storing the given prefix's block along with the walk's history
+    def set(self, prefix, block, history):
+        entry = (block, history.snapshot())
+
+        with self.lock:
+            self.entries[prefix] = entry
+            self.entries.move_to_end(prefix)
+
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    # Method dropping the entries of the given prefix and of its descendants
+    def invalidate(self, prefix):
+        with self.lock:
+            stale = [key for key in self.entries if key.startswith(prefix)]
+
+            for key in stale:
+                del self.entries[key]
+
+            self.invalidations += 1
+
+    # Method dropping every entry
+    def clear(self):
+        with self.lock:
+            self.entries = OrderedDict()
+
+    # Method returning the cache's counters
+    def metrics(self):
+        lookups = self.hits + self.misses
+
+        return {
+            "capacity": self.capacity,
+            "nb_prefixes": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_ratio": self.hits / float(lookups) if lookups else 0.0,
+        }
@@ -15,7 +15,7 @@ from traph.version import __version__ as TRAPH_VERSION
 # some rules (namely have even addresses or addresses divisible by 4 on some
 # architecture).
 # NOTE: the size of the header struct MUST match the node's one.
-LRU_TRIE_HEADER_FORMAT = "I12p112x"
+LRU_TRIE_HEADER_FORMAT = "I12pBB5Q64x"
 LRU_TRIE_HEADER_BLOCK_SIZE = struct.calcsize(LRU_TRIE_HEADER_FORMAT)
 
 # Header blocks
@@ -27,6 +27,26 @@ LRU_TRIE_HEADER_BLOCKS = 1
 # Positions
 LRU_TRIE_HEADER_LAST_WEBENTITY_ID = 0
 LRU_TRIE_HEADER_TRAPH_VERSION = 1
+LRU_TRIE_HEADER_EXACT_COUNTERS = 2
+LRU_TRIE_HEADER_SUBTREE_COUNTERS = 3
+LRU_TRIE_HEADER_NB_PAGES = 4
+LRU_TRIE_HEADER_NB_CRAWLED_PAGES = 5
+LRU_TRIE_HEADER_NB_NODES = 6
+LRU_TRIE_HEADER_NB_TAIL_NODES = 7
+LRU_TRIE_HEADER_NB_WEBENTITY_PREFIXES = 8
+
+# Counters
+# -
+# The counters are only exact if the flag preceding them is set. Files
+# predating them read it as 0 & an open Traph clears it until it is cleanly
+# closed, so that a crash cannot leave stale counters behind.
+LRU_TRIE_HEADER_COUNTERS = [
+    LRU_TRIE_HEADER_NB_PAGES,
+    LRU_TRIE_HEADER_NB_CRAWLED_PAGES,
+    LRU_TRIE_HEADER_NB_NODES,
+    LRU_TRIE_HEADER_NB_TAIL_NODES,
+    LRU_TRIE_HEADER_NB_WEBENTITY_PREFIXES,
+]
 
 
 # Main class
@@ -40,6 +60,13 @@ class LRUTrieHeader(object):
         self.data = [
             0,  # Last webentity id
             TRAPH_VERSION.encode(),  # Traph version
+            1,  # Whether the counters are exact
+            0,  # Whether the trie maintains subtree counters
+            0,  # Number of pages
+            0,  # Number of crawled pages
+            0,  # Number of nodes, tail nodes included
+            0,  # Number of tail nodes
+            0,  # Number of webentity prefixes
         ]
 
         self.__ensure()
@@ -51,11 +78,15 @@ class LRUTrieHeader(object):
         return (
             "<%(class_name)s"
             " version=%(version)s"
-            " last_webentity_id=%(last_webentity_id)s>"
+            " last_webentity_id=%(last_webentity_id)s"
+            " exact_counters=%(exact_counters)s"
+            " subtree_counters=%(subtree_counters)s>"
         ) % {
             "class_name": class_name,
             "version": self.get_version(),
             "last_webentity_id": self.last_webentity_id(),
+            "exact_counters": self.has_exact_counters(),
+            "subtree_counters": self.has_subtree_counters(),
         }
 
     def __ensure(self):
@@ -108,3 +139,24 @@ class LRUTrieHeader(object):
 
     def get_version(self):
         return self.data[LRU_TRIE_HEADER_TRAPH_VERSION]
+
+    def has_exact_counters(self):
+        return bool(self.data[LRU_TRIE_HEADER_EXACT_COUNTERS])
+
+    def set_exact_counters(self, exact):
+        self.data[LRU_TRIE_HEADER_EXACT_COUNTERS] = int(exact)
+
+    def has_subtree_counters(self):
+        return bool(self.data[LRU_TRIE_HEADER_SUBTREE_COUNTERS])
+
+    def set_subtree_counters(self, enabled):
+        self.data[LRU_TRIE_HEADER_SUBTREE_COUNTERS] = int(enabled)
+
+    def counter(self, position):
+        return self.data[position]
+
+    def set_counter(self, position, value):
+        self.data[position] = value
+
+    def increment_counter(self, position, number=1):
+        self.data[position] += number
@@ -0,0 +1,170 @@
+# =============================================================================
+# LRU Trie Inorder Traversal Class
+# =============================================================================
+#
+# Class representing the inorder traversal of the pages of a webentity, i.e.
+# of the nodes found below one of its prefixes, the nested webentities
+# excluded, in LRU order.
+#
+# Each node is given a path recording how it was reached from the prefix's
+# node, as a base 4 integer whose digits are 1 for a left pointer, 2 for a
+# child pointer and 3 for a right pointer.
+#
+# The traversal does not rely on recursive generators, which would make
+# each yielded node go up through one generator per level of depth, but on
+# an explicit stack of frames. The frames, and the node view each one holds,
+# are kept & reused when the traversal goes back up, and a node's right
+# sibling reuses its frame since there is nothing left to do for the node
+# itself once its right subtree is reached.
+#
+# Since the stack is fully determined by the path of the current node, a
+# traversal can be resumed right after any node by rebuilding its stack from
+# the node's path, without walking the nodes preceding it.
+#
+from traph.helpers import base4_append
+from traph.lru_trie.node import LRUTrieNodeTraversalException
+from traph.lru_trie.view import LRUTrieNodeView
+
+# States of a frame
+LRU_TRIE_INORDER_LEFT = 0
+LRU_TRIE_INORDER_NODE = 1
+LRU_TRIE_INORDER_RIGHT = 2
+
+
+class LRUTrieInorderFrame(object):
+    __slots__ = ("node", "lru", "path", "state")
+
+    def __init__(self, storage):
+        self.node = LRUTrieNodeView(storage)
+        self.lru = None
+        self.path = 0
+        self.state = LRU_TRIE_INORDER_LEFT
+
+
+# Main class
+class LRUTrieInorderTraversal(object):
+    __slots__ = ("storage", "starting_block", "starting_lru", "frames", "depth")
+
+    def __init__(self, storage, starting_block, starting_lru):
+        # Properties
+        self.storage = storage
+        self.starting_block = starting_block
+        self.starting_lru = starting_lru
+        self.frames = []
+        self.depth = 0
+
+        self.__push(starting_block, starting_lru, 0)
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+
+        return ("<%(class_name)s block=%(block)s depth=%(depth)s>") % {
+            "class_name": class_name,
+            "block": self.starting_block,
+            "depth": self.depth,
+        }
+
+    # Method pushing a frame set on the given block onto the stack
+    def __push(self, block, lru, path):
+        if self.depth == len(self.frames):
+            frame = LRUTrieInorderFrame(self.storage)
+            self.frames.append(frame)
+        else:
+            frame = self.frames[self.depth]
+
+        frame.node.read(block)
+        frame.lru = lru
+        frame.path = path
+        frame.state = LRU_TRIE_INORDER_LEFT
+
+        self.depth += 1
+
+        return frame
+
+    # Method setting the traversal so that it resumes right after the node
+    # found at the given path, by rebuilding the stack it had when the node
+    # was yielded
+    def resume(self, path):
+        digits = []
+
+        while path:
+            digits.append(path & 3)
+            path >>= 2
+
+        self.depth = 0
+        frame = self.__push(self.starting_block, self.starting_lru, 0)
+        path = 0
+
+        for digit in reversed(digits):
+            node = frame.node
+            path = base4_append(path, digit)
+
+            # The node comes after its left subtree
+            if digit == 1 and node.has_left():
+                frame.state = LRU_TRIE_INORDER_NODE
+                frame = self.__push(node.left(), frame.lru, path)
+
+            # The node was yielded before its subtree
+            elif digit == 2 and node.has_child():
+                frame.state = LRU_TRIE_INORDER_RIGHT
+                frame = self.__push(node.child(), frame.lru + node.stem(), path)
+
+            # The node & its subtrees were done before its right sibling
+            elif digit == 3 and node.has_right():
+                node.read_right()
+                frame.path = path
+
+            else:
+                raise LRUTrieNodeTraversalException(
+                    "Pagination path does not lead to a node."
+                )
+
+        # The node itself was yielded, its subtree comes next
+        frame.state = LRU_TRIE_INORDER_RIGHT
+        node = frame.node
+
+        if node.has_child() and (
+            node.block == self.starting_block or not node.has_webentity()
+        ):
+            self.__push(node.child(), frame.lru + node.stem(), base4_append(path, 2))
+
+    # Method iterating over the traversed nodes, their LRU & their path.
+    # NOTE: the yielded node is only valid until the next step
+    def __iter__(self):
+        starting_block = self.starting_block
+        frames = self.frames
+        push = self.__push
+
+        while self.depth:
+            frame = frames[self.depth - 1]
+            node = frame.node
+
+            # The left subtree comes first, the prefix's siblings excluded
+            if frame.state == LRU_TRIE_INORDER_LEFT:
+                frame.state = LRU_TRIE_INORDER_NODE
+
+                if node.block != starting_block and node.has_left():
+                    push(node.left(), frame.lru, base4_append(frame.path, 1))
+                    continue
+
+            # Then the node itself & its subtree, unless a nested webentity's
+            if frame.state == LRU_TRIE_INORDER_NODE:
+                frame.state = LRU_TRIE_INORDER_RIGHT
+
+                if node.block == starting_block or not node.has_webentity():
+                    lru = frame.lru + node.stem()
+
+                    yield node, lru, frame.path
+
+                    if node.has_child():
+                        push(node.child(), lru, base4_append(frame.path, 2))
+                        continue
+
+            # And finally the right subtree, taking over the node's frame
+            if node.block != starting_block and node.has_right():
+                node.read_right()
+                frame.path = base4_append(frame.path, 3)
+                frame.state = LRU_TRIE_INORDER_LEFT
+                continue
+
+            self.depth -= 1
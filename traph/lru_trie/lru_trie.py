@@ -6,15 +6,121 @@
 #
 import math
 import warnings
+from collections import deque
 from traph.lru_trie.node import (
     LRUTrieNode,
     LRU_TRIE_FIRST_DATA_BLOCK,
+    LRU_TRIE_NODE_FIELD_OFFSETS,
+    LRU_TRIE_NODE_FIELD_STRUCTS,
+    LRU_TRIE_NODE_STEM,
+    LRU_TRIE_NODE_FLAGS,
+    LRU_TRIE_NODE_WEBENTITY,
+    LRU_TRIE_NODE_FLAG_PAGE,
+    LRU_TRIE_NODE_FLAG_CRAWLED,
+    LRU_TRIE_NODE_FLAG_IS_TAIL,
     LRU_TRIE_STEM_SIZE,
+    nb_blocks_for_stem,
 )
-from traph.lru_trie.header import LRUTrieHeader
+from traph.lru_trie.header import (
+    LRUTrieHeader,
+    LRU_TRIE_HEADER_NB_PAGES,
+    LRU_TRIE_HEADER_NB_CRAWLED_PAGES,
+    LRU_TRIE_HEADER_NB_NODES,
+    LRU_TRIE_HEADER_NB_TAIL_NODES,
+    LRU_TRIE_HEADER_NB_WEBENTITY_PREFIXES,
+)
+from traph.lru_trie.view import LRUTrieNodeView
+from traph.lru_trie.inorder import LRUTrieInorderTraversal
 from traph.lru_trie.walk_history import LRUTrieWalkHistory
+from traph.lru_trie.descent_cache import (
+    LRUTrieDescentCache,
+    LRU_TRIE_DESCENT_CACHE_SIZE,
+)
+from traph.lru_trie.windup_cache import (
+    LRUTrieWindupCache,
+    LRU_TRIE_WINDUP_CACHE_SIZE,
+)
+from traph.lru_trie.webentity_cache import (
+    LRUTrieWebentityCache,
+    LRU_TRIE_WEBENTITY_CACHE_SIZE,
+)
+from traph.lru_trie.subtree_counters import (
+    LRUTrieSubtreeCounters,
+    LRU_TRIE_SUBTREE_PAGES,
+    LRU_TRIE_SUBTREE_CRAWLED_PAGES,
+    LRU_TRIE_BST_PAGES,
+    LRU_TRIE_BST_CRAWLED_PAGES,
+)
+from traph.lru_trie.prefix_index import LRUTriePrefixIndex
+
+from traph.helpers import balance_bst, lru_iter, lru_dirname, base4_append
+
+# Decoders of the flags & webentity registers & masks used when counting
+FLAGS_STRUCT = LRU_TRIE_NODE_FIELD_STRUCTS[LRU_TRIE_NODE_FLAGS]
+FLAGS_OFFSET = LRU_TRIE_NODE_FIELD_OFFSETS[LRU_TRIE_NODE_FLAGS]
+WEBENTITY_STRUCT = LRU_TRIE_NODE_FIELD_STRUCTS[LRU_TRIE_NODE_WEBENTITY]
+WEBENTITY_OFFSET = LRU_TRIE_NODE_FIELD_OFFSETS[LRU_TRIE_NODE_WEBENTITY]
+PAGE_FLAG = 1 << LRU_TRIE_NODE_FLAG_PAGE
+CRAWLED_PAGE_FLAGS = PAGE_FLAG | (1 << LRU_TRIE_NODE_FLAG_CRAWLED)
+TAIL_FLAG = 1 << LRU_TRIE_NODE_FLAG_IS_TAIL
+
+# Height ratio, to a balanced BST of the same size, above which a sibling BST
+# is rebuilt by the rebalancing
+LRU_TRIE_MAX_BST_RATIO = 2.0
+
+
+# Function returning the given lrus in the order of a depth-first traversal
+# of their own trie, so that consecutive ones share their longest possible
+# prefix. Note that the stems of a same level are not visited in sorted
+# order, which would degenerate the BSTs of the siblings they create into
+# lists, but median first, breadth-wise, so that those remain balanced.
+def batch_order(lrus):
+    tree = {}
+
+    for lru in lrus:
+        level = tree
+
+        for stem in lru_iter(lru):
+            level = level.setdefault(stem, {})
+
+        level[None] = lru
+
+    order = []
+    stack = [tree]
 
-from traph.helpers import lru_iter, lru_dirname, base4_append, int_to_base4
+    while stack:
+        level = stack.pop()
+        lru = level.pop(None, None)
+
+        if lru is not None:
+            order.append(lru)
+
+        stems = sorted(level)
+        children = []
+        ranges = deque([(0, len(stems))])
+
+        while ranges:
+            start, end = ranges.popleft()
+
+            if start >= end:
+                continue
+
+            middle = (start + end) // 2
+            children.append(level[stems[middle]])
+            ranges.append((start, middle))
+            ranges.append((middle + 1, end))
+
+        stack.extend(reversed(children))
+
+    return order
+
+
+# Function returning the height, minus one, of a balanced BST of n nodes
+def max_balanced_bst_height(n):
+    if n < 2:
+        return 0
+
+    return int(math.ceil(math.log(n + 1, 2) - 1))
 
 
 # Main class
@@ -22,35 +128,131 @@ class LRUTrie(object):
     # =========================================================================
     # Constructor
     # =========================================================================
-    def __init__(self, storage, encoding="utf-8"):
+    def __init__(
+        self,
+        storage,
+        encoding="utf-8",
+        descent_cache_size=LRU_TRIE_DESCENT_CACHE_SIZE,
+        windup_cache_size=LRU_TRIE_WINDUP_CACHE_SIZE,
+        webentity_cache_size=LRU_TRIE_WEBENTITY_CACHE_SIZE,
+    ):
         # Properties
         self.storage = storage
         self.encoding = encoding
+        self.descent_cache = None
+        self.windup_cache = None
+        self.webentity_cache = None
+        self.subtree_counters = None
+        self.prefix_index = None
+
+        if descent_cache_size:
+            self.descent_cache = LRUTrieDescentCache(descent_cache_size)
+
+        if windup_cache_size:
+            self.windup_cache = LRUTrieWindupCache(windup_cache_size)
+
+        if webentity_cache_size:
+            self.webentity_cache = LRUTrieWebentityCache(webentity_cache_size)
 
         # Reading headers
         self.header = LRUTrieHeader(storage)
 
+        # Whether the header's counters can be trusted
+        self.exact_counters = self.header.has_exact_counters()
+
     # =========================================================================
     # Internal methods
     # =========================================================================
 
+    # Method resuming a descent from the deepest cached prefix of the stems,
+    # returning the number of stems covered and the prefix's node, if any
+    def __resume(self, stems, history, cache):
+        if cache is None:
+            return 0, None
+
+        i, block = cache.resume(stems, history)
+
+        if block is None:
+            return 0, None
+
+        return i, self.node(block=block)
+
+    # Method following the given lru in the trie while keeping a history
+    def __follow(self, lru):
+        stems = list(lru_iter(lru))
+        l = len(stems)
+        history = LRUTrieWalkHistory(lru)
+
+        cache = self.descent_cache
+        i, node = self.__resume(stems, history, cache)
+        lru = b"".join(stems[:i])
+
+        if node is None:
+            node = self.root()
+        elif i < l:
+            if not node.has_child():
+                return None, history
+
+            node.read_child()
+
+        while i < l:
+            stem = stems[i]
+            lru += stem
+
+            while True:
+                comparison = node.compare_stem(stem)
+
+                if comparison == 0:
+                    break
+
+                if comparison > 0:
+                    if node.has_left():
+                        node.read_left()
+                    else:
+                        return None, history
+                else:
+                    if node.has_right():
+                        node.read_right()
+                    else:
+                        return None, history
+
+            if node.has_webentity():
+                history.update_webentity(node.webentity(), lru, len(lru))
+
+            if node.has_webentity_creation_rule():
+                history.add_webentity_creation_rule(len(lru))
+
+            if cache is not None:
+                cache.set(lru, node.block, history)
+
+            i += 1
+
+            if i < l:
+                if not node.has_child():
+                    return None, history
+                else:
+                    node.read_child()
+
+        return node, history
+
     # Method ensuring that a sibling with the desired char exists
     def __ensure_stem_from_siblings(self, node, stem):
         # If the node does not exist, we create it
         if not node.exists:
             node.set_stem(stem)
             node.write()
+            self.__count_new_node(node)
             return node
 
         # Else we follow the siblings until we find a relevant one
         while True:
-            current_stem = node.stem()
+            comparison = node.compare_stem(stem)
 
-            if current_stem == stem:
+            if comparison == 0:
                 return node
 
             # Searching the BST
-            if stem < current_stem:
+            if comparison > 0:
                 if node.has_left():
                     node.read_left()
                 else:
@@ -67,8 +269,9 @@ class LRUTrie(object):
         # The new sibling's parent is the same, obviously
         sibling.set_parent(node.parent())
         sibling.write()
+        self.__count_new_node(sibling)
 
-        if stem < node.stem():
+        if comparison > 0:
             node.set_left(sibling.block)
         else:
             node.set_right(sibling.block)
@@ -77,23 +280,34 @@ class LRUTrie(object):
 
         return sibling
 
-    # =========================================================================
-    # Mutation methods
-    # =========================================================================
-
-    # Method adding a lru to the trie
-    def add_lru(self, lru, flag_can_have_child_webentities=False):
-        # Iteration state
-        # TODO: we should be able to use an iterator and not keep a list!
-        stems = list(lru_iter(lru))
+    # Method descending the trie along the given stems from the node of the
+    # i-th one's parent prefix (or from the root if none), adding the missing
+    # nodes on the way. If a path list is given, the block of each stem's
+    # node & the history gathered until there are appended to it.
+    def __descend(
+        self,
+        stems,
+        history,
+        i=0,
+        node=None,
+        flag_can_have_child_webentities=False,
+        cache=None,
+        path=None,
+    ):
         l = len(stems)
-        i = 0
-        history = LRUTrieWalkHistory(lru)
-        node = self.root()
-        lru = b""
+        lru = b"".join(stems[:i])
 
-        # Descending the trie
-        while i < l:
+        # Descending the trie, from the given prefix if any
+        descending = True
+
+        if node is None:
+            node = self.root()
+        elif i < l and node.has_child():
+            node.read_child()
+        else:
+            descending = False
+
+        while descending and i < l:
             stem = stems[i]
             lru += stem
 
@@ -116,6 +330,12 @@ class LRUTrie(object):
                 node.flag_can_have_child_webentities()
                 node.write()
 
+            if cache is not None:
+                cache.set(lru, node.block, history)
+
+            if path is not None:
+                path.append((node.block, history.snapshot()))
+
             i += 1
 
             if i < l and node.has_child():
@@ -126,6 +346,7 @@ class LRUTrie(object):
         # We went as far as possible, now we add the missing part
         while i < l:
             stem = stems[i]
+            lru += stem
 
             # Creating the child
             child = self.node(stem=stem)
@@ -136,148 +357,573 @@ class LRUTrie(object):
                 child.flag_can_have_child_webentities()
 
             child.write()
+            self.__count_new_node(child)
 
             # Linking the child to its parent
             node.set_child(child.block)
             node.write()
 
+            if cache is not None:
+                cache.set(lru, child.block, history)
+
+            if path is not None:
+                path.append((child.block, history.snapshot()))
+
             node = child
             i += 1
 
-        return node, history
+        return node
 
-    # Method adding a page to the trie
-    def add_page(self, lru, crawled=False):
-        node, history = self.add_lru(lru)
+    # Method counting a newly written node, along with its tail
+    def __count_new_node(self, node):
+        nb_blocks = nb_blocks_for_stem(node.data[LRU_TRIE_NODE_STEM] + node.tail)
+
+        self.header.increment_counter(LRU_TRIE_HEADER_NB_NODES, nb_blocks)
+        self.header.increment_counter(LRU_TRIE_HEADER_NB_TAIL_NODES, nb_blocks - 1)
+
+    # Method adding the given numbers of pages & crawled pages to the subtree
+    # counters of the given node, of its ancestors & of the BST ancestors of
+    # those, found by searching their stem from the root of their BST
+    def __count_subtree_pages(self, block, pages, crawled):
+        counters = self.subtree_counters
+        node = self.node_view(block=block)
+        sibling = self.node_view()
+
+        while True:
+            counters.add(node.block, pages, crawled, subtree=True)
+
+            stem = node.stem()
+            target = node.block
+            top = not node.has_parent()
 
-        # Flagging the node as a page
+            if top:
+                sibling.read(LRU_TRIE_FIRST_DATA_BLOCK)
+            else:
+                node.read_parent()
+                sibling.read(node.child())
+
+            while sibling.block != target:
+                counters.add(sibling.block, pages, crawled)
+
+                if sibling.compare_stem(stem) > 0:
+                    sibling.read_left()
+                else:
+                    sibling.read_right()
+
+            if top:
+                return
+
+    # Method flagging the node reached by a walk as a page
+    def __flag_page(self, node, history, crawled=False):
         if not node.is_page():
             node.flag_as_page()
+            self.header.increment_counter(LRU_TRIE_HEADER_NB_PAGES)
 
             if crawled:
                 node.flag_as_crawled()
+                self.header.increment_counter(LRU_TRIE_HEADER_NB_CRAWLED_PAGES)
 
             node.write()
             history.page_was_created = True
 
+            if self.subtree_counters is not None:
+                self.__count_subtree_pages(node.block, 1, int(crawled))
+
         elif crawled and not node.is_crawled():
-            node.flag_as_crawled()
+            self.flag_page_as_crawled(node)
 
-            node.write()
+    # =========================================================================
+    # Mutation methods
+    # =========================================================================
+
+    # Method winding up the LRU of the given parent, climbing its own parents
+    # until one of them is found in the windup cache
+    def __windup_parent(self, block):
+        cache = self.windup_cache
+        node = self.node_view(block=block)
+        stems = []
+
+        while True:
+            stems.append(node.stem())
+
+            if not node.has_parent():
+                prefix = b""
+                break
+
+            prefix = cache.get(node.parent())
+
+            if prefix is not None:
+                break
+
+            node.read_parent()
+
+        stems.append(prefix)
+
+        return b"".join(reversed(stems))
+
+    # Method returning a view of the nearest webentity-bearing node among the
+    # given block's node and its ancestors, or None, using the webentity cache
+    def __webentity_ancestor(self, block):
+        cache = self.webentity_cache
+        target = cache.get(block)
+
+        if target is not None:
+            ancestor = self.node_view(block=target)
+
+            if ancestor.has_webentity():
+                return ancestor
+
+            # The prefix was removed without invalidating the cache
+            cache.invalidate(target)
+
+        ancestor = self.node_view(block=block)
+
+        while not ancestor.has_webentity():
+            if not ancestor.has_parent():
+                return None
+
+            ancestor.read_parent()
+
+        cache.set(block, ancestor.block)
+
+        return ancestor
+
+    # Method adding a lru to the trie
+    def add_lru(self, lru, flag_can_have_child_webentities=False):
+        # Iteration state
+        # TODO: we should be able to use an iterator and not keep a list!
+        stems = list(lru_iter(lru))
+        history = LRUTrieWalkHistory(lru)
+
+        # NOTE: flagging for underlying webentities needs to visit every node
+        cache = None if flag_can_have_child_webentities else self.descent_cache
+        i, node = self.__resume(stems, history, cache)
+
+        node = self.__descend(
+            stems,
+            history,
+            i,
+            node,
+            flag_can_have_child_webentities=flag_can_have_child_webentities,
+            cache=cache,
+        )
 
         return node, history
 
+    # Method adding a page to the trie
+    def add_page(self, lru, crawled=False):
+        node, history = self.add_lru(lru)
+
+        self.__flag_page(node, history, crawled)
+
+        return node, history
+
+    # Method adding a batch of pages to the trie, given as a dict mapping
+    # lrus to their crawled flag. The lrus are ordered by prefix so that two
+    # consecutive ones share their longest possible prefix & the path of the
+    # previous one is kept so that each descent only starts from the node of
+    # the common prefix. Yields the lru, node & history of each page.
+    # NOTE: the yielded histories do not account for webentities that would
+    # be created while iterating.
+    def add_page_batch_iter(self, pages):
+        path = []
+        previous_stems = []
+
+        for lru in batch_order(pages):
+            stems = list(lru_iter(lru))
+            history = LRUTrieWalkHistory(lru)
+
+            # Finding the number of stems shared with the previous lru
+            i = 0
+            m = min(len(stems), len(previous_stems))
+
+            while i < m and stems[i] == previous_stems[i]:
+                i += 1
+
+            del path[i:]
+
+            node = None
+
+            if i:
+                block, snapshot = path[i - 1]
+                history.restore(snapshot)
+                node = self.node(block=block)
+
+            node = self.__descend(stems, history, i, node, path=path)
+
+            self.__flag_page(node, history, pages[lru])
+
+            previous_stems = stems
+
+            yield lru, node, history
+
+    # Method flagging the given page's node as crawled
+    def flag_page_as_crawled(self, node):
+        if node.is_crawled():
+            node.write()
+            return
+
+        node.flag_as_crawled()
+        self.header.increment_counter(LRU_TRIE_HEADER_NB_CRAWLED_PAGES)
+
+        node.write()
+
+        if self.subtree_counters is not None:
+            self.__count_subtree_pages(node.block, 0, 1)
+
+    # Method invalidating the cached descents going through the given prefix,
+    # to be called whenever a webentity or a creation rule is set on or
+    # removed from the prefix's node
+    def invalidate_descent_cache(self, prefix):
+        if self.descent_cache is not None:
+            self.descent_cache.invalidate(prefix)
+
+    # Method setting the given webentity on the given prefix's node
+    def set_webentity(self, node, prefix, weid):
+        if not node.has_webentity():
+            self.header.increment_counter(LRU_TRIE_HEADER_NB_WEBENTITY_PREFIXES)
+        elif self.prefix_index is not None:
+            self.prefix_index.remove(node.webentity(), node.block)
+
+        node.set_webentity(weid)
+        node.write()
+
+        if self.prefix_index is not None:
+            self.prefix_index.add(weid, node.block)
+
+        self.invalidate_descent_cache(prefix)
+        self.invalidate_webentity_cache(node)
+
+    # Method removing the webentity of the given prefix's node
+    def unset_webentity(self, node, prefix):
+        if node.has_webentity():
+            self.header.increment_counter(LRU_TRIE_HEADER_NB_WEBENTITY_PREFIXES, -1)
+
+            if self.prefix_index is not None:
+                self.prefix_index.remove(node.webentity(), node.block)
+
+        node.unset_webentity()
+        node.write()
+
+        self.invalidate_descent_cache(prefix)
+        self.invalidate_webentity_cache(node)
+
+    # Method invalidating the webentity cache's stale entries, to be called
+    # whenever a webentity is set on or removed from the given node
+    def invalidate_webentity_cache(self, node):
+        cache = self.webentity_cache
+
+        if cache is None:
+            return
+
+        # The entries pointing to the node itself are now dangling
+        if not node.has_webentity():
+            cache.invalidate(node.block)
+            return
+
+        # The entries which could go through the node now point too high
+        if node.has_parent():
+            ancestor = self.__webentity_ancestor(node.parent())
+
+            if ancestor is not None:
+                cache.invalidate(ancestor.block)
+
     # =========================================================================
-    # Read methods
+    # Maintenance methods
     # =========================================================================
 
-    # Method returning a node
-    def node(self, **kwargs):
-        return LRUTrieNode(self.storage, **kwargs)
+    # Method flagging the counters as being in use, so that they are not
+    # trusted anymore if the trie is not cleanly closed
+    def open_counters(self):
+        self.header.set_exact_counters(False)
+        self.header.write()
+
+    # Method persisting the counters, flagging them as exact if the trie is
+    # being cleanly closed
+    def write_counters(self, close=False):
+        self.header.set_exact_counters(close and self.exact_counters)
+        self.header.write()
+
+    # Method maintaining subtree counters in the given storage from now on.
+    # NOTE: rebuild_subtree_counters must be run if the trie has pages
+    def use_subtree_counters(self, storage):
+        self.subtree_counters = LRUTrieSubtreeCounters(storage)
+
+        self.header.set_subtree_counters(True)
+        self.header.write()
+
+    # Method maintaining the webentity prefix index in the given storage from
+    # now on, rebuilding it from the trie unless it was cleanly closed
+    def use_prefix_index(self, storage):
+        index = LRUTriePrefixIndex(storage)
+
+        if index.load():
+            index.open()
+        else:
+            index.rebuild(
+                (node.webentity(), node.block)
+                for node, _ in self.webentity_prefix_iter()
+            )
 
-    # Method returning root node
-    def root(self):
-        return self.node(block=LRU_TRIE_FIRST_DATA_BLOCK)
+        self.prefix_index = index
 
-    def lru_node(self, lru):
-        node = self.root()
+    # Method persisting the webentity prefix index, flagging it as cleanly
+    # closed
+    def close_prefix_index(self):
+        index = self.prefix_index
 
-        stems = list(lru_iter(lru))
-        l = len(stems)
+        if index is None:
+            return
 
-        for i in range(l):
-            stem = stems[i]
+        if index.is_fragmented():
+            index.compact()
 
-            while True:
-                current_stem = node.stem()
+        index.close()
 
-                if current_stem == stem:
-                    break
+    # Method recomputing the subtree counters of every node, children first
+    def rebuild_subtree_counters(self):
+        counters = self.subtree_counters
 
-                if stem < current_stem:
-                    if node.has_left():
-                        node.read_left()
-                    else:
-                        return
-                else:
-                    if node.has_right():
-                        node.read_right()
-                    else:
-                        return
+        if not self.root().exists:
+            return
 
-            if i < l - 1:
-                if not node.has_child():
-                    return
-                else:
-                    node.read_child()
+        stack = [(LRU_TRIE_FIRST_DATA_BLOCK, False)]
+        node = self.node_view()
 
-        return node
+        while stack:
+            block, visited = stack.pop()
+            node.read(block)
 
-    def follow_lru(self, lru):
-        # Does almost the same thing as lru_node but with a history,
-        # and thus less efficient.
-        # Very similar to add_lru too, but returns False if lru not in Trie
+            if not visited:
+                stack.append((block, True))
 
-        node = self.root()
-        history = LRUTrieWalkHistory(lru)
+                if node.has_left():
+                    stack.append((node.left(), False))
 
-        stems = list(lru_iter(lru))
-        lru = b""
-        l = len(stems)
+                if node.has_right():
+                    stack.append((node.right(), False))
 
-        for i in range(l):
-            stem = stems[i]
-            lru += stem
+                if node.has_child():
+                    stack.append((node.child(), False))
 
-            while True:
-                current_stem = node.stem()
+                continue
 
-                if current_stem == stem:
-                    break
+            pages = int(node.is_page())
+            crawled = int(node.is_page() and node.is_crawled())
 
-                if stem < current_stem:
-                    if node.has_left():
-                        node.read_left()
-                    else:
-                        return None, history
-                else:
-                    if node.has_right():
-                        node.read_right()
-                    else:
-                        return None, history
+            if node.has_child():
+                child = counters.read(node.child())
+                pages += child[LRU_TRIE_BST_PAGES]
+                crawled += child[LRU_TRIE_BST_CRAWLED_PAGES]
+
+            record = [pages, crawled, pages, crawled]
+
+            for sibling in (node.left(), node.right()):
+                if sibling:
+                    sibling_counters = counters.read(sibling)
+                    record[LRU_TRIE_BST_PAGES] += sibling_counters[LRU_TRIE_BST_PAGES]
+                    record[LRU_TRIE_BST_CRAWLED_PAGES] += sibling_counters[
+                        LRU_TRIE_BST_CRAWLED_PAGES
+                    ]
+
+            counters.write(block, record)
+
+    # Method recomputing the counters by scanning every block
+    def rebuild_counters(self):
+        counters = dict.fromkeys(
+            [
+                LRU_TRIE_HEADER_NB_PAGES,
+                LRU_TRIE_HEADER_NB_CRAWLED_PAGES,
+                LRU_TRIE_HEADER_NB_NODES,
+                LRU_TRIE_HEADER_NB_TAIL_NODES,
+                LRU_TRIE_HEADER_NB_WEBENTITY_PREFIXES,
+            ],
+            0,
+        )
 
-            if node.has_webentity():
-                history.update_webentity(node.webentity(), lru, len(lru))
+        for data in self.__registers_iter():
+            flags = FLAGS_STRUCT.unpack_from(data, FLAGS_OFFSET)[0]
 
-            if node.has_webentity_creation_rule():
-                history.add_webentity_creation_rule(len(lru))
+            counters[LRU_TRIE_HEADER_NB_NODES] += 1
 
-            if i < l - 1:
-                if not node.has_child():
-                    return None, history
-                else:
-                    node.read_child()
+            if flags & TAIL_FLAG:
+                counters[LRU_TRIE_HEADER_NB_TAIL_NODES] += 1
+                continue
 
-        return node, history
+            if flags & PAGE_FLAG:
+                counters[LRU_TRIE_HEADER_NB_PAGES] += 1
+
+            if flags & CRAWLED_PAGE_FLAGS == CRAWLED_PAGE_FLAGS:
+                counters[LRU_TRIE_HEADER_NB_CRAWLED_PAGES] += 1
+
+            if WEBENTITY_STRUCT.unpack_from(data, WEBENTITY_OFFSET)[0]:
+                counters[LRU_TRIE_HEADER_NB_WEBENTITY_PREFIXES] += 1
+
+        for position, value in counters.items():
+            self.header.set_counter(position, value)
+
+        self.exact_counters = True
+        self.header.write()
+
+        return counters
+
+    # Method rebuilding the sibling BST made of the given sorted blocks as a
+    # balanced tree, in place: only the left & right pointers of its nodes
+    # and the child pointer of their parent are rewritten. The root of the
+    # top-level BST being the trie's entry point, it is kept as is & its two
+    # subtrees are balanced instead.
+    def rebalance_bst(self, blocks):
+        lefts = dict.fromkeys(blocks, 0)
+        rights = dict.fromkeys(blocks, 0)
+
+        if LRU_TRIE_FIRST_DATA_BLOCK in lefts:
+            root = LRU_TRIE_FIRST_DATA_BLOCK
+            i = blocks.index(root)
+
+            lefts[root] = balance_bst(blocks[:i], lefts, rights)
+            rights[root] = balance_bst(blocks[i + 1 :], lefts, rights)
+        else:
+            root = balance_bst(blocks, lefts, rights)
+
+        node = self.node()
+
+        for block in blocks:
+            node.read(block)
+
+            if lefts[block]:
+                node.set_left(lefts[block])
+            else:
+                node.unset_left()
+
+            if rights[block]:
+                node.set_right(rights[block])
+            else:
+                node.unset_right()
+
+            node.write()
+
+        if node.has_parent():
+            parent = self.node(block=node.parent())
+            parent.set_child(root)
+            parent.write()
+
+        if self.subtree_counters is not None:
+            self.__recount_bst(root, lefts, rights)
+
+        # NOTE: the descent cache only stores the blocks of the nodes, which
+        # are not moved, so there is no need to invalidate it
+
+    # Method recomputing the BST counters of the nodes of a rebuilt BST, given
+    # its new pointers, their own subtree counters being left untouched
+    def __recount_bst(self, root, lefts, rights):
+        counters = self.subtree_counters
+        records = {}
+        stack = [(root, False)]
+
+        while stack:
+            block, visited = stack.pop()
+            siblings = [b for b in (lefts[block], rights[block]) if b]
+
+            if not visited:
+                stack.append((block, True))
+                stack.extend((sibling, False) for sibling in siblings)
+                continue
+
+            record = counters.read(block)
+            record[LRU_TRIE_BST_PAGES] = record[LRU_TRIE_SUBTREE_PAGES]
+            record[LRU_TRIE_BST_CRAWLED_PAGES] = record[LRU_TRIE_SUBTREE_CRAWLED_PAGES]
+
+            for sibling in siblings:
+                record[LRU_TRIE_BST_PAGES] += records[sibling][LRU_TRIE_BST_PAGES]
+                record[LRU_TRIE_BST_CRAWLED_PAGES] += records[sibling][
+                    LRU_TRIE_BST_CRAWLED_PAGES
+                ]
+
+            records[block] = record
+            counters.write(block, record)
+
+    # Method rebuilding the sibling BSTs whose height is more than max_ratio
+    # times the one of a balanced BST of the same size. Yields the size,
+    # ratio & whether it was rebuilt for each BST, so that the operation can
+    # be interleaved with writes.
+    def rebalance_iter(self, max_ratio=LRU_TRIE_MAX_BST_RATIO):
+        for blocks, height in self.bsts_iter():
+            size = len(blocks)
+            ratio = height / float(max_balanced_bst_height(size) + 1)
+
+            if ratio <= max_ratio:
+                yield size, ratio, False
+                continue
+
+            self.rebalance_bst(blocks)
+
+            yield size, ratio, True
+
+    # =========================================================================
+    # Read methods
+    # =========================================================================
+
+    # Method returning a node
+    def node(self, **kwargs):
+        return LRUTrieNode(self.storage, **kwargs)
+
+    # Method returning a read-only view over a node
+    def node_view(self, **kwargs):
+        return LRUTrieNodeView(self.storage, **kwargs)
+
+    # Method returning root node
+    def root(self):
+        return self.node(block=LRU_TRIE_FIRST_DATA_BLOCK)
+
+    def lru_node(self, lru):
+        node, _ = self.__follow(lru)
+
+        return node
+
+    def follow_lru(self, lru):
+        # Same as lru_node but also returning the walk's history.
+        # Very similar to add_lru too, but returns None if lru not in Trie
+        return self.__follow(lru)
 
     def windup_lru(self, block):
         # TODO: check block
-        node = self.node(block=block)
+        node = self.node_view(block=block)
+        cache = self.windup_cache
+
+        if cache is None:
+            lru = node.stem()
 
-        lru = node.stem()
+            for parent in self.node_parents_iter(node):
+                lru = parent.stem() + lru
 
-        for parent in self.node_parents_iter(node):
-            lru = parent.stem() + lru
+            return lru
 
-        return lru
+        if not node.has_parent():
+            return node.stem()
+
+        parent_block = node.parent()
+        prefix = cache.get(parent_block)
+
+        if prefix is None:
+            prefix = self.__windup_parent(parent_block)
+            cache.set(parent_block, prefix)
+
+        return prefix + node.stem()
 
     def windup_lru_for_webentity(self, node):
         if node.has_webentity():
             return node.webentity()
 
-        for parent in self.node_parents_iter(node):
-            if parent.has_webentity():
-                return parent.webentity()
+        if self.webentity_cache is None:
+            for parent in self.node_parents_iter(node):
+                if parent.has_webentity():
+                    return parent.webentity()
+
+        elif node.has_parent():
+            ancestor = self.__webentity_ancestor(node.parent())
+
+            if ancestor is not None:
+                return ancestor.webentity()
 
         # We could not find a webentity for the given node, we should warn
         warnings.warn(
@@ -291,18 +937,48 @@ class LRUTrie(object):
     # Iteration methods
     # =========================================================================
     def nodes_iter(self):
-        node = self.root()
+        """
+        Note that the blocks are read sequentially by large chunks and that a
+        node's tail blocks are yielded right after it.
+        """
+        node = self.node()
+        blocks = self.storage.iter_blocks(LRU_TRIE_FIRST_DATA_BLOCK)
+
+        for block, data in blocks:
+            node.load(block, data)
+
+            if not node.has_tail():
+                yield node
+                continue
+
+            # Gathering the tail blocks, which directly follow their head
+            tail_blocks = []
+
+            for tail_block, tail_data in blocks:
+                tail_blocks.append((tail_block, tail_data))
+                node.load(tail_block, tail_data)
+
+                if not node.has_tail():
+                    break
+
+            node.load(block, data)
+            node.tail = b"".join(
+                node.unpack(tail_data)[LRU_TRIE_NODE_STEM]
+                for _, tail_data in tail_blocks
+            )
 
-        while node.exists:
             yield node
-            node.read(node.block + self.storage.block_size)
+
+            for tail_block, tail_data in tail_blocks:
+                node.load(tail_block, tail_data)
+                yield node
 
     def node_parents_iter(self, node):
         # TODO: block
         if not node.has_parent():
             return
 
-        parent = node.parent_node()
+        parent = self.node_view(block=node.parent())
 
         yield parent
 
@@ -331,7 +1007,7 @@ class LRUTrie(object):
             return
 
         stack = [(starting_block, starting_lru)]
-        node = self.node()
+        node = self.node_view()
 
         while len(stack):
             block, lru = stack.pop()
@@ -354,6 +1030,50 @@ class LRUTrie(object):
             if node.has_child():
                 stack.append((node.child(), current_lru))
 
+    def bsts_iter(self):
+        """
+        Yields the sorted blocks of each sibling BST's nodes, along with the
+        BST's height. Note that a BST's blocks are all read before it is
+        yielded, so that it can safely be modified in between.
+        """
+        if not self.root().exists:
+            return
+
+        stack = [LRU_TRIE_FIRST_DATA_BLOCK]
+        node = self.node_view()
+
+        while stack:
+            blocks = []
+            children = []
+            height = 0
+
+            # Inorder traversal of the BST
+            bst_stack = []
+            block = stack.pop()
+            depth = 1
+
+            while bst_stack or block:
+                while block:
+                    node.read(block)
+                    bst_stack.append((block, depth, node.right(), node.child()))
+                    block = node.left()
+                    depth += 1
+
+                block, depth, right, child = bst_stack.pop()
+
+                blocks.append(block)
+                height = max(height, depth)
+
+                if child:
+                    children.append(child)
+
+                block = right
+                depth += 1
+
+            stack.extend(reversed(children))
+
+            yield blocks, height
+
     def webentity_dfs_iter(self, starting_node, starting_lru, max_depth=None):
         """
         Note that this algorithm will peruse the webentity nodes only for the
@@ -369,7 +1089,7 @@ class LRUTrie(object):
             return
 
         stack = [(starting_block, starting_lru, 0)]
-        node = self.node()
+        node = self.node_view()
 
         while len(stack):
             block, lru, level = stack.pop()
@@ -398,80 +1118,21 @@ class LRUTrie(object):
 
     def webentity_inorder_iter(self, starting_node, starting_lru, pagination_path=None):
         """
-        Note that it would be fairly easy to resume traversal from any given
-        lru. It could simplify the pagination token scheme.
-        """
-
-        starting_lru = lru_dirname(starting_lru)
-        pagination_lru = None
-        comparison_path = None
-
-        def follow_path(p: str):
-            n = self.node(block=starting_node.block)
-            lru = starting_lru
-
-            for op in p:
-                if op == "1":
-                    n.read_left()
-                elif op == "2":
-                    lru += n.stem()
-                    n.read_child()
-                else:
-                    n.read_right()
+        Iterates over the nodes found below the given webentity prefix's node,
+        nested webentities excluded, in LRU order, along with their LRU & the
+        base 4 path leading to them.
 
-            return lru + n.stem()
+        If pagination_path is given, the traversal resumes right after the
+        node found at this path, without walking the nodes preceding it.
+        """
+        traversal = LRUTrieInorderTraversal(
+            self.storage, starting_node.block, lru_dirname(starting_lru)
+        )
 
         if pagination_path is not None:
-            comparison_path = (
-                int_to_base4(pagination_path) if pagination_path != 0 else ""
-            )
-            pagination_lru = follow_path(comparison_path)
-
-        def can_follow_path(current_path):
-            if current_path == 0:
-                return True
-
-            current_path = int_to_base4(current_path)
-
-            p = comparison_path[: len(current_path)]
-
-            return current_path >= p
-
-        def inorder_traversal(node, lru, path=0):
-            # NOTE: could be done before this call to avoid reading too much from file
-            if pagination_path is not None and not can_follow_path(path):
-                return
-
-            if node.block != starting_node.block:
-                if node.has_left():
-                    for item in inorder_traversal(
-                        node.left_node(), lru, base4_append(path, 1)
-                    ):
-                        yield item
-
-            current_lru = lru + node.stem()
-            relevant_node = (
-                node.block == starting_node.block or not node.has_webentity()
-            )
-
-            if relevant_node:
-                if pagination_path is None or current_lru > pagination_lru:
-                    yield node, current_lru, path
+            traversal.resume(pagination_path)
 
-                if node.has_child():
-                    for item in inorder_traversal(
-                        node.child_node(), current_lru, base4_append(path, 2)
-                    ):
-                        yield item
-
-            if node.block != starting_node.block:
-                if node.has_right():
-                    for item in inorder_traversal(
-                        node.right_node(), lru, base4_append(path, 3)
-                    ):
-                        yield item
-
-        for item in inorder_traversal(starting_node, starting_lru):
+        for item in traversal:
             yield item
 
     def dfs_with_webentity_iter(self):
@@ -483,7 +1144,7 @@ class LRUTrie(object):
             return
 
         stack = [(starting_block, None)]
-        node = self.node()
+        node = self.node_view()
 
         while len(stack):
             block, webentity = stack.pop()
@@ -518,26 +1179,218 @@ class LRUTrie(object):
     # =========================================================================
     # Counting methods
     # =========================================================================
+
+    # Method iterating over the raw data of every block, tail blocks included,
+    # whose registers only are meant to be decoded
+    def __registers_iter(self):
+        if hasattr(self.storage, "iter_registers"):
+            blocks = self.storage.iter_registers(LRU_TRIE_FIRST_DATA_BLOCK)
+        else:
+            blocks = self.storage.iter_blocks(LRU_TRIE_FIRST_DATA_BLOCK)
+
+        for _, data in blocks:
+            yield data
+
+    def flags_iter(self):
+        """
+        Yields the flags of every block, tail blocks included, without
+        decoding the rest of the nodes nor, when the storage keeps them
+        apart, reading the stems.
+        """
+        for data in self.__registers_iter():
+            yield FLAGS_STRUCT.unpack_from(data, FLAGS_OFFSET)[0]
+
+    # Method returning the given counter, if exact, or None
+    def counter(self, position):
+        if not self.exact_counters:
+            return None
+
+        return self.header.counter(position)
+
+    def count_nodes(self):
+        nb = self.counter(LRU_TRIE_HEADER_NB_NODES)
+
+        if nb is None:
+            nb = sum(1 for _ in self.flags_iter())
+
+        return nb
+
+    def count_tail_nodes(self):
+        nb = self.counter(LRU_TRIE_HEADER_NB_TAIL_NODES)
+
+        if nb is None:
+            nb = sum(1 for flags in self.flags_iter() if flags & TAIL_FLAG)
+
+        return nb
+
+    def count_webentity_prefixes(self):
+        nb = self.counter(LRU_TRIE_HEADER_NB_WEBENTITY_PREFIXES)
+
+        if nb is None:
+            nb = sum(1 for _ in self.webentity_prefix_iter())
+
+        return nb
+
     def count_pages(self):
+        nb = self.counter(LRU_TRIE_HEADER_NB_PAGES)
+
+        if nb is not None:
+            return nb
+
         nb = 0
 
-        # Here we don't need a DFS so we can plainly iterate over the nodes
-        for node in self.nodes_iter():
-            if node.is_page():
+        # Here we don't need a DFS so we can plainly iterate over the flags
+        for flags in self.flags_iter():
+            if flags & PAGE_FLAG:
                 nb += 1
 
         return nb
 
     def count_crawled_pages(self):
+        nb = self.counter(LRU_TRIE_HEADER_NB_CRAWLED_PAGES)
+
+        if nb is not None:
+            return nb
+
         nb = 0
 
-        # Here we don't need a DFS so we can plainly iterate over the nodes
-        for node in self.nodes_iter():
-            if node.is_page() and node.is_crawled():
+        # Here we don't need a DFS so we can plainly iterate over the flags
+        for flags in self.flags_iter():
+            if flags & CRAWLED_PAGE_FLAGS == CRAWLED_PAGE_FLAGS:
                 nb += 1
 
         return nb
 
+    # Method returning whether the given node is a page, or a crawled page
+    def __own_pages(self, node, crawled):
+        return int(node.is_page() and (not crawled or node.is_crawled()))
+
+    # Method returning the number of pages, or of crawled pages, found in the
+    # subtree of the given node, those of the webentities nested below it
+    # excluded
+    def __webentity_subtree_pages(self, node, crawled):
+        if not node.can_have_child_webentities():
+            counters = self.subtree_counters.read(node.block)
+            return counters[LRU_TRIE_SUBTREE_PAGES + crawled]
+
+        nb = self.__own_pages(node, crawled)
+
+        if node.has_child():
+            nb += self.__webentity_bst_pages(node.child(), crawled, True)
+
+        return nb
+
+    # Method returning the number of pages, or of crawled pages, found in the
+    # BST rooted at the given block, those of the nested webentities excluded.
+    # Since only the ancestors of a webentity prefix can have child
+    # webentities, the BST is only traversed if its parent can.
+    def __webentity_bst_pages(self, block, crawled, nested):
+        if not nested:
+            return self.subtree_counters.read(block)[LRU_TRIE_BST_PAGES + crawled]
+
+        nb = 0
+        stack = [block]
+        node = self.node_view()
+
+        while stack:
+            node.read(stack.pop())
+
+            if node.has_left():
+                stack.append(node.left())
+
+            if node.has_right():
+                stack.append(node.right())
+
+            if not node.has_webentity():
+                nb += self.__webentity_subtree_pages(node, crawled)
+
+        return nb
+
+    def count_webentity_pages(self, starting_node, crawled=False):
+        """
+        Returns the number of pages, or of crawled pages, found below the
+        given webentity prefix's node, as webentity_inorder_iter would yield
+        them, using the subtree counters.
+        """
+        crawled = int(crawled)
+        nb = self.__own_pages(starting_node, crawled)
+
+        if starting_node.has_child():
+            nb += self.__webentity_bst_pages(
+                starting_node.child(),
+                crawled,
+                starting_node.can_have_child_webentities(),
+            )
+
+        return nb
+
+    def webentity_page_path(self, starting_node, offset, crawled=False):
+        """
+        Returns the path, as given by webentity_inorder_iter, of the page found
+        at the given offset among the pages, or crawled pages, found below the
+        given webentity prefix's node, or None if there are not as many.
+
+        The BSTs are descended using the subtree counters, skipping whole
+        subtrees, rather than iterating over the preceding pages.
+        """
+        crawled = int(crawled)
+        node = self.node_view(block=starting_node.block)
+        path = 0
+
+        if self.__own_pages(node, crawled):
+            if offset == 0:
+                return path
+
+            offset -= 1
+
+        if not node.has_child():
+            return None
+
+        nested = node.can_have_child_webentities()
+        block = node.child()
+        path = base4_append(path, 2)
+
+        while True:
+            node.read(block)
+
+            # Skipping the left subtree, unless the page is found there
+            if node.has_left():
+                nb = self.__webentity_bst_pages(node.left(), crawled, nested)
+
+                if offset < nb:
+                    block = node.left()
+                    path = base4_append(path, 1)
+                    continue
+
+                offset -= nb
+
+            # Then the node itself & its subtree, unless nested webentities
+            if not node.has_webentity():
+                if self.__own_pages(node, crawled):
+                    if offset == 0:
+                        return path
+
+                    offset -= 1
+
+                if node.has_child():
+                    child_nested = node.can_have_child_webentities()
+                    nb = self.__webentity_bst_pages(node.child(), crawled, child_nested)
+
+                    if offset < nb:
+                        nested = child_nested
+                        block = node.child()
+                        path = base4_append(path, 2)
+                        continue
+
+                    offset -= nb
+
+            # And finally the right subtree
+            if not node.has_right():
+                return None
+
+            block = node.right()
+            path = base4_append(path, 3)
+
     def metrics(self):
         stats = {
             "nb_nodes": 0,
@@ -609,12 +1462,6 @@ class LRUTrie(object):
 
             return False
 
-        def max_balanced_bst_height(n):
-            if n < 2:
-                return 0
-
-            return int(math.ceil(math.log(n + 1, 2) - 1))
-
         def bst_dfs_iter(node):
             stack = [(node.block, 0)]
 
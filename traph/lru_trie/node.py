@@ -4,12 +4,15 @@
 #
 # Class representing a single node from the LRU trie.
 #
-# Note that it should be possible to speed up targeted updates by only
-# writing the updated fields (typically when setting a pointer).
+# Note that the node keeps track of the registers modified since it was read
+# so that targeted updates (typically when setting a pointer or a flag) only
+# write the updated fields, at their exact offsets in the block, and so that
+# writing a node which did not change does nothing.
 #
 # TODO: we can be more compact for some things
 #
 import struct
+from itertools import chain
 from traph.lru_trie.header import LRU_TRIE_HEADER_BLOCKS
 from traph.helpers import detailed_chunks_iter
 
@@ -22,9 +25,29 @@ from traph.helpers import detailed_chunks_iter
 
 # TODO: it's possible to differentiate the tail's blocks format if needed
 LRU_TRIE_NODE_FORMAT = "75pBI6Q"
-LRU_TRIE_NODE_BLOCK_SIZE = struct.calcsize(LRU_TRIE_NODE_FORMAT)
+LRU_TRIE_NODE_STRUCT = struct.Struct(LRU_TRIE_NODE_FORMAT)
+LRU_TRIE_NODE_BLOCK_SIZE = LRU_TRIE_NODE_STRUCT.size
 LRU_TRIE_FIRST_DATA_BLOCK = LRU_TRIE_HEADER_BLOCKS * LRU_TRIE_NODE_BLOCK_SIZE
 
+# Format of each register, used to decode or encode a single one in place
+LRU_TRIE_NODE_FIELDS = ("75p", "B", "I", "Q", "Q", "Q", "Q", "Q", "Q")
+LRU_TRIE_NODE_FIELD_STRUCTS = [struct.Struct(field) for field in LRU_TRIE_NODE_FIELDS]
+LRU_TRIE_NODE_FIELD_OFFSETS = [
+    struct.calcsize("".join(LRU_TRIE_NODE_FIELDS[: i + 1])) - struct.calcsize(field)
+    for i, field in enumerate(LRU_TRIE_NODE_FIELDS)
+]
+
+LRU_TRIE_NODE_NB_FIELDS = len(LRU_TRIE_NODE_FIELDS)
+
+# Whether each register directly follows the previous one, without padding
+LRU_TRIE_NODE_FIELD_CONTIGUOUS = [False] + [
+    LRU_TRIE_NODE_FIELD_OFFSETS[i]
+    == LRU_TRIE_NODE_FIELD_OFFSETS[i - 1] + LRU_TRIE_NODE_FIELD_STRUCTS[i - 1].size
+    for i in range(1, LRU_TRIE_NODE_NB_FIELDS)
+]
+
+assert struct.calcsize("".join(LRU_TRIE_NODE_FIELDS)) == LRU_TRIE_NODE_BLOCK_SIZE
+
 # NOTE: this MUST be 1 less than the number above because varchars or
 # pascal strings (hence the "p") need one byte of information to encode
 # the stored string's length
@@ -44,6 +67,9 @@ LRU_TRIE_NODE_PARENT_BLOCK = 6
 LRU_TRIE_NODE_OUTLINKS_BLOCK = 7
 LRU_TRIE_NODE_INLINKS_BLOCK = 8
 
+# Number of bytes preceding the registers, i.e. taken by the stem
+LRU_TRIE_STEM_FIELD_SIZE = LRU_TRIE_NODE_FIELD_OFFSETS[LRU_TRIE_NODE_FLAGS]
+
 LRU_TRIE_NODE_REGISTERS = 7  # 8 - flags
 
 # Flags (Currently allocating 8/8 bits)
@@ -75,6 +101,35 @@ def test(data, register, pos):
     return bool((data[register] >> pos) & 1)
 
 
+# Number of blocks taken by a node having the given stem, tail included
+def nb_blocks_for_stem(stem):
+    if len(stem) <= LRU_TRIE_STEM_SIZE:
+        return 1
+
+    tail = stem[LRU_TRIE_STEM_SIZE:]
+
+    return 1 + sum(1 for _ in detailed_chunks_iter(LRU_TRIE_STEM_SIZE, tail))
+
+
+def compare_stem_chunks(chunks, stem):
+    """
+    Returning -1, 0 or 1 whether the stem spread over the given chunks is
+    lower, equal or greater than the given one. Chunks are only consumed
+    until the order is decided.
+    """
+    offset = 0
+
+    for chunk in chunks:
+        other = stem[offset : offset + len(chunk)]
+
+        if chunk != other:
+            return 1 if chunk > other else -1
+
+        offset += len(chunk)
+
+    return 0 if offset == len(stem) else -1
+
+
 # Exceptions
 class LRUTrieNodeTraversalException(Exception):
     pass
@@ -86,6 +141,8 @@ class LRUTrieNodeUsageException(Exception):
 
 # Main class
 class LRUTrieNode(object):
+    __slots__ = ("storage", "block", "exists", "data", "tail", "dirty")
+
     # =========================================================================
     # Constructor
     # =========================================================================
@@ -95,6 +152,7 @@ class LRUTrieNode(object):
         self.block = None
         self.exists = False
         self.tail = b""
+        self.dirty = 0
 
         # Loading node from storage
         if block is not None:
@@ -108,6 +166,7 @@ class LRUTrieNode(object):
 
     def __set_default_data(self, stem=None):
         self.data = [b"", DEFAULT_FLAGS_VALUE] + [0] * LRU_TRIE_NODE_REGISTERS
+        self.dirty = 0
 
         if stem is not None:
             self.set_stem(stem)
@@ -141,7 +200,7 @@ class LRUTrieNode(object):
 
     # unpack data
     def unpack(self, data):
-        return list(struct.unpack(LRU_TRIE_NODE_FORMAT, data))
+        return list(LRU_TRIE_NODE_STRUCT.unpack(data))
 
     # set a switch to another block
     def read(self, block):
@@ -155,25 +214,36 @@ class LRUTrieNode(object):
             self.exists = True
             self.data = self.unpack(data)
             self.block = block
-            self.tail = b""
+            self.dirty = 0
+
+            # NOTE: the tail is only read when the full stem is needed
+            self.tail = None if self.has_tail() else b""
 
-            # Reading the tail recursively
-            # TODO: it's possible not to read the tail in some cases
-            # TODO: it might be possible to "stream" the tail when performing
-            # BST comparison (probably overkill)
-            if self.has_tail():
-                chunks = []
+    # iterate over the stem chunks stored in the tail blocks
+    # NOTE: tail blocks are read using their explicit address so that
+    # we never rely on a storage's cursor
+    def tail_chunks_iter(self):
+        if not self.has_tail():
+            return
 
-                while True:
-                    data = struct.unpack(LRU_TRIE_NODE_FORMAT, self.storage.read())
-                    chars = data[LRU_TRIE_NODE_STEM]
+        tail_block = self.block
 
-                    chunks.append(chars)
+        while True:
+            tail_block += self.storage.block_size
+            data = LRU_TRIE_NODE_STRUCT.unpack(self.storage.read(tail_block))
 
-                    if not test(data, LRU_TRIE_NODE_FLAGS, LRU_TRIE_NODE_FLAG_HAS_TAIL):
-                        break
+            yield data[LRU_TRIE_NODE_STEM]
 
-                self.tail = b"".join(chunks)
+            if not test(data, LRU_TRIE_NODE_FLAGS, LRU_TRIE_NODE_FLAG_HAS_TAIL):
+                break
+
+    # set the node's data from an already read block, tail excluded
+    def load(self, block, data):
+        self.exists = True
+        self.data = self.unpack(data)
+        self.block = block
+        self.dirty = 0
+        self.tail = b""
 
     # re-acquiring data from storage because it may have changed
     def refresh(self):
@@ -181,10 +251,64 @@ class LRUTrieNode(object):
 
     # pack the node to binary form
     def pack(self):
-        return struct.pack(LRU_TRIE_NODE_FORMAT, *self.data)
+        return LRU_TRIE_NODE_STRUCT.pack(*self.data)
+
+    # set a register's value, marking it as dirty only if it changed
+    def __set(self, register, value):
+        if self.data[register] == value:
+            return
+
+        self.data[register] = value
+        self.dirty |= 1 << register
+
+    def __flag(self, pos):
+        if not test(self.data, LRU_TRIE_NODE_FLAGS, pos):
+            flag(self.data, LRU_TRIE_NODE_FLAGS, pos)
+            self.dirty |= 1 << LRU_TRIE_NODE_FLAGS
+
+    def __unflag(self, pos):
+        if test(self.data, LRU_TRIE_NODE_FLAGS, pos):
+            unflag(self.data, LRU_TRIE_NODE_FLAGS, pos)
+            self.dirty |= 1 << LRU_TRIE_NODE_FLAGS
+
+    # write the dirty registers only, contiguous ones being packed together
+    def __write_dirty_registers(self):
+        register = 0
+
+        while register < LRU_TRIE_NODE_NB_FIELDS:
+            if not (self.dirty >> register) & 1:
+                register += 1
+                continue
+
+            start = register
+            chunks = []
+
+            while register < LRU_TRIE_NODE_NB_FIELDS and (self.dirty >> register) & 1:
+                if register > start and not LRU_TRIE_NODE_FIELD_CONTIGUOUS[register]:
+                    break
+
+                chunks.append(
+                    LRU_TRIE_NODE_FIELD_STRUCTS[register].pack(self.data[register])
+                )
+                register += 1
+
+            self.storage.write_at(
+                self.block + LRU_TRIE_NODE_FIELD_OFFSETS[start], b"".join(chunks)
+            )
+
+        self.dirty = 0
 
     # write the node's data to storage
     def write(self):
+        # Existing nodes only need their modified registers to be written
+        if self.exists:
+            if self.dirty:
+                self.__write_dirty_registers()
+            else:
+                self.storage.counters.skipped_writes += 1
+
+            return
+
         block = self.storage.write(self.pack(), self.block)
         self.block = block
 
@@ -199,9 +323,10 @@ class LRUTrieNode(object):
                 if not is_last:
                     flag(data, LRU_TRIE_NODE_FLAGS, LRU_TRIE_NODE_FLAG_HAS_TAIL)
 
-                self.storage.write(struct.pack(LRU_TRIE_NODE_FORMAT, *data))
+                self.storage.write(LRU_TRIE_NODE_STRUCT.pack(*data))
 
         self.exists = True
+        self.dirty = 0
 
     # Method returning whether this node is the root
     def is_root(self):
@@ -214,19 +339,19 @@ class LRUTrieNode(object):
         return test(self.data, LRU_TRIE_NODE_FLAGS, LRU_TRIE_NODE_FLAG_PAGE)
 
     def flag_as_page(self):
-        flag(self.data, LRU_TRIE_NODE_FLAGS, LRU_TRIE_NODE_FLAG_PAGE)
+        self.__flag(LRU_TRIE_NODE_FLAG_PAGE)
 
     def unflag_as_page(self):
-        unflag(self.data, LRU_TRIE_NODE_FLAGS, LRU_TRIE_NODE_FLAG_PAGE)
+        self.__unflag(LRU_TRIE_NODE_FLAG_PAGE)
 
     def is_crawled(self):
         return test(self.data, LRU_TRIE_NODE_FLAGS, LRU_TRIE_NODE_FLAG_CRAWLED)
 
     def flag_as_crawled(self):
-        flag(self.data, LRU_TRIE_NODE_FLAGS, LRU_TRIE_NODE_FLAG_CRAWLED)
+        self.__flag(LRU_TRIE_NODE_FLAG_CRAWLED)
 
     def unflag_as_crawled(self):
-        unflag(self.data, LRU_TRIE_NODE_FLAGS, LRU_TRIE_NODE_FLAG_CRAWLED)
+        self.__unflag(LRU_TRIE_NODE_FLAG_CRAWLED)
 
     def has_webentity_creation_rule(self):
         return test(
@@ -234,18 +359,16 @@ class LRUTrieNode(object):
         )
 
     def flag_as_webentity_creation_rule(self):
-        flag(self.data, LRU_TRIE_NODE_FLAGS, LRU_TRIE_NODE_FLAG_WEBENTITY_CREATION_RULE)
+        self.__flag(LRU_TRIE_NODE_FLAG_WEBENTITY_CREATION_RULE)
 
     def unflag_as_webentity_creation_rule(self):
-        unflag(
-            self.data, LRU_TRIE_NODE_FLAGS, LRU_TRIE_NODE_FLAG_WEBENTITY_CREATION_RULE
-        )
+        self.__unflag(LRU_TRIE_NODE_FLAG_WEBENTITY_CREATION_RULE)
 
     def has_tail(self):
         return test(self.data, LRU_TRIE_NODE_FLAGS, LRU_TRIE_NODE_FLAG_HAS_TAIL)
 
     def flag_as_having_tail(self):
-        flag(self.data, LRU_TRIE_NODE_FLAGS, LRU_TRIE_NODE_FLAG_HAS_TAIL)
+        self.__flag(LRU_TRIE_NODE_FLAG_HAS_TAIL)
 
     def is_tail(self):
         return test(self.data, LRU_TRIE_NODE_FLAGS, LRU_TRIE_NODE_FLAG_IS_TAIL)
@@ -256,7 +379,7 @@ class LRUTrieNode(object):
         )
 
     def flag_can_have_child_webentities(self):
-        unflag(self.data, LRU_TRIE_NODE_FLAGS, LRU_TRIE_NODE_FLAG_NO_CHILD_WEBENTITIES)
+        self.__unflag(LRU_TRIE_NODE_FLAG_NO_CHILD_WEBENTITIES)
 
     # =========================================================================
     # Stem methods
@@ -265,16 +388,31 @@ class LRUTrieNode(object):
     def stem(self):
         chars = self.data[LRU_TRIE_NODE_STEM]
 
+        if self.tail is None:
+            self.tail = b"".join(self.tail_chunks_iter())
+
         return chars + self.tail
 
+    # compare the node's stem with the given one, reading the tail blocks
+    # only until the order is decided
+    def compare_stem(self, stem):
+        chars = self.data[LRU_TRIE_NODE_STEM]
+
+        if self.tail is not None:
+            chunks = (chars, self.tail)
+        else:
+            chunks = chain((chars,), self.tail_chunks_iter())
+
+        return compare_stem_chunks(chunks, stem)
+
     def set_stem(self, stem):
         # If the stem can be stored in our block, things are simple
         if len(stem) <= LRU_TRIE_STEM_SIZE:
-            self.data[LRU_TRIE_NODE_STEM] = stem
+            self.__set(LRU_TRIE_NODE_STEM, stem)
 
         # Else, we need to chunk the stem and write a tail
         else:
-            self.data[LRU_TRIE_NODE_STEM] = stem[:LRU_TRIE_STEM_SIZE]
+            self.__set(LRU_TRIE_NODE_STEM, stem[:LRU_TRIE_STEM_SIZE])
 
             self.tail = stem[LRU_TRIE_STEM_SIZE:]
             self.flag_as_having_tail()
@@ -301,7 +439,11 @@ class LRUTrieNode(object):
         if block < LRU_TRIE_FIRST_DATA_BLOCK:
             raise LRUTrieNodeUsageException("Left node cannot be the root.")
 
-        self.data[LRU_TRIE_NODE_LEFT_BLOCK] = block
+        self.__set(LRU_TRIE_NODE_LEFT_BLOCK, block)
+
+    # drop the left sibling
+    def unset_left(self):
+        self.__set(LRU_TRIE_NODE_LEFT_BLOCK, 0)
 
     # read the left sibling
     def read_left(self):
@@ -335,7 +477,11 @@ class LRUTrieNode(object):
         if block < LRU_TRIE_FIRST_DATA_BLOCK:
             raise LRUTrieNodeUsageException("right node cannot be the root.")
 
-        self.data[LRU_TRIE_NODE_RIGHT_BLOCK] = block
+        self.__set(LRU_TRIE_NODE_RIGHT_BLOCK, block)
+
+    # drop the right sibling
+    def unset_right(self):
+        self.__set(LRU_TRIE_NODE_RIGHT_BLOCK, 0)
 
     # read the right sibling
     def read_right(self):
@@ -373,7 +519,7 @@ class LRUTrieNode(object):
         if block < LRU_TRIE_FIRST_DATA_BLOCK:
             raise LRUTrieNodeUsageException("Child node cannot be the root.")
 
-        self.data[LRU_TRIE_NODE_CHILD_BLOCK] = block
+        self.__set(LRU_TRIE_NODE_CHILD_BLOCK, block)
 
     # read the child
     def read_child(self):
@@ -405,7 +551,7 @@ class LRUTrieNode(object):
 
     # set a parent
     def set_parent(self, block):
-        self.data[LRU_TRIE_NODE_PARENT_BLOCK] = block
+        self.__set(LRU_TRIE_NODE_PARENT_BLOCK, block)
 
     # read the parent
     def read_parent(self):
@@ -434,7 +580,7 @@ class LRUTrieNode(object):
 
     # set the outlinks block
     def set_outlinks(self, block):
-        self.data[LRU_TRIE_NODE_OUTLINKS_BLOCK] = block
+        self.__set(LRU_TRIE_NODE_OUTLINKS_BLOCK, block)
 
     # =========================================================================
     # Inlinks block methods
@@ -450,7 +596,7 @@ class LRUTrieNode(object):
 
     # set the inlinks block
     def set_inlinks(self, block):
-        self.data[LRU_TRIE_NODE_INLINKS_BLOCK] = block
+        self.__set(LRU_TRIE_NODE_INLINKS_BLOCK, block)
 
     # =========================================================================
     # Generic links block methods
@@ -477,7 +623,7 @@ class LRUTrieNode(object):
         if not out:
             offset = LRU_TRIE_NODE_INLINKS_BLOCK
 
-        self.data[offset] = block
+        self.__set(offset, block)
 
     # =========================================================================
     # WebEntity methods
@@ -498,8 +644,8 @@ class LRUTrieNode(object):
 
     # set the webentity flag
     def set_webentity(self, weid):
-        self.data[LRU_TRIE_NODE_WEBENTITY] = weid
+        self.__set(LRU_TRIE_NODE_WEBENTITY, weid)
 
     # remove the tie between the node (ie. prefix) and the webentity
     def unset_webentity(self):
-        self.data[LRU_TRIE_NODE_WEBENTITY] = 0
+        self.__set(LRU_TRIE_NODE_WEBENTITY, 0)
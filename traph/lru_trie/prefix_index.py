@@ -0,0 +1,179 @@
+# =============================================================================
+# LRU Trie Webentity Prefix Index Class
+# =============================================================================
+#
+# Class representing a persistent index of the prefixes of each webentity,
+# by id, so that the prefixes of a webentity can be found, and the
+# webentities enumerated, without traversing the trie.
+#
+# The index is kept in memory and persisted, in a storage of its own, as a
+# log of 16 bytes records, each one adding or removing the block of a
+# prefix's node to or from a webentity. Since nodes never move, a block
+# remains valid as long as the trie is not rewritten.
+#
+# The log starts with a header record flagging whether it was cleanly
+# closed, along with its number of records. If it was not, the trie's writes
+# & the log's ones may have diverged and the index must be rebuilt from the
+# trie. Records found after the last one are leftovers of a longer log which
+# was rewritten & are ignored.
+#
+import struct
+
+# Binary format
+LRU_TRIE_PREFIX_INDEX_FORMAT = "B3xIQ"
+LRU_TRIE_PREFIX_INDEX_STRUCT = struct.Struct(LRU_TRIE_PREFIX_INDEX_FORMAT)
+LRU_TRIE_PREFIX_INDEX_BLOCK_SIZE = LRU_TRIE_PREFIX_INDEX_STRUCT.size
+
+# Version of the log, stored in its header record
+LRU_TRIE_PREFIX_INDEX_VERSION = 1
+
+# Operations, the header's ones telling whether the log was cleanly closed
+LRU_TRIE_PREFIX_INDEX_ADD = 1
+LRU_TRIE_PREFIX_INDEX_REMOVE = 2
+LRU_TRIE_PREFIX_INDEX_OPEN = 3
+LRU_TRIE_PREFIX_INDEX_CLOSED = 4
+
+
+# Main class
+class LRUTriePrefixIndex(object):
+    def __init__(self, storage):
+        # Properties
+        self.storage = storage
+        self.prefixes = {}
+        self.nb_records = 0
+
+    def __len__(self):
+        return len(self.prefixes)
+
+    def __contains__(self, weid):
+        return weid in self.prefixes
+
+    def __iter__(self):
+        return iter(self.prefixes)
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+
+        return ("<%(class_name)s webentities=%(webentities)s records=%(records)s>") % {
+            "class_name": class_name,
+            "webentities": len(self.prefixes),
+            "records": self.nb_records,
+        }
+
+    # Method writing the header record
+    def __write_header(self, op):
+        data = LRU_TRIE_PREFIX_INDEX_STRUCT.pack(
+            op, LRU_TRIE_PREFIX_INDEX_VERSION, self.nb_records
+        )
+
+        self.storage.write(data, 0)
+
+    # Method appending a record to the log
+    def __append(self, op, weid, block):
+        self.nb_records += 1
+
+        self.storage.write(
+            LRU_TRIE_PREFIX_INDEX_STRUCT.pack(op, weid, block),
+            self.nb_records * LRU_TRIE_PREFIX_INDEX_BLOCK_SIZE,
+        )
+
+    # Method loading the index from the log, returning whether it could be,
+    # i.e. whether the log was cleanly closed
+    def load(self):
+        data = self.storage.read(0)
+
+        if not data or len(data) < LRU_TRIE_PREFIX_INDEX_BLOCK_SIZE:
+            return False
+
+        op, version, nb_records = LRU_TRIE_PREFIX_INDEX_STRUCT.unpack(data)
+
+        if op != LRU_TRIE_PREFIX_INDEX_CLOSED:
+            return False
+
+        if version != LRU_TRIE_PREFIX_INDEX_VERSION:
+            return False
+
+        self.prefixes = {}
+        self.nb_records = 0
+
+        # NOTE: the records come right after the header's
+        records = self.storage.iter_blocks(LRU_TRIE_PREFIX_INDEX_BLOCK_SIZE)
+
+        for _, data in records:
+            if self.nb_records == nb_records:
+                break
+
+            op, weid, block = LRU_TRIE_PREFIX_INDEX_STRUCT.unpack(data)
+
+            if op == LRU_TRIE_PREFIX_INDEX_ADD:
+                self.prefixes.setdefault(weid, []).append(block)
+            else:
+                blocks = self.prefixes[weid]
+                blocks.remove(block)
+
+                if not blocks:
+                    del self.prefixes[weid]
+
+            self.nb_records += 1
+
+        return True
+
+    # Method rewriting the log from the given (weid, block) pairs
+    def rebuild(self, items):
+        self.prefixes = {}
+        self.nb_records = 0
+
+        self.open()
+
+        for weid, block in items:
+            self.add(weid, block)
+
+    # Method rewriting the log with only the records describing the index
+    def compact(self):
+        self.rebuild(list(self.items()))
+
+    # Method flagging the log as being in use, so that it is not trusted
+    # anymore if it is not cleanly closed
+    def open(self):
+        self.__write_header(LRU_TRIE_PREFIX_INDEX_OPEN)
+
+    # Method flagging the log as cleanly closed
+    def close(self):
+        self.__write_header(LRU_TRIE_PREFIX_INDEX_CLOSED)
+
+    # Method returning whether the log holds more records than needed to
+    # describe the index
+    def is_fragmented(self):
+        return self.nb_records > sum(len(blocks) for blocks in self.prefixes.values())
+
+    def add(self, weid, block):
+        blocks = self.prefixes.setdefault(weid, [])
+
+        if block in blocks:
+            return
+
+        blocks.append(block)
+        self.__append(LRU_TRIE_PREFIX_INDEX_ADD, weid, block)
+
+    def remove(self, weid, block):
+        blocks = self.prefixes.get(weid)
+
+        if not blocks or block not in blocks:
+            return
+
+        blocks.remove(block)
+
+        if not blocks:
+            del self.prefixes[weid]
+
+        self.__append(LRU_TRIE_PREFIX_INDEX_REMOVE, weid, block)
+
+    # Method returning the blocks of the prefixes of the given webentity
+    def blocks(self, weid):
+        return list(self.prefixes.get(weid, ()))
+
+    # Method iterating over the (weid, block) pairs of the index
+    def items(self):
+        for weid, blocks in self.prefixes.items():
+            for block in blocks:
+                yield weid, block
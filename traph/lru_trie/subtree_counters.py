@@ -0,0 +1,83 @@
+# =============================================================================
+# LRU Trie Subtree Counters Class
+# =============================================================================
+#
+# Class storing, in a storage of its own, the number of pages & of crawled
+# pages found below each node of the trie:
+#
+#   1. in the node's subtree, i.e. the node itself & its middle subtree,
+#      which are the pages whose LRU starts with the node's prefix.
+#   2. in the node's whole BST subtree, i.e. its own subtree & the ones of
+#      the siblings found below it in their BST.
+#
+# A node's record is found at the index of its block & a missing record reads
+# as zeros, so that nodes can be created without touching the counters. Only
+# pages becoming pages or getting crawled need to update them, along the path
+# leading to them.
+#
+# With those, the pages of a prefix are counted without any traversal & the
+# page found at a given offset below a prefix is reached by descending its
+# BSTs, skipping whole subtrees, instead of iterating over the pages
+# preceding it.
+#
+import struct
+
+from traph.lru_trie.node import LRU_TRIE_NODE_BLOCK_SIZE
+
+# Binary format
+LRU_TRIE_SUBTREE_COUNTERS_FORMAT = "4I"
+LRU_TRIE_SUBTREE_COUNTERS_STRUCT = struct.Struct(LRU_TRIE_SUBTREE_COUNTERS_FORMAT)
+LRU_TRIE_SUBTREE_COUNTERS_BLOCK_SIZE = LRU_TRIE_SUBTREE_COUNTERS_STRUCT.size
+
+# Positions
+LRU_TRIE_SUBTREE_PAGES = 0
+LRU_TRIE_SUBTREE_CRAWLED_PAGES = 1
+LRU_TRIE_BST_PAGES = 2
+LRU_TRIE_BST_CRAWLED_PAGES = 3
+
+
+# Main class
+class LRUTrieSubtreeCounters(object):
+    def __init__(self, storage):
+        # Properties
+        self.storage = storage
+
+    # Method returning the offset of the given node's record
+    def __offset(self, block):
+        return (
+            block // LRU_TRIE_NODE_BLOCK_SIZE
+        ) * LRU_TRIE_SUBTREE_COUNTERS_BLOCK_SIZE
+
+    # Method returning the counters of the given node
+    def read(self, block):
+        data = self.storage.read(self.__offset(block))
+
+        if not data or len(data) < LRU_TRIE_SUBTREE_COUNTERS_BLOCK_SIZE:
+            return [0, 0, 0, 0]
+
+        return list(LRU_TRIE_SUBTREE_COUNTERS_STRUCT.unpack(data))
+
+    # Method writing the counters of the given node
+    def write(self, block, counters):
+        offset = self.__offset(block)
+        missing = offset - len(self.storage)
+
+        # Padding the storage with empty records up to the node's one
+        if missing > 0:
+            self.storage.write(bytes(missing))
+
+        self.storage.write(LRU_TRIE_SUBTREE_COUNTERS_STRUCT.pack(*counters), offset)
+
+    # Method adding pages & crawled pages to the given node's BST subtree and,
+    # if the node is on the way to them, to its own subtree
+    def add(self, block, pages, crawled, subtree=False):
+        counters = self.read(block)
+
+        counters[LRU_TRIE_BST_PAGES] += pages
+        counters[LRU_TRIE_BST_CRAWLED_PAGES] += crawled
+
+        if subtree:
+            counters[LRU_TRIE_SUBTREE_PAGES] += pages
+            counters[LRU_TRIE_SUBTREE_CRAWLED_PAGES] += crawled
+
+        self.write(block, counters)
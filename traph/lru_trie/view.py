@@ -0,0 +1,350 @@
+# =============================================================================
+# LRU Trie Node View
+# =============================================================================
+#
+# Class representing a read-only view over a single node from the LRU trie.
+#
+# Contrary to the LRUTrieNode, the view does not unpack the whole block into
+# a list but decodes each register lazily, when asked for, directly from the
+# storage's buffer. This is especially useful when traversing the trie since
+# most steps only need to check some flags and follow one or two pointers.
+#
+# Note that a view is only guaranteed to reflect the storage's data until
+# the next write, so it should be re-read whenever the trie is modified.
+#
+# When the storage keeps the stems apart from the registers, the view only
+# reads the registers & fetches the stem when asked for.
+#
+from itertools import chain
+from traph.lru_trie.node import (
+    LRU_TRIE_FIRST_DATA_BLOCK,
+    LRU_TRIE_NODE_FIELD_OFFSETS,
+    LRU_TRIE_NODE_FIELD_STRUCTS,
+    LRU_TRIE_NODE_STEM,
+    LRU_TRIE_NODE_FLAGS,
+    LRU_TRIE_NODE_WEBENTITY,
+    LRU_TRIE_NODE_LEFT_BLOCK,
+    LRU_TRIE_NODE_RIGHT_BLOCK,
+    LRU_TRIE_NODE_CHILD_BLOCK,
+    LRU_TRIE_NODE_PARENT_BLOCK,
+    LRU_TRIE_NODE_OUTLINKS_BLOCK,
+    LRU_TRIE_NODE_INLINKS_BLOCK,
+    LRU_TRIE_NODE_FLAG_PAGE,
+    LRU_TRIE_NODE_FLAG_CRAWLED,
+    LRU_TRIE_NODE_FLAG_WEBENTITY_CREATION_RULE,
+    LRU_TRIE_NODE_FLAG_HAS_TAIL,
+    LRU_TRIE_NODE_FLAG_IS_TAIL,
+    LRU_TRIE_NODE_FLAG_NO_CHILD_WEBENTITIES,
+    DEFAULT_FLAGS_VALUE,
+    LRUTrieNodeTraversalException,
+    compare_stem_chunks,
+)
+
+# Decoders of the registers
+STEM_STRUCT = LRU_TRIE_NODE_FIELD_STRUCTS[LRU_TRIE_NODE_STEM]
+FLAGS_STRUCT = LRU_TRIE_NODE_FIELD_STRUCTS[LRU_TRIE_NODE_FLAGS]
+WEBENTITY_STRUCT = LRU_TRIE_NODE_FIELD_STRUCTS[LRU_TRIE_NODE_WEBENTITY]
+BLOCK_STRUCT = LRU_TRIE_NODE_FIELD_STRUCTS[LRU_TRIE_NODE_LEFT_BLOCK]
+
+FLAGS_OFFSET = LRU_TRIE_NODE_FIELD_OFFSETS[LRU_TRIE_NODE_FLAGS]
+WEBENTITY_OFFSET = LRU_TRIE_NODE_FIELD_OFFSETS[LRU_TRIE_NODE_WEBENTITY]
+
+
+# Main class
+class LRUTrieNodeView(object):
+    __slots__ = ("storage", "split", "block", "exists", "buffer", "offset", "tail")
+
+    # =========================================================================
+    # Constructor
+    # =========================================================================
+    def __init__(self, storage, block=None):
+        # Properties
+        self.storage = storage
+        self.split = hasattr(storage, "read_stem_buffer")
+        self.block = None
+        self.exists = False
+        self.buffer = None
+        self.offset = 0
+        self.tail = b""
+
+        if block is not None:
+            self.read(block)
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+
+        return (
+            '<%(class_name)s "%(stem)s"'
+            " block=%(block)s exists=%(exists)s has_tail=%(has_tail)s"
+            " parent=%(parent)s child=%(child)s left=%(left)s right=%(right)s"
+            " out=%(outlinks)s we=%(webentity)s wecr=%(webentity_creation_rule)s>"
+        ) % {
+            "class_name": class_name,
+            "stem": self.stem(),
+            "block": self.block,
+            "exists": str(self.exists),
+            "has_tail": str(self.has_tail()),
+            "parent": self.parent(),
+            "child": self.child(),
+            "left": self.left(),
+            "right": self.right(),
+            "outlinks": self.outlinks(),
+            "webentity": self.webentity(),
+            "webentity_creation_rule": self.has_webentity_creation_rule(),
+        }
+
+    # =========================================================================
+    # Utilities
+    # =========================================================================
+
+    # set the view on another block
+    def read(self, block):
+        if self.split:
+            result = self.storage.read_registers_buffer(block)
+        else:
+            result = self.storage.read_buffer(block)
+
+        self.tail = None
+
+        if result is None:
+            self.exists = False
+            self.buffer = None
+            self.offset = 0
+            self.tail = b""
+        else:
+            self.exists = True
+            self.buffer, self.offset = result
+            self.block = block
+
+    # decode the stem chars stored in the block itself
+    def __chars(self):
+        if self.split:
+            return STEM_STRUCT.unpack_from(self.storage.read_stem_buffer(self.block))[0]
+
+        return STEM_STRUCT.unpack_from(self.buffer, self.offset)[0]
+
+    # decode a pointer register
+    def register(self, register):
+        if self.buffer is None:
+            return 0
+
+        return BLOCK_STRUCT.unpack_from(
+            self.buffer, self.offset + LRU_TRIE_NODE_FIELD_OFFSETS[register]
+        )[0]
+
+    # decode the flags register
+    def flags(self):
+        if self.buffer is None:
+            return DEFAULT_FLAGS_VALUE
+
+        return FLAGS_STRUCT.unpack_from(self.buffer, self.offset + FLAGS_OFFSET)[0]
+
+    def test_flag(self, pos):
+        return bool((self.flags() >> pos) & 1)
+
+    # Method returning whether this node is the root
+    def is_root(self):
+        return self.block == LRU_TRIE_FIRST_DATA_BLOCK
+
+    # =========================================================================
+    # Flags methods
+    # =========================================================================
+    def is_page(self):
+        return self.test_flag(LRU_TRIE_NODE_FLAG_PAGE)
+
+    def is_crawled(self):
+        return self.test_flag(LRU_TRIE_NODE_FLAG_CRAWLED)
+
+    def has_webentity_creation_rule(self):
+        return self.test_flag(LRU_TRIE_NODE_FLAG_WEBENTITY_CREATION_RULE)
+
+    def has_tail(self):
+        return self.test_flag(LRU_TRIE_NODE_FLAG_HAS_TAIL)
+
+    def is_tail(self):
+        return self.test_flag(LRU_TRIE_NODE_FLAG_IS_TAIL)
+
+    def can_have_child_webentities(self):
+        return not self.test_flag(LRU_TRIE_NODE_FLAG_NO_CHILD_WEBENTITIES)
+
+    # =========================================================================
+    # Stem methods
+    # =========================================================================
+    def tail_chunks_iter(self):
+        if not self.has_tail():
+            return
+
+        tail_block = self.block
+        tail_view = LRUTrieNodeView(self.storage)
+
+        while True:
+            tail_block += self.storage.block_size
+            tail_view.read(tail_block)
+
+            yield tail_view.__chars()
+
+            if not tail_view.has_tail():
+                break
+
+    def stem(self):
+        if self.buffer is None:
+            return b""
+
+        chars = self.__chars()
+
+        # Reading the tail only once
+        if self.tail is None:
+            self.tail = b"".join(self.tail_chunks_iter())
+
+        return chars + self.tail
+
+    def compare_stem(self, stem):
+        if self.buffer is None:
+            return compare_stem_chunks((), stem)
+
+        chars = self.__chars()
+
+        if self.tail is not None:
+            chunks = (chars, self.tail)
+        else:
+            chunks = chain((chars,), self.tail_chunks_iter())
+
+        return compare_stem_chunks(chunks, stem)
+
+    # =========================================================================
+    # Binary Tree block methods
+    # =========================================================================
+    def has_left(self):
+        return self.register(LRU_TRIE_NODE_LEFT_BLOCK) != 0
+
+    def left(self):
+        block = self.register(LRU_TRIE_NODE_LEFT_BLOCK)
+
+        if block < LRU_TRIE_FIRST_DATA_BLOCK:
+            return None
+
+        return block
+
+    def read_left(self):
+        if not self.has_left():
+            raise LRUTrieNodeTraversalException("Node has no left sibling.")
+
+        self.read(self.left())
+
+    def left_node(self):
+        if not self.has_left():
+            raise LRUTrieNodeTraversalException("Node has no left sibling.")
+
+        return LRUTrieNodeView(self.storage, block=self.left())
+
+    def has_right(self):
+        return self.register(LRU_TRIE_NODE_RIGHT_BLOCK) != 0
+
+    def right(self):
+        block = self.register(LRU_TRIE_NODE_RIGHT_BLOCK)
+
+        if block < LRU_TRIE_FIRST_DATA_BLOCK:
+            return None
+
+        return block
+
+    def read_right(self):
+        if not self.has_right():
+            raise LRUTrieNodeTraversalException("Node has no right sibling.")
+
+        self.read(self.right())
+
+    def right_node(self):
+        if not self.has_right():
+            raise LRUTrieNodeTraversalException("Node has no right sibling.")
+
+        return LRUTrieNodeView(self.storage, block=self.right())
+
+    # =========================================================================
+    # Child block methods
+    # =========================================================================
+    def has_child(self):
+        return self.register(LRU_TRIE_NODE_CHILD_BLOCK) != 0
+
+    def child(self):
+        block = self.register(LRU_TRIE_NODE_CHILD_BLOCK)
+
+        if block < LRU_TRIE_FIRST_DATA_BLOCK:
+            return None
+
+        return block
+
+    def read_child(self):
+        if not self.has_child():
+            raise LRUTrieNodeTraversalException("Node has no child.")
+
+        self.read(self.child())
+
+    def child_node(self):
+        if not self.has_child():
+            raise LRUTrieNodeTraversalException("Node has no child.")
+
+        return LRUTrieNodeView(self.storage, block=self.child())
+
+    # =========================================================================
+    # Parent block methods
+    # =========================================================================
+    def has_parent(self):
+        return self.register(LRU_TRIE_NODE_PARENT_BLOCK) != 0
+
+    def parent(self):
+        return self.register(LRU_TRIE_NODE_PARENT_BLOCK)
+
+    def read_parent(self):
+        parent = self.parent()
+
+        if parent < LRU_TRIE_FIRST_DATA_BLOCK:
+            raise LRUTrieNodeTraversalException("Node has no parent (root).")
+
+        self.read(parent)
+
+    def parent_node(self):
+        return LRUTrieNodeView(self.storage, block=self.parent())
+
+    # =========================================================================
+    # Links block methods
+    # =========================================================================
+    def has_outlinks(self):
+        return self.register(LRU_TRIE_NODE_OUTLINKS_BLOCK) != 0
+
+    def outlinks(self):
+        return self.register(LRU_TRIE_NODE_OUTLINKS_BLOCK)
+
+    def has_inlinks(self):
+        return self.register(LRU_TRIE_NODE_INLINKS_BLOCK) != 0
+
+    def inlinks(self):
+        return self.register(LRU_TRIE_NODE_INLINKS_BLOCK)
+
+    def has_links(self, out=True):
+        return self.links(out=out) != 0
+
+    def links(self, out=True):
+        if out:
+            return self.register(LRU_TRIE_NODE_OUTLINKS_BLOCK)
+
+        return self.register(LRU_TRIE_NODE_INLINKS_BLOCK)
+
+    # =========================================================================
+    # WebEntity methods
+    # =========================================================================
+    def has_webentity(self):
+        return self.webentity() is not None
+
+    def webentity(self):
+        if self.buffer is None:
+            return None
+
+        weid = WEBENTITY_STRUCT.unpack_from(
+            self.buffer, self.offset + WEBENTITY_OFFSET
+        )[0]
+
+        if weid == 0:
+            return None
+
+        return weid
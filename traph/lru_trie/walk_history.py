@@ -8,6 +8,15 @@
 
 # Class representing the history of a simple walk into the Trie
 class LRUTrieWalkHistory(object):
+    __slots__ = (
+        "lru",
+        "webentity",
+        "webentity_prefix",
+        "webentity_position",
+        "webentity_creation_rules",
+        "page_was_created",
+    )
+
     def __init__(self, lru):
         # Properties
 
@@ -43,6 +52,22 @@ class LRUTrieWalkHistory(object):
     def add_webentity_creation_rule(self, position):
         self.webentity_creation_rules.append(position)
 
+    # Method returning the webentity & creation rules state gathered so far
+    def snapshot(self):
+        return (
+            self.webentity,
+            self.webentity_prefix,
+            self.webentity_position,
+            tuple(self.webentity_creation_rules),
+        )
+
+    # Method restoring a state returned by the snapshot method
+    def restore(self, snapshot):
+        webentity, webentity_prefix, webentity_position, rules = snapshot
+
+        self.update_webentity(webentity, webentity_prefix, webentity_position)
+        self.webentity_creation_rules = list(rules)
+
     def rules_to_apply(self):
         for position in reversed(self.webentity_creation_rules):
             if position >= 0:
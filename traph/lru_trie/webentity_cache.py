@@ -0,0 +1,137 @@
+# =============================================================================
+# LRU Trie Webentity Cache Class
+# =============================================================================
+#
+# Class representing a bounded, in-memory, cache mapping the blocks of some
+# nodes to the block of their nearest webentity-bearing ancestor, the node
+# itself included, so that resolving the webentity of a recently resolved
+# page only needs to read the page's node and the ancestor's one instead of
+# climbing every parent. Other pages still climb their ancestors.
+#
+# Since the pages of a same directory share their parent, only the parents
+# of the resolved pages are cached.
+#
+# Entries become stale when a webentity prefix is set on or removed from a
+# node. When one is removed, the entries pointing to its node are dropped.
+# When one is set, the entries which could go through the node all point to
+# its former nearest webentity-bearing ancestor and are dropped in turn. A
+# reverse index of the entries by target makes both invalidations incremental.
+#
+# Note that a webentity only changing its id on an existing prefix leaves
+# every entry valid, since they point to nodes rather than to webentities.
+#
+# The cache being shared by every reader of the Traph, its entries are only
+# ever accessed under a lock.
+#
+from collections import OrderedDict
+from threading import Lock
+
+# Default number of blocks kept in the cache
+LRU_TRIE_WEBENTITY_CACHE_SIZE = 65536
+
+
+# Main class
+class LRUTrieWebentityCache(object):
+    def __init__(self, capacity=LRU_TRIE_WEBENTITY_CACHE_SIZE):
+        # Properties
+        self.capacity = max(capacity, 1)
+        self.entries = OrderedDict()
+        self.targets = {}
+        self.lock = Lock()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+
+        return (
+            "<%(class_name)s size=%(size)s/%(capacity)s"
+            " hits=%(hits)s misses=%(misses)s>"
+        ) % {
+            "class_name": class_name,
+            "size": len(self.entries),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    # Method returning the block of the given block's nearest webentity-bearing
+    # ancestor, or None
+    def get(self, block):
+        with self.lock:
+            target = self.entries.get(block)
+
+            if target is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries.move_to_end(block)
+
+            return target
+
+    # Method storing the block of the given block's nearest webentity-bearing
+    # ancestor
+    def set(self, block, target):
+        with self.lock:
+            self.__drop(block)
+
+            self.entries[block] = target
+            self.targets.setdefault(target, set()).add(block)
+
+            if len(self.entries) > self.capacity:
+                evicted, evicted_target = self.entries.popitem(last=False)
+                self.__unlink(evicted, evicted_target)
+
+    # Method dropping the entries pointing to the given target
+    def invalidate(self, target):
+        with self.lock:
+            blocks = self.targets.pop(target, None)
+
+            if blocks is None:
+                return
+
+            for block in blocks:
+                del self.entries[block]
+
+            self.invalidations += 1
+
+    # Method dropping every entry
+    def clear(self):
+        with self.lock:
+            self.entries = OrderedDict()
+            self.targets = {}
+
+    # Method returning the cache's counters
+    def metrics(self):
+        lookups = self.hits + self.misses
+
+        return {
+            "capacity": self.capacity,
+            "nb_blocks": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_ratio": self.hits / float(lookups) if lookups else 0.0,
+        }
+
+    # Method dropping the entry of the given block, if any
+    def __drop(self, block):
+        target = self.entries.pop(block, None)
+
+        if target is not None:
+            self.__unlink(block, target)
+
+    # Method removing the given block from the reverse index of its target
+    def __unlink(self, block, target):
+        blocks = self.targets[target]
+        blocks.discard(block)
+
+        if not blocks:
+            del self.targets[target]
@@ -0,0 +1,107 @@
+# =============================================================================
+# LRU Trie Windup Cache Class
+# =============================================================================
+#
+# Class representing a bounded cache mapping the blocks of some nodes to
+# their full LRU, so that winding up a node's LRU only needs to climb its
+# parents until one of them is found in the cache.
+#
+# Since links mostly target a few popular pages and since the pages of a same
+# host share their parents, caching the LRU of the parent of each wound up
+# node means most windups only need to read the node itself.
+#
+# Note that a node never moves nor changes its stem or parent once written,
+# so entries never become stale. The cache is bounded by the total size in
+# bytes of the LRUs it holds, an estimate of the overhead of each entry
+# included, and evicts its least recently used entries first.
+#
+# The cache being shared by every reader of the Traph, its entries are only
+# ever accessed under a lock.
+#
+from collections import OrderedDict
+from threading import Lock
+
+# Default size in bytes of the cache
+LRU_TRIE_WINDUP_CACHE_SIZE = 4 * 1024 * 1024
+
+# Estimated size in bytes of an entry, its LRU's chars excluded
+LRU_TRIE_WINDUP_CACHE_ENTRY_OVERHEAD = 128
+
+
+# Main class
+class LRUTrieWindupCache(object):
+    def __init__(self, budget=LRU_TRIE_WINDUP_CACHE_SIZE):
+        # Properties
+        self.budget = budget
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+
+        return (
+            "<%(class_name)s size=%(size)s/%(budget)s hits=%(hits)s misses=%(misses)s>"
+        ) % {
+            "class_name": class_name,
+            "size": self.size,
+            "budget": self.budget,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    # Method returning the LRU of the given block, or None
+    def get(self, block):
+        with self.lock:
+            lru = self.entries.get(block)
+
+            if lru is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries.move_to_end(block)
+
+            return lru
+
+    # Method storing the LRU of the given block
+    def set(self, block, lru):
+        with self.lock:
+            if block in self.entries:
+                return
+
+            self.entries[block] = lru
+            self.size += len(lru) + LRU_TRIE_WINDUP_CACHE_ENTRY_OVERHEAD
+
+            while self.size > self.budget and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted) + LRU_TRIE_WINDUP_CACHE_ENTRY_OVERHEAD
+                self.evictions += 1
+
+    # Method dropping every entry
+    def clear(self):
+        with self.lock:
+            self.entries = OrderedDict()
+            self.size = 0
+
+    # Method returning the cache's counters
+    def metrics(self):
+        lookups = self.hits + self.misses
+
+        return {
+            "budget": self.budget,
+            "size": self.size,
+            "nb_lrus": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / float(lookups) if lookups else 0.0,
+        }
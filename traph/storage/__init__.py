@@ -2,6 +2,10 @@
 # Storage Endpoint
 # =============================================================================
 #
+from traph.storage.cache import BlockCache
+from traph.storage.counters import WriteCounters
 from traph.storage.file import FileStorage
 from traph.storage.memory import MemoryStorage
 from traph.storage.memmap import MemMapStorage
+from traph.storage.positional import PositionalStorage
+from traph.storage.split import SplitStorage
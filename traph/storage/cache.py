@@ -0,0 +1,95 @@
+# =============================================================================
+# Block Cache Class
+# =============================================================================
+#
+# Class representing a bounded read-through cache of blocks, evicting the
+# least recently used ones when full. It is meant to keep the upper levels of
+# the trie (schemes, TLDs, big hosts...) in RAM since they are read again and
+# again by every descent and every climb.
+#
+from collections import OrderedDict
+
+
+# Main class
+class BlockCache(object):
+    def __init__(self, block_size, cache_size):
+        # Properties
+        self.block_size = block_size
+        self.cache_size = cache_size
+        self.capacity = max(cache_size // block_size, 1)
+        self.blocks = OrderedDict()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+
+        return (
+            "<%(class_name)s size=%(size)s/%(capacity)s"
+            " hits=%(hits)s misses=%(misses)s>"
+        ) % {
+            "class_name": class_name,
+            "size": len(self.blocks),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    # Method returning the cached data of a block or None
+    def get(self, block):
+        data = self.blocks.get(block)
+
+        if data is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.blocks.move_to_end(block)
+
+        return data
+
+    # Method storing a block's data, evicting the least recently used one
+    def set(self, block, data):
+        self.blocks[block] = data
+        self.blocks.move_to_end(block)
+
+        if len(self.blocks) > self.capacity:
+            self.blocks.popitem(last=False)
+            self.evictions += 1
+
+    # Method updating part of a cached block, if it is cached
+    def patch(self, block, offset, data):
+        cached = self.blocks.get(block)
+
+        if cached is None:
+            return
+
+        self.blocks[block] = cached[:offset] + data + cached[offset + len(data) :]
+
+    # Method dropping a single block from the cache
+    def discard(self, block):
+        self.blocks.pop(block, None)
+
+    # Method dropping every cached block
+    def clear(self):
+        self.blocks = OrderedDict()
+
+    # Method returning the cache's counters
+    def metrics(self):
+        lookups = self.hits + self.misses
+
+        return {
+            "cache_size": self.cache_size,
+            "capacity": self.capacity,
+            "nb_blocks": len(self.blocks),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / float(lookups) if lookups else 0.0,
+        }
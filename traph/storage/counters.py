@@ -0,0 +1,44 @@
+# =============================================================================
+# Write Counters Class
+# =============================================================================
+#
+# Class counting the writes issued to a storage, so that one can check how
+# many of them were only partial or were skipped altogether because the node
+# to write had not changed.
+#
+
+
+# Main class
+class WriteCounters(object):
+    __slots__ = ("writes", "partial_writes", "skipped_writes")
+
+    def __init__(self):
+        self.writes = 0
+        self.partial_writes = 0
+        self.skipped_writes = 0
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+
+        return (
+            "<%(class_name)s writes=%(writes)s partial=%(partial)s skipped=%(skipped)s>"
+        ) % {
+            "class_name": class_name,
+            "writes": self.writes,
+            "partial": self.partial_writes,
+            "skipped": self.skipped_writes,
+        }
+
+    # Method resetting every counter
+    def clear(self):
+        self.writes = 0
+        self.partial_writes = 0
+        self.skipped_writes = 0
+
+    # Method returning the counters
+    def metrics(self):
+        return {
+            "writes": self.writes,
+            "partial_writes": self.partial_writes,
+            "skipped_writes": self.skipped_writes,
+        }
@@ -4,21 +4,60 @@
 #
 # Class abstracting random access file handling for the Traph.
 #
+# An optional read-through block cache can be given a size in bytes so that
+# frequently accessed blocks are not read from disk each time. Writes go
+# through the cache so that it always remains coherent with the file.
+#
+# An optional append buffer can also be given a size in bytes so that new
+# blocks are given their address right away but only reach the file in large
+# contiguous chunks. Updates to blocks still in the buffer are applied in the
+# buffer, and the buffer is flushed when full or when calling `flush`.
+#
 import os
+from traph.storage.cache import BlockCache
+from traph.storage.counters import WriteCounters
+from traph.storage.helpers import (
+    ITER_BLOCKS_CHUNK_SIZE,
+    aligned_chunk_size,
+    chunk_blocks_iter,
+)
 from traph.storage.memmap import MemMapStorage
 
 
 # Main class
 class FileStorage(object):
-    def __init__(self, block_size, file):
+    def __init__(self, block_size, file, cache_size=0, buffer_size=0):
         # Properties
         self.block_size = block_size
         self.file = file
+        self.cache = None
+        self.buffer_size = buffer_size
+        self.buffer = None
+        self.buffer_start = 0
+        self.counters = WriteCounters()
+
+        # Address of the block following the last one read or written, used
+        # when reading without giving a block
+        self.position = 0
+
+        if cache_size:
+            self.cache = BlockCache(block_size, cache_size)
+
+        if buffer_size:
+            self.__reset_buffer()
 
     def __len__(self):
+        if self.buffer is not None:
+            return self.buffer_start + len(self.buffer)
+
         self.file.seek(0, os.SEEK_END)
         return self.file.tell()
 
+    def __reset_buffer(self):
+        self.file.seek(0, os.SEEK_END)
+        self.buffer = bytearray()
+        self.buffer_start = self.file.tell()
+
     # Method returning the number of blocks
     def count_blocks(self):
         return self.__len__() / self.block_size
@@ -32,29 +71,165 @@ class FileStorage(object):
 
         return False
 
+    # Method swapping the underlying file, e.g. after truncating it
+    def reset(self, file):
+        self.file = file
+        self.position = 0
+
+        if self.cache is not None:
+            self.cache.clear()
+
+        if self.buffer is not None:
+            self.__reset_buffer()
+
+    # Method writing the append buffer to the file
+    def flush(self):
+        if self.buffer:
+            self.file.seek(self.buffer_start)
+            self.file.write(self.buffer)
+            self.buffer_start += len(self.buffer)
+            self.buffer = bytearray()
+
+        self.file.flush()
+
+    # Method flushing pending writes before the file gets closed
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+
     # Method reading a block in the file and returning the contained node
     def read(self, block=None):
-        if block is not None:
-            self.file.seek(block)
+        if block is None:
+            block = self.position
+
+        self.position = block + self.block_size
+
+        # The block might still be waiting in the append buffer
+        if self.buffer is not None and block >= self.buffer_start:
+            offset = block - self.buffer_start
+
+            return bytes(self.buffer[offset : offset + self.block_size]) or None
 
+        if self.cache is not None:
+            data = self.cache.get(block)
+
+            if data is not None:
+                return data
+
+        self.file.seek(block)
         data = self.file.read(self.block_size)
 
-        return data or None
+        if not data:
+            return None
+
+        if self.cache is not None:
+            self.cache.set(block, data)
+
+        return data
+
+    # Method returning a buffer containing the block and its offset in it
+    def read_buffer(self, block):
+        data = self.read(block)
+
+        if data is None:
+            return None
+
+        return data, 0
 
     # Method writing a node
     def write(self, data, block=None):
+        self.counters.writes += 1
+
+        if self.buffer is not None:
+            if block is None:
+                block = self.buffer_start + len(self.buffer)
+                self.buffer.extend(data)
+                self.position = block + self.block_size
+
+                if len(self.buffer) >= self.buffer_size:
+                    self.flush()
+
+                return block
+
+            if block >= self.buffer_start:
+                offset = block - self.buffer_start
+                self.buffer[offset : offset + len(data)] = data
+                self.position = block + self.block_size
+
+                return block
+
         if block is not None:
             self.file.seek(block)
         else:
             self.file.seek(0, os.SEEK_END)
 
+            # TODO: can be avoided if we do not append
+            block = self.file.tell()
+
         self.file.write(data)
+        self.position = block + self.block_size
 
-        # TODO: can be avoided if we do not append
-        block = self.file.tell() - self.block_size
+        if self.cache is not None:
+            self.cache.set(block, bytes(data))
 
         return block
 
+    # Method writing some bytes at the given offset, within a single block
+    def write_at(self, offset, data):
+        self.counters.partial_writes += 1
+
+        if self.buffer is not None and offset >= self.buffer_start:
+            start = offset - self.buffer_start
+            self.buffer[start : start + len(data)] = data
+
+            return
+
+        self.file.seek(offset)
+        self.file.write(data)
+
+        if self.cache is not None:
+            block = offset - offset % self.block_size
+            self.cache.patch(block, offset - block, bytes(data))
+
+    # Method iterating over the blocks by reading large sequential chunks
+    # NOTE: blocks updated after their chunk was read will be yielded stale
+    def iter_blocks(self, start=0, chunk_bytes=ITER_BLOCKS_CHUNK_SIZE):
+        chunk_bytes = aligned_chunk_size(self.block_size, chunk_bytes)
+        block = start
+
+        while block < self.__len__():
+            # Blocks still in the append buffer
+            if self.buffer is not None and block >= self.buffer_start:
+                offset = block - self.buffer_start
+                chunk = bytes(self.buffer[offset : offset + chunk_bytes])
+
+            else:
+                size = chunk_bytes
+
+                if self.buffer is not None:
+                    size = min(size, self.buffer_start - block)
+
+                self.file.seek(block)
+                chunk = self.file.read(size)
+
+            if len(chunk) < self.block_size:
+                return
+
+            for item in chunk_blocks_iter(self.block_size, block, chunk):
+                yield item
+
+            block += len(chunk) - len(chunk) % self.block_size
+
+    # Method returning the cache's counters
+    def cache_metrics(self):
+        if self.cache is None:
+            return None
+
+        return self.cache.metrics()
+
     # Method returning a map
     def map(self):
+        if self.buffer is not None:
+            self.flush()
+
         return MemMapStorage(self.block_size, self.file)
@@ -0,0 +1,63 @@
+# =============================================================================
+# Storage Helpers
+# =============================================================================
+#
+# Miscellaneous helper functions used by the storage classes.
+#
+import os
+
+# Default number of bytes read at once when scanning a whole storage
+ITER_BLOCKS_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def aligned_chunk_size(block_size, chunk_bytes):
+    """
+    Returning the given chunk size rounded down to a whole number of blocks.
+    """
+    return max(chunk_bytes - chunk_bytes % block_size, block_size)
+
+
+def chunk_blocks_iter(block_size, start, chunk):
+    """
+    Returning an iterator over the (address, data) pairs of the complete
+    blocks contained in a chunk read at the given address.
+    """
+    view = memoryview(chunk)
+    end = len(chunk) - len(chunk) % block_size
+
+    for offset in range(0, end, block_size):
+        yield start + offset, view[offset : offset + block_size]
+
+
+def trim_null_blocks(file, block_size, chunk_bytes=ITER_BLOCKS_CHUNK_SIZE):
+    """
+    Truncating the given file right after its last block not entirely made of
+    null bytes, so as to drop the extent a memory map grew it by if it was not
+    properly closed, and returning the file's size. Files whose size is not a
+    multiple of the block size are left as is.
+    """
+    file.flush()
+    fd = file.fileno()
+    size = os.fstat(fd).st_size
+
+    if size % block_size:
+        return size
+
+    chunk_bytes = aligned_chunk_size(block_size, chunk_bytes)
+    length = size
+
+    while length > 0:
+        start = max(length - chunk_bytes, 0)
+        chunk = os.pread(fd, length - start, start)
+        end = len(chunk.rstrip(b"\0"))
+
+        if end:
+            length = start + end + -end % block_size
+            break
+
+        length = start
+
+    if length != size:
+        os.ftruncate(fd, length)
+
+    return length
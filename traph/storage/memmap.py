@@ -2,23 +2,194 @@
 # Memory Map Storage Class
 # =============================================================================
 #
-# Class abstracting reading the given file using python's mmap module
+# Class abstracting reading & writing the given file using python's mmap
+# module.
+#
+# When writable, the file is grown by large extents and remapped whenever
+# the map runs out of space. The file is then trimmed to its real size when
+# closing the storage.
+#
+# Note that the real size of a file which was not properly closed is
+# recovered by trimming its trailing null blocks, which is fine since no
+# valid block of the Traph's files is entirely made of null bytes. Since
+# other storages cannot tell those blocks from actual ones, the Traph trims
+# its files the same way when opening them, whatever its storage.
 #
 import mmap
+import os
+from traph.storage.counters import WriteCounters
+from traph.storage.helpers import (
+    ITER_BLOCKS_CHUNK_SIZE,
+    aligned_chunk_size,
+    chunk_blocks_iter,
+    trim_null_blocks,
+)
+
+# Default number of bytes the file grows by each time the map is full
+MEMMAP_STORAGE_EXTENT = 32 * 1024 * 1024
 
 
 # Main class
 class MemMapStorage(object):
-    def __init__(self, block_size, file):
+    def __init__(self, block_size, file, writable=False, extent=None):
         # Properties
         self.block_size = block_size
         self.file = file
-        self.map = mmap.mmap(file.fileno(), access=mmap.ACCESS_READ, length=0)
+        self.writable = writable
+        self.extent = extent or MEMMAP_STORAGE_EXTENT
+        self.map = None
+        self.length = 0
+        self.capacity = 0
+        self.counters = WriteCounters()
+
+        # Address of the block following the last one read or written, used
+        # when reading without giving a block
+        self.position = 0
+
+        # Extents should contain whole blocks
+        if self.extent % block_size:
+            self.extent += block_size - self.extent % block_size
+
+        self.__open()
+
+    def __len__(self):
+        return self.length
+
+    def __open(self):
+        if not self.writable:
+            self.map = mmap.mmap(self.file.fileno(), access=mmap.ACCESS_READ, length=0)
+            self.length = len(self.map)
+            self.capacity = self.length
+            return
+
+        # Recovering the real size of a file which was not properly closed
+        size = trim_null_blocks(self.file, self.block_size)
+
+        self.capacity = max(size, self.extent)
+        self.capacity += -self.capacity % self.block_size
+
+        if self.capacity != size:
+            os.ftruncate(self.file.fileno(), self.capacity)
+
+        self.map = mmap.mmap(self.file.fileno(), self.capacity)
+        self.length = size - size % self.block_size
+
+    def __grow(self, end):
+        capacity = self.capacity
+
+        while capacity < end:
+            capacity += self.extent
+
+        try:
+            self.map.resize(capacity)
+
+        # Some platforms cannot resize a map, we need to remap the file
+        # NOTE: the former map is not closed since it may still be referenced
+        # by node views, and remains coherent since both maps are shared
+        except SystemError:
+            self.map.flush()
+            os.ftruncate(self.file.fileno(), capacity)
+            self.map = mmap.mmap(self.file.fileno(), capacity)
+
+        self.capacity = capacity
+
+    # Method returning the number of blocks
+    def count_blocks(self):
+        return self.__len__() / self.block_size
+
+    # Method returning whether the file is corrupted
+    def check_for_corruption(self):
+        if self.length % self.block_size:
+            return True
+
+        return False
+
+    # Method swapping the underlying file, e.g. after truncating it
+    def reset(self, file):
+        if self.map is not None and not self.map.closed:
+            self.map.close()
+
+        self.file = file
+        self.position = 0
+        self.__open()
 
     # Method reading a block in the map and returning the contained node
-    def read(self, block):
+    def read(self, block=None):
+        if block is None:
+            block = self.position
+
+        self.position = block + self.block_size
+
+        if block >= self.length:
+            return None
+
         return self.map[block : block + self.block_size] or None
 
+    # Method returning a buffer containing the block and its offset in it
+    # NOTE: the map itself is returned, so no copy is made
+    def read_buffer(self, block):
+        if block + self.block_size > self.length:
+            return None
+
+        return self.map, block
+
+    # Method iterating over the blocks by chunks
+    # NOTE: chunks are copied so that the map can still grow meanwhile
+    def iter_blocks(self, start=0, chunk_bytes=ITER_BLOCKS_CHUNK_SIZE):
+        chunk_bytes = aligned_chunk_size(self.block_size, chunk_bytes)
+        block = start
+
+        while block + self.block_size <= self.length:
+            chunk = self.map[block : min(block + chunk_bytes, self.length)]
+
+            for item in chunk_blocks_iter(self.block_size, block, chunk):
+                yield item
+
+            block += len(chunk) - len(chunk) % self.block_size
+
+    # Method writing a node
+    def write(self, data, block=None):
+        self.counters.writes += 1
+
+        if block is None:
+            block = self.length
+
+        end = block + len(data)
+
+        if end > self.capacity:
+            self.__grow(end)
+
+        self.map[block:end] = data
+        self.position = block + self.block_size
+
+        if end > self.length:
+            self.length = end
+
+        return block
+
+    # Method writing some bytes at the given offset, within the written blocks
+    def write_at(self, offset, data):
+        self.counters.partial_writes += 1
+
+        self.map[offset : offset + len(data)] = data
+
+    # Method flushing the map's dirty pages to the file
+    def flush(self):
+        if self.writable:
+            self.map.flush()
+
+    # Method releasing the map and trimming the file to its real size
+    def close(self):
+        if self.map is None or self.map.closed:
+            return
+
+        self.flush()
+        self.map.close()
+
+        if self.writable:
+            os.ftruncate(self.file.fileno(), self.length)
+            self.capacity = self.length
+
     # Method releasing the map from memory
     def release(self):
-        self.map.close()
+        self.close()
@@ -4,6 +4,12 @@
 #
 # Class storing the data in a byte array.
 #
+from traph.storage.counters import WriteCounters
+from traph.storage.helpers import (
+    ITER_BLOCKS_CHUNK_SIZE,
+    aligned_chunk_size,
+    chunk_blocks_iter,
+)
 
 
 # Main class
@@ -12,6 +18,7 @@ class MemoryStorage(object):
         # Properties
         self.block_size = block_size
         self.array = bytearray()
+        self.counters = WriteCounters()
 
     def __len__(self):
         return len(self.array)
@@ -33,8 +40,32 @@ class MemoryStorage(object):
         except:
             raise
 
+    # Method returning a buffer containing the block and its offset in it
+    # NOTE: the bytearray itself is returned, so no copy is made
+    def read_buffer(self, block):
+        if block + self.block_size > len(self.array):
+            return None
+
+        return self.array, block
+
+    # Method iterating over the blocks by chunks
+    # NOTE: chunks are copied so that the bytearray can still grow meanwhile
+    def iter_blocks(self, start=0, chunk_bytes=ITER_BLOCKS_CHUNK_SIZE):
+        chunk_bytes = aligned_chunk_size(self.block_size, chunk_bytes)
+        block = start
+
+        while block + self.block_size <= len(self.array):
+            chunk = bytes(self.array[block : block + chunk_bytes])
+
+            for item in chunk_blocks_iter(self.block_size, block, chunk):
+                yield item
+
+            block += len(chunk) - len(chunk) % self.block_size
+
     # Method writing nodes to the bytearray
     def write(self, data, block=None):
+        self.counters.writes += 1
+
         if block is None:
             self.array.extend(data)
 
@@ -44,3 +75,9 @@ class MemoryStorage(object):
             self.array[block : block + self.block_size] = data
 
         return block
+
+    # Method writing some bytes at the given offset
+    def write_at(self, offset, data):
+        self.counters.partial_writes += 1
+
+        self.array[offset : offset + len(data)] = data
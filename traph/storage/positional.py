@@ -0,0 +1,116 @@
+# =============================================================================
+# Positional Storage Class
+# =============================================================================
+#
+# Class abstracting random access file handling for the Traph using
+# positional I/O (`os.pread` & `os.pwrite`) rather than a shared cursor.
+#
+# Since every read gives its own explicit offset, any number of threads can
+# read from the same storage without any lock. Appends are still serialized
+# so that concurrent writers cannot be handed the same address.
+#
+import os
+from threading import Lock
+from traph.storage.counters import WriteCounters
+from traph.storage.helpers import (
+    ITER_BLOCKS_CHUNK_SIZE,
+    aligned_chunk_size,
+    chunk_blocks_iter,
+)
+
+
+# Main class
+class PositionalStorage(object):
+    def __init__(self, block_size, file):
+        # Properties
+        self.block_size = block_size
+        self.file = file
+        self.fd = file.fileno()
+        self.length = os.fstat(self.fd).st_size
+        self.lock = Lock()
+        self.counters = WriteCounters()
+
+    def __len__(self):
+        return self.length
+
+    # Method returning the number of blocks
+    def count_blocks(self):
+        return self.__len__() / self.block_size
+
+    # Method returning whether the file is corrupted
+    def check_for_corruption(self):
+        if self.length % self.block_size:
+            return True
+
+        return False
+
+    # Method swapping the underlying file, e.g. after truncating it
+    def reset(self, file):
+        with self.lock:
+            self.file = file
+            self.fd = file.fileno()
+            self.length = os.fstat(self.fd).st_size
+
+    # Method reading a block in the file and returning the contained node
+    def read(self, block):
+        return os.pread(self.fd, self.block_size, block) or None
+
+    # Method returning a buffer containing the block and its offset in it
+    def read_buffer(self, block):
+        data = self.read(block)
+
+        if data is None:
+            return None
+
+        return data, 0
+
+    # Method iterating over the blocks by reading large sequential chunks
+    def iter_blocks(self, start=0, chunk_bytes=ITER_BLOCKS_CHUNK_SIZE):
+        chunk_bytes = aligned_chunk_size(self.block_size, chunk_bytes)
+        block = start
+
+        while block + self.block_size <= self.length:
+            chunk = os.pread(self.fd, chunk_bytes, block)
+
+            if len(chunk) < self.block_size:
+                return
+
+            for item in chunk_blocks_iter(self.block_size, block, chunk):
+                yield item
+
+            block += len(chunk) - len(chunk) % self.block_size
+
+    # Method writing a node
+    def write(self, data, block=None):
+        self.counters.writes += 1
+
+        if block is not None:
+            os.pwrite(self.fd, data, block)
+
+            if block + len(data) > self.length:
+                with self.lock:
+                    self.length = max(self.length, block + len(data))
+
+            return block
+
+        with self.lock:
+            block = self.length
+            self.length += len(data)
+
+        os.pwrite(self.fd, data, block)
+
+        return block
+
+    # Method writing some bytes at the given offset
+    def write_at(self, offset, data):
+        self.counters.partial_writes += 1
+
+        os.pwrite(self.fd, data, offset)
+
+    # NOTE: writes are not buffered, so there is nothing to flush
+    def flush(self):
+        pass
+
+    # Method called before the file gets closed
+    def close(self):
+        pass
@@ -0,0 +1,200 @@
+# =============================================================================
+# Split Storage Class
+# =============================================================================
+#
+# Class storing each block as two columns kept in separate files: the bytes
+# preceding the given split offset go to a "cold" file and the following ones
+# to a "hot" file, both being addressed by the block's index.
+#
+# The LRU Trie uses it to keep the stems apart from the flags & pointers, so
+# that traversals which never look at the stems only read the hot file. Full
+# blocks, as returned by `read` & `iter_blocks`, are reassembled from both
+# files, while `read_registers_buffer` & `iter_registers` only read the hot
+# one and `read_stem_buffer` only the cold one.
+#
+# Like the positional storage, it relies on `os.pread` & `os.pwrite` and
+# neither caches nor buffers anything.
+#
+import os
+from traph.storage.counters import WriteCounters
+from traph.storage.helpers import ITER_BLOCKS_CHUNK_SIZE, chunk_blocks_iter
+
+
+# Main class
+class SplitStorage(object):
+    def __init__(self, block_size, split_offset, file, cold_file):
+        # Properties
+        self.block_size = block_size
+        self.split_offset = split_offset
+        self.hot_size = block_size - split_offset
+        self.counters = WriteCounters()
+
+        # Bytes standing for the cold part of the blocks only read in part,
+        # so that the hot registers keep their offsets
+        self.padding = bytes(split_offset)
+
+        self.reset(file, cold_file)
+
+    def __len__(self):
+        return self.nb_blocks * self.block_size
+
+    # Method returning the number of blocks
+    def count_blocks(self):
+        return self.nb_blocks
+
+    # Method returning whether the files are corrupted
+    def check_for_corruption(self):
+        hot_length = os.fstat(self.fd).st_size
+        cold_length = os.fstat(self.cold_fd).st_size
+
+        if hot_length % self.hot_size or cold_length % self.split_offset:
+            return True
+
+        return hot_length // self.hot_size != cold_length // self.split_offset
+
+    # Method swapping the underlying files, e.g. after truncating them
+    def reset(self, file, cold_file):
+        self.file = file
+        self.cold_file = cold_file
+        self.fd = file.fileno()
+        self.cold_fd = cold_file.fileno()
+        self.nb_blocks = os.fstat(self.fd).st_size // self.hot_size
+
+    # Method reading a block from both files
+    def read(self, block):
+        index = block // self.block_size
+
+        if index >= self.nb_blocks:
+            return None
+
+        return os.pread(
+            self.cold_fd, self.split_offset, index * self.split_offset
+        ) + os.pread(self.fd, self.hot_size, index * self.hot_size)
+
+    # Method returning a buffer containing the block and its offset in it
+    def read_buffer(self, block):
+        data = self.read(block)
+
+        if data is None:
+            return None
+
+        return data, 0
+
+    # Method returning a buffer containing the hot part of the block, at its
+    # usual offset, and the offset of the block in it
+    def read_registers_buffer(self, block):
+        index = block // self.block_size
+
+        if index >= self.nb_blocks:
+            return None
+
+        return self.padding + os.pread(self.fd, self.hot_size, index * self.hot_size), 0
+
+    # Method returning a buffer containing the cold part of the block
+    def read_stem_buffer(self, block):
+        index = block // self.block_size
+
+        return os.pread(self.cold_fd, self.split_offset, index * self.split_offset)
+
+    # Method iterating over the blocks by reading large sequential chunks
+    def iter_blocks(self, start=0, chunk_bytes=ITER_BLOCKS_CHUNK_SIZE):
+        index = start // self.block_size
+        nb_chunk_blocks = max(chunk_bytes // self.block_size, 1)
+
+        while index < self.nb_blocks:
+            count = min(nb_chunk_blocks, self.nb_blocks - index)
+
+            hot = os.pread(self.fd, count * self.hot_size, index * self.hot_size)
+            cold = os.pread(
+                self.cold_fd, count * self.split_offset, index * self.split_offset
+            )
+
+            count = min(len(hot) // self.hot_size, len(cold) // self.split_offset)
+
+            if not count:
+                return
+
+            chunk = bytearray()
+
+            for i in range(count):
+                chunk += cold[i * self.split_offset : (i + 1) * self.split_offset]
+                chunk += hot[i * self.hot_size : (i + 1) * self.hot_size]
+
+            for item in chunk_blocks_iter(
+                self.block_size, index * self.block_size, chunk
+            ):
+                yield item
+
+            index += count
+
+    # Method iterating over the hot part of the blocks, given at their usual
+    # offset, by reading large sequential chunks of the hot file only
+    def iter_registers(self, start=0, chunk_bytes=ITER_BLOCKS_CHUNK_SIZE):
+        index = start // self.block_size
+        nb_chunk_blocks = max(chunk_bytes // self.hot_size, 1)
+
+        while index < self.nb_blocks:
+            count = min(nb_chunk_blocks, self.nb_blocks - index)
+            hot = os.pread(self.fd, count * self.hot_size, index * self.hot_size)
+            count = len(hot) // self.hot_size
+
+            if not count:
+                return
+
+            for i in range(count):
+                yield (
+                    (index + i) * self.block_size,
+                    self.padding + hot[i * self.hot_size : (i + 1) * self.hot_size],
+                )
+
+            index += count
+
+    # Method writing a whole block
+    def write(self, data, block=None):
+        self.counters.writes += 1
+
+        if block is None:
+            block = self.nb_blocks * self.block_size
+
+        index = block // self.block_size
+
+        os.pwrite(
+            self.cold_fd, bytes(data[: self.split_offset]), index * self.split_offset
+        )
+        os.pwrite(self.fd, bytes(data[self.split_offset :]), index * self.hot_size)
+
+        self.nb_blocks = max(self.nb_blocks, index + 1)
+
+        return block
+
+    # Method writing some bytes at the given offset, within a single block
+    def write_at(self, offset, data):
+        self.counters.partial_writes += 1
+
+        index = offset // self.block_size
+        offset -= index * self.block_size
+        end = offset + len(data)
+
+        if offset < self.split_offset:
+            os.pwrite(
+                self.cold_fd,
+                bytes(data[: self.split_offset - offset]),
+                index * self.split_offset + offset,
+            )
+
+        if end > self.split_offset:
+            skip = max(self.split_offset - offset, 0)
+
+            os.pwrite(
+                self.fd,
+                bytes(data[skip:]),
+                index * self.hot_size + offset + skip - self.split_offset,
+            )
+
+    # NOTE: writes are not buffered, so there is nothing to flush
+    def flush(self):
+        pass
+
+    # Method called before the files get closed
+    def close(self):
+        pass
@@ -12,11 +12,41 @@ import warnings
 from collections import defaultdict, Counter
 from .traph_write_report import TraphWriteReport
 from .traph_iterator_state import TraphIteratorState, run_iterator
-from .storage import FileStorage, MemoryStorage
-from .lru_trie import LRUTrie, LRU_TRIE_NODE_BLOCK_SIZE
+from .storage import (
+    FileStorage,
+    MemoryStorage,
+    MemMapStorage,
+    PositionalStorage,
+    SplitStorage,
+)
+from .storage.helpers import trim_null_blocks
+from .lru_trie import (
+    LRUTrie,
+    LRU_TRIE_NODE_BLOCK_SIZE,
+    LRU_TRIE_DESCENT_CACHE_SIZE,
+    LRU_TRIE_MAX_BST_RATIO,
+    LRU_TRIE_STEM_FIELD_SIZE,
+    LRU_TRIE_WINDUP_CACHE_SIZE,
+    LRU_TRIE_WEBENTITY_CACHE_SIZE,
+    LRU_TRIE_SUBTREE_COUNTERS_BLOCK_SIZE,
+    LRU_TRIE_PREFIX_INDEX_BLOCK_SIZE,
+)
 from .link_store import LinkStore, LINK_STORE_NODE_BLOCK_SIZE
+from .compaction import compact
 
-from .helpers import lru_variations, build_pagination_token, parse_pagination_token
+from .helpers import (
+    lru_iter,
+    lru_variations,
+    build_pagination_token,
+    parse_pagination_token,
+)
+
+
+# Storage backends that can be used when the Traph is stored on disk
+STORAGES = ("file", "mmap", "pread", "split")
+
+# Size in bytes of the append buffers used when compacting the Traph
+COMPACTION_BUFFER_SIZE = 1 << 20
 
 
 # Exceptions
@@ -37,11 +67,55 @@ class Traph(object):
         debug=False,
         default_webentity_creation_rule=None,
         webentity_creation_rules=None,
+        storage="file",
+        cache_size=0,
+        buffer_size=0,
+        descent_cache_size=LRU_TRIE_DESCENT_CACHE_SIZE,
+        windup_cache_size=LRU_TRIE_WINDUP_CACHE_SIZE,
+        webentity_cache_size=LRU_TRIE_WEBENTITY_CACHE_SIZE,
+        subtree_counters=False,
     ):
+        """
+        Note: storage selects how the Traph's files are accessed, either
+        through regular file I/O ("file"), through a writable memory map
+        ("mmap") or through positional I/O ("pread"), the latter letting
+        several threads read from the same Traph. The "split" storage also
+        uses positional I/O but keeps the trie's stems in a separate file,
+        `lru_trie.stems.dat`, so that traversals which only need the flags &
+        pointers read much less data. It can only open Traphs created with
+        it. The storage is ignored when the Traph is stored in memory.
+        Since the "mmap" storage grows the files by large zeroed extents, the
+        trailing null blocks of the files are trimmed when opening them, so
+        that a Traph which was not properly closed can be opened by any
+        storage but the "split" one.
+
+        Note 2: cache_size is the size in bytes of the block cache kept for
+        each of the Traph's files (0 to disable it), and buffer_size the size
+        in bytes of the append buffer coalescing their new blocks (0 to
+        disable it). Both only apply to the "file" storage.
+
+        Note 3: descent_cache_size is the number of LRU prefixes whose trie
+        node is remembered so that descents sharing a prefix do not need to
+        start from the root again (0 to disable it), and windup_cache_size
+        the size in bytes of the cache of wound up LRUs used to resolve the
+        pages found in the link store (0 to disable it). Likewise,
+        webentity_cache_size is the number of nodes whose nearest
+        webentity prefix is remembered to resolve the webentity of those
+        pages (0 to disable it).
+
+        Note 4: subtree_counters makes the Traph maintain, in a separate
+        `lru_trie.counts.dat` file, the number of pages & crawled pages found
+        below each node of the trie, so that the pages of a webentity can be
+        counted and paginated by offset without iterating over them. The
+        setting is kept in the Traph's header so it only needs to be given
+        once, the counters being rebuilt whenever they cannot be trusted.
+        """
         # Handling encoding
         self.encoding = encoding
 
         # Debugging mode
+        self.debug = debug
+
         if debug:
             if not default_webentity_creation_rule:
                 default_webentity_creation_rule = ""
@@ -58,11 +132,26 @@ class Traph(object):
                 raise TraphException("Given webentity creation rules is not a dict!")
                 # TODO: check if each value is correctly a string
 
+        if storage not in STORAGES:
+            raise TraphException(
+                "Unknown storage %s, expecting one of %s" % (storage, STORAGES)
+            )
+
         # Files
         self.folder = folder
+        self.storage = storage
+        self.descent_cache_size = descent_cache_size
+        self.windup_cache_size = windup_cache_size
+        self.webentity_cache_size = webentity_cache_size
         self.lru_trie_file = None
+        self.lru_trie_stems_file = None
+        self.lru_trie_counts_file = None
+        self.lru_trie_webentities_file = None
         self.link_store_file = None
         self.lru_trie_path = None
+        self.lru_trie_stems_path = None
+        self.lru_trie_counts_path = None
+        self.lru_trie_webentities_path = None
         self.link_store_path = None
 
         create = overwrite
@@ -73,6 +162,11 @@ class Traph(object):
             assert folder is not None
             self.lru_trie_path = os.path.join(folder, "lru_trie.dat")
             self.link_store_path = os.path.join(folder, "link_store.dat")
+            self.lru_trie_stems_path = os.path.join(folder, "lru_trie.stems.dat")
+            self.lru_trie_counts_path = os.path.join(folder, "lru_trie.counts.dat")
+            self.lru_trie_webentities_path = os.path.join(
+                folder, "lru_trie.webentities.dat"
+            )
 
             # Ensuring the given folder exists
             try:
@@ -103,18 +197,72 @@ class Traph(object):
                 not lru_trie_file_exists and not link_store_file_exists
             )
 
+            # Checking the trie's layout matches the storage
+            if not create and (storage == "split") != os.path.isfile(
+                self.lru_trie_stems_path
+            ):
+                raise TraphException(
+                    "File inconsistency: Traphs created with the `split` storage,"
+                    " and only those, must be opened with it."
+                )
+
             flags = "wb+" if create else "rb+"
 
             self.lru_trie_file = open(self.lru_trie_path, flags)
             self.link_store_file = open(self.link_store_path, flags)
 
-            self.lru_trie_storage = FileStorage(
-                LRU_TRIE_NODE_BLOCK_SIZE, self.lru_trie_file
-            )
+            # Dropping the extent a "mmap" Traph which was not properly closed
+            # may have left at the end of its files
+            if not create and storage != "split":
+                trim_null_blocks(self.lru_trie_file, LRU_TRIE_NODE_BLOCK_SIZE)
+                trim_null_blocks(self.link_store_file, LINK_STORE_NODE_BLOCK_SIZE)
 
-            self.links_store_storage = FileStorage(
-                LINK_STORE_NODE_BLOCK_SIZE, self.link_store_file
-            )
+            if storage == "split":
+                self.lru_trie_stems_file = open(self.lru_trie_stems_path, flags)
+
+                self.lru_trie_storage = SplitStorage(
+                    LRU_TRIE_NODE_BLOCK_SIZE,
+                    LRU_TRIE_STEM_FIELD_SIZE,
+                    self.lru_trie_file,
+                    self.lru_trie_stems_file,
+                )
+
+                self.links_store_storage = PositionalStorage(
+                    LINK_STORE_NODE_BLOCK_SIZE, self.link_store_file
+                )
+
+            elif storage == "mmap":
+                self.lru_trie_storage = MemMapStorage(
+                    LRU_TRIE_NODE_BLOCK_SIZE, self.lru_trie_file, writable=True
+                )
+
+                self.links_store_storage = MemMapStorage(
+                    LINK_STORE_NODE_BLOCK_SIZE, self.link_store_file, writable=True
+                )
+
+            elif storage == "pread":
+                self.lru_trie_storage = PositionalStorage(
+                    LRU_TRIE_NODE_BLOCK_SIZE, self.lru_trie_file
+                )
+
+                self.links_store_storage = PositionalStorage(
+                    LINK_STORE_NODE_BLOCK_SIZE, self.link_store_file
+                )
+
+            else:
+                self.lru_trie_storage = FileStorage(
+                    LRU_TRIE_NODE_BLOCK_SIZE,
+                    self.lru_trie_file,
+                    cache_size=cache_size,
+                    buffer_size=buffer_size,
+                )
+
+                self.links_store_storage = FileStorage(
+                    LINK_STORE_NODE_BLOCK_SIZE,
+                    self.link_store_file,
+                    cache_size=cache_size,
+                    buffer_size=buffer_size,
+                )
 
             # Checking for corruption
             if not create and self.lru_trie_storage.check_for_corruption():
@@ -128,11 +276,24 @@ class Traph(object):
             self.links_store_storage = MemoryStorage(LINK_STORE_NODE_BLOCK_SIZE)
 
         # LRU Trie initialization
-        self.lru_trie = LRUTrie(self.lru_trie_storage, encoding=encoding)
+        self.lru_trie = LRUTrie(
+            self.lru_trie_storage,
+            encoding=encoding,
+            descent_cache_size=descent_cache_size,
+            windup_cache_size=windup_cache_size,
+            webentity_cache_size=webentity_cache_size,
+        )
+
+        if subtree_counters or self.lru_trie.header.has_subtree_counters():
+            self.__use_subtree_counters(create)
+
+        self.__use_prefix_index(create)
 
         # Link Store initialization
         self.link_store = LinkStore(self.links_store_storage)
 
+        self.__open_counters()
+
         # Webentity creation rules are stored in RAM
         if not debug:
             self.default_webentity_creation_rule = re.compile(
@@ -153,6 +314,64 @@ class Traph(object):
 
         return string.encode(self.encoding)
 
+    def __open_counters(self):
+        # NOTE: the counters of an in-memory Traph cannot outlive it
+        if not self.in_memory:
+            self.lru_trie.open_counters()
+            self.lru_trie_storage.flush()
+
+    def __use_subtree_counters(self, create=False):
+        lru_trie = self.lru_trie
+
+        # NOTE: the subtree counters are only as trustworthy as the header's
+        # ones, which are not after an unclean close
+        rebuild = not lru_trie.header.has_subtree_counters() or (
+            not lru_trie.exact_counters
+        )
+
+        if self.in_memory:
+            storage = MemoryStorage(LRU_TRIE_SUBTREE_COUNTERS_BLOCK_SIZE)
+        else:
+            rebuild = rebuild or create or not os.path.isfile(self.lru_trie_counts_path)
+
+            # NOTE: rebuilt counters start from an empty file since missing
+            # records must read as zeros
+            self.lru_trie_counts_file = open(
+                self.lru_trie_counts_path, "wb+" if rebuild else "rb+"
+            )
+
+            storage = PositionalStorage(
+                LRU_TRIE_SUBTREE_COUNTERS_BLOCK_SIZE, self.lru_trie_counts_file
+            )
+
+        lru_trie.use_subtree_counters(storage)
+
+        if rebuild:
+            if not lru_trie.exact_counters:
+                lru_trie.rebuild_counters()
+
+            lru_trie.rebuild_subtree_counters()
+
+    def __use_prefix_index(self, create=False):
+        if self.in_memory:
+            storage = MemoryStorage(LRU_TRIE_PREFIX_INDEX_BLOCK_SIZE)
+        else:
+            exists = not create and os.path.isfile(self.lru_trie_webentities_path)
+
+            self.lru_trie_webentities_file = open(
+                self.lru_trie_webentities_path, "rb+" if exists else "wb+"
+            )
+
+            storage = PositionalStorage(
+                LRU_TRIE_PREFIX_INDEX_BLOCK_SIZE, self.lru_trie_webentities_file
+            )
+
+        self.lru_trie.use_prefix_index(storage)
+
+    def __write_counters(self, close=False):
+        self.lru_trie.write_counters(close=close)
+        self.link_store.write_counters()
+
     def __generated_web_entity_id(self):
         header = self.lru_trie.header
         header.increment_last_webentity_id()
@@ -160,6 +379,14 @@ class Traph(object):
 
         return header.last_webentity_id()
 
+    # Method returning the given prefixes or, if None, the prefixes of the
+    # given webentity found in the prefix index
+    def __webentity_prefixes(self, weid, prefixes):
+        if prefixes is not None:
+            return prefixes
+
+        return self.get_webentity_prefixes(weid)
+
     def __add_prefixes(self, prefixes, use_best_case=True):
         # Check that prefixes are not already defining a web entity
         valid_prefixes_index = {}
@@ -189,8 +416,7 @@ class Traph(object):
 
             for prefix, [node, history] in valid_prefixes_index.items():
                 node.refresh()  # node update necessary
-                node.set_webentity(webentity_id)
-                node.write()
+                self.lru_trie.set_webentity(node, prefix, webentity_id)
 
             return webentity_id, list(valid_prefixes_index.keys())
 
@@ -231,6 +457,12 @@ class Traph(object):
     def __add_page(self, lru, crawled=False):
         node, history = self.lru_trie.add_page(lru, crawled=crawled)
 
+        report = self.__apply_webentity_creation_rules_to_page(lru, history)
+
+        node.refresh()  # update node
+        return node, report
+
+    def __apply_webentity_creation_rules_to_page(self, lru, history):
         report = TraphWriteReport()
 
         if history.page_was_created:
@@ -257,14 +489,12 @@ class Traph(object):
 
         # In this case, the webentity already exists
         if longest_candidate_prefix and len(longest_candidate_prefix) <= history.webentity_position:
-            node.refresh()  # update node
-            return node, report
+            return report
 
         # Else we need to expand the prefix and create relevant web entities
         if longest_candidate_prefix:
             report += self.__create_webentity(longest_candidate_prefix, expand=True)
-            node.refresh()  # update node
-            return node, report
+            return report
 
         # Nothing worked, we need to apply the default creation rule
         longest_candidate_prefix = self.__apply_webentity_default_creation_rule(lru)
@@ -277,8 +507,54 @@ class Traph(object):
         else:
             report += self.__create_webentity(longest_candidate_prefix, expand=True)
 
-        node.refresh()  # update node
-        return node, report
+        return report
+
+    # Method adding a batch of (lru, crawled) pages, yielding the node & report
+    # of each one of them, in the given order, as __add_page would. The lrus
+    # are first added to the trie ordered by prefix so that each descent can
+    # start from the prefix shared with the previous lru, then the creation
+    # rules are applied in the batch's own order so that the created
+    # webentities, and their ids, remain the same.
+    def __add_page_batch_iter(self, pages):
+        crawled_lrus = {}
+
+        for lru, crawled in pages:
+            crawled_lrus[lru] = crawled or crawled_lrus.get(lru, False)
+
+        walks = {
+            lru: (node, history)
+            for lru, node, history in self.lru_trie.add_page_batch_iter(crawled_lrus)
+        }
+
+        # Prefixes of the webentities created by the batch so far, since the
+        # walk histories do not know about them
+        created_prefixes = {}
+
+        for lru, _ in pages:
+            node, history = walks[lru]
+
+            if created_prefixes:
+                prefix = b""
+
+                for stem in lru_iter(lru):
+                    prefix += stem
+                    weid = created_prefixes.get(prefix)
+
+                    if weid is not None and len(prefix) > history.webentity_position:
+                        history.update_webentity(weid, prefix, len(prefix))
+
+            report = self.__apply_webentity_creation_rules_to_page(lru, history)
+
+            # Further occurrences of the lru must not count it as created again
+            history.page_was_created = False
+
+            for weid, prefixes in report.created_webentities.items():
+                for prefix in prefixes:
+                    created_prefixes[prefix] = weid
+
+            node.refresh()  # update node
+            yield node, report
+
 
     # =========================================================================
     # Public interface
@@ -306,6 +582,7 @@ class Traph(object):
                 raise TraphException(b"Prefix not in tree: " + rule_prefix)
             node.flag_as_webentity_creation_rule()
             node.write()
+            self.lru_trie.invalidate_descent_cache(rule_prefix)
             # Spawn necessary web entities
             for node2, lru in self.lru_trie.dfs_iter(node, rule_prefix):
                 if node2.is_page():
@@ -336,6 +613,7 @@ class Traph(object):
             raise TraphException(b"Prefix %s cannot be found" % (rule_prefix))
         node.unflag_as_webentity_creation_rule()
         node.write()
+        self.lru_trie.invalidate_descent_cache(rule_prefix)
 
         return True
 
@@ -353,11 +631,14 @@ class Traph(object):
         report.created_webentities[webentity_id] = valid_prefixes
         return report
 
-    def delete_webentity(self, weid, weid_prefixes, check_for_corruption=True):
+    def delete_webentity(self, weid, weid_prefixes=None, check_for_corruption=True):
         """
         Note: weid is only useful to check data consistency, but not strictly necessary to the method.
         It there is no weid, a consistency check will be skipped but the method will execute regardless.
+        If weid_prefixes is not given, the webentity's prefixes are read from the
+        prefix index.
         """
+        weid_prefixes = self.__webentity_prefixes(weid, weid_prefixes)
         weid_prefixes = [self.__encode(weid_prefix) for weid_prefix in weid_prefixes]
 
         # Note: weid is ignored if no check for data consistency
@@ -379,8 +660,7 @@ class Traph(object):
                 prefix_index.update({prefix: node})
 
         for prefix, node in prefix_index.items():
-            node.unset_webentity()
-            node.write()
+            self.lru_trie.unset_webentity(node, prefix)
 
         return True
 
@@ -397,8 +677,7 @@ class Traph(object):
                 % (prefix, node.webentity())
             )
         else:
-            node.set_webentity(weid)
-            node.write()
+            self.lru_trie.set_webentity(node, prefix, weid)
             return True
 
     def remove_prefix_from_webentity(self, prefix, weid=False):
@@ -407,8 +686,7 @@ class Traph(object):
         # check prefix
         node, history = self.lru_trie.add_lru(prefix)
         if not weid or node.webentity() == weid:
-            node.unset_webentity()
-            node.write()
+            self.lru_trie.unset_webentity(node, prefix)
             return True
         else:
             raise TraphException(
@@ -515,7 +793,31 @@ class Traph(object):
             raise TraphException("LRU %s is not a webentity prefix" % (prefix))
         return node.webentity()
 
-    def get_webentity_pages_iter(self, weid, prefixes):
+    def get_webentity_prefixes(self, weid):
+        """
+        Returns the prefixes of the given webentity, read from the prefix
+        index rather than searched in the trie. Methods taking a webentity's
+        prefixes along with its id default to those.
+        """
+        blocks = self.lru_trie.prefix_index.blocks(weid)
+
+        if not blocks:
+            raise TraphException("Unknown webentity %s" % (weid))
+
+        return [self.lru_trie.windup_lru(block) for block in blocks]
+
+    def webentities_iter(self):
+        """
+        Iterates over the webentities, as (weid, prefixes) tuples sorted by
+        id, using the prefix index & thus without traversing the trie.
+        """
+        for weid in sorted(self.lru_trie.prefix_index):
+            yield weid, self.get_webentity_prefixes(weid)
+
+    def get_webentities(self):
+        return dict(self.webentities_iter())
+
+    def get_webentity_pages_iter(self, weid, prefixes=None):
         """
         Note: the prefixes are supposed to match the webentity id. We do not check.
         """
@@ -529,12 +831,73 @@ class Traph(object):
 
         yield state.finalize(pages)
 
-    def get_webentity_pages(self, weid, prefixes):
+    def get_webentity_pages(self, weid, prefixes=None):
         return run_iterator(self.get_webentity_pages_iter(weid, prefixes))
 
+    # Method returning the path of the page found at the given offset below
+    # the given prefix, or None if there are not as many
+    def __webentity_page_path(self, starting_node, prefix, offset, crawled_only):
+        if self.lru_trie.subtree_counters is not None:
+            return self.lru_trie.webentity_page_path(
+                starting_node, offset, crawled=crawled_only
+            )
+
+        generator = self.lru_trie.webentity_inorder_iter(starting_node, prefix)
+
+        for node, _, path in generator:
+            if not node.is_page() or (crawled_only and not node.is_crawled()):
+                continue
+
+            if offset == 0:
+                return path
+
+            offset -= 1
+
+        return None
+
+    # Method returning the prefix index & the path of the page preceding the
+    # given offset among the webentity's pages, i.e. what a pagination token
+    # would hold to resume the traversal from there.
+    def __webentity_pagination_start(self, prefixes, offset, crawled_only=False):
+        offset -= 1
+
+        for i, prefix in enumerate(prefixes):
+            prefix = self.__encode(prefix)
+
+            starting_node = self.lru_trie.lru_node(prefix)
+
+            if not starting_node:
+                raise TraphException("LRU %s not in the traph" % (prefix))
+
+            path = self.__webentity_page_path(
+                starting_node, prefix, offset, crawled_only
+            )
+
+            if path is not None:
+                return i, path
+
+            offset -= self.__count_webentity_prefix_pages(starting_node, prefix)[
+                "count_crawled" if crawled_only else "count"
+            ]
+
+        return len(prefixes), None
+
     def paginate_webentity_pages(
-        self, weid, prefixes, page_count=None, pagination_token=None, crawled_only=False
+        self,
+        weid,
+        prefixes=None,
+        page_count=None,
+        pagination_token=None,
+        crawled_only=False,
+        offset=None,
     ):
+        """
+        Note: offset can be given instead of a pagination token to start
+        from the page found at this offset, which, using subtree counters,
+        does not iterate over the preceding pages.
+        """
+        prefixes = self.__webentity_prefixes(weid, prefixes)
+
         if page_count is not None:
             assert page_count > 0
 
@@ -553,6 +916,10 @@ class Traph(object):
 
         if pagination_token:
             start_i, pagination_path = parse_pagination_token(pagination_token)
+        elif offset:
+            start_i, pagination_path = self.__webentity_pagination_start(
+                prefixes, offset, crawled_only
+            )
 
         for i in range(start_i, len(prefixes)):
             current_prefix = self.__encode(prefixes[i])
@@ -599,7 +966,7 @@ class Traph(object):
 
         return {"done": True, "count": n, "count_crawled": c, "pages": pages}
 
-    def get_webentity_crawled_pages_iter(self, weid, prefixes):
+    def get_webentity_crawled_pages_iter(self, weid, prefixes=None):
         """
         Note: the prefixes are supposed to match the webentity id. We do not check.
         """
@@ -614,16 +981,18 @@ class Traph(object):
 
         yield state.finalize(pages)
 
-    def get_webentity_crawled_pages(self, weid, prefixes):
+    def get_webentity_crawled_pages(self, weid, prefixes=None):
         return run_iterator(self.get_webentity_crawled_pages_iter(weid, prefixes))
 
     def get_webentity_most_linked_pages_iter(
-        self, weid, prefixes, pages_count=10, max_depth=None
+        self, weid, prefixes=None, pages_count=10, max_depth=None
     ):
         """
         Returns a list of objects {lru:, indegree:}
         Note: the prefixes are supposed to match the webentity id. We do not check.
         """
+        prefixes = self.__webentity_prefixes(weid, prefixes)
+
         state = TraphIteratorState()
         pages = []
         c = 0
@@ -641,8 +1010,11 @@ class Traph(object):
                     # Iterate over link nodes
                     indegree = 0
 
-                    for _ in self.link_store.weighted_link_nodes_iter(node.inlinks()):
-                        indegree += 1
+                    if node.has_inlinks():
+                        for _ in self.link_store.weighted_link_nodes_iter(
+                            node.inlinks()
+                        ):
+                            indegree += 1
 
                     c += 1
                     heapq.heappush(pages, (indegree, c, lru))
@@ -664,7 +1036,7 @@ class Traph(object):
         yield state.finalize(sorted_pages)
 
     def get_webentity_most_linked_pages(
-        self, weid, prefixes, pages_count=10, max_depth=None
+        self, weid, prefixes=None, pages_count=10, max_depth=None
     ):
         return run_iterator(
             self.get_webentity_most_linked_pages_iter(
@@ -672,10 +1044,12 @@ class Traph(object):
             )
         )
 
-    def get_webentity_parent_webentities(self, weid, prefixes):
+    def get_webentity_parent_webentities(self, weid, prefixes=None):
         """
         Note: the prefixes are supposed to match the webentity id. We do not check.
         """
+        prefixes = self.__webentity_prefixes(weid, prefixes)
+
         weids = set()
         for prefix in prefixes:
             prefix = self.__encode(prefix)
@@ -691,10 +1065,12 @@ class Traph(object):
 
         return list(weids)
 
-    def get_webentity_child_webentities_iter(self, weid, prefixes):
+    def get_webentity_child_webentities_iter(self, weid, prefixes=None):
         """
         Note: the prefixes are supposed to match the webentity id. We do not check.
         """
+        prefixes = self.__webentity_prefixes(weid, prefixes)
+
         state = TraphIteratorState()
         weids = set()
         for prefix in prefixes:
@@ -716,13 +1092,13 @@ class Traph(object):
 
         yield state.finalize(list(weids))
 
-    def get_webentity_child_webentities(self, weid, prefixes):
+    def get_webentity_child_webentities(self, weid, prefixes=None):
         return run_iterator(self.get_webentity_child_webentities_iter(weid, prefixes))
 
     def get_webentity_pagelinks_iter(
         self,
         weid,
-        prefixes,
+        prefixes=None,
         include_inbound=False,
         include_internal=True,
         include_outbound=False,
@@ -732,8 +1108,7 @@ class Traph(object):
         Default is only internal pagelinks.
         Note: the prefixes are supposed to match the webentity id. We do not check.
         """
-
-        # TODO: Can be optimized caching windups
+        prefixes = self.__webentity_prefixes(weid, prefixes)
 
         if not include_internal and not include_outbound and not include_inbound:
             raise TraphException(
@@ -800,7 +1175,7 @@ class Traph(object):
     def get_webentity_pagelinks(
         self,
         weid,
-        prefixes,
+        prefixes=None,
         include_inbound=False,
         include_internal=True,
         include_outbound=False,
@@ -818,12 +1193,14 @@ class Traph(object):
     def paginate_webentity_pagelinks(
         self,
         weid,
-        prefixes,
+        prefixes=None,
         include_internal=True,
         include_outbound=False,
         source_page_count=None,
         pagination_token=None,
     ):
+        prefixes = self.__webentity_prefixes(weid, prefixes)
+
         if source_page_count is not None:
             assert source_page_count > 0
 
@@ -909,11 +1286,12 @@ class Traph(object):
             "pagelinks": pagelinks,
         }
 
-    def get_webentity_outlinks_iter(self, weid, prefixes):
+    def get_webentity_outlinks_iter(self, weid, prefixes=None):
         """
         Returns the list of cited web entities
         Note: the prefixes are supposed to match the webentity id. We do not check.
         """
+        prefixes = self.__webentity_prefixes(weid, prefixes)
 
         state = TraphIteratorState()
         done_blocks = set()
@@ -949,10 +1327,10 @@ class Traph(object):
 
         yield state.finalize(weids)
 
-    def get_webentity_outlinks(self, weid, prefixes):
+    def get_webentity_outlinks(self, weid, prefixes=None):
         return run_iterator(self.get_webentity_outlinks_iter(weid, prefixes))
 
-    def get_webentity_outdegree(self, weid, prefixes):
+    def get_webentity_outdegree(self, weid, prefixes=None):
         """
         Convenience method relying on get_webentity_outlinks (thus NOT more efficient)
         Note: the prefixes are supposed to match the webentity id. We do not check.
@@ -961,11 +1339,12 @@ class Traph(object):
 
         return len(self.get_webentity_outlinks(weid, prefixes))  # type:ignore
 
-    def get_webentity_inlinks_iter(self, weid, prefixes):
+    def get_webentity_inlinks_iter(self, weid, prefixes=None):
         """
         Returns the list of citing web entities
         Note: the prefixes are supposed to match the webentity id. We do not check.
         """
+        prefixes = self.__webentity_prefixes(weid, prefixes)
 
         state = TraphIteratorState()
         done_blocks = set()
@@ -1001,10 +1380,10 @@ class Traph(object):
 
         yield state.finalize(weids)
 
-    def get_webentity_inlinks(self, weid, prefixes):
+    def get_webentity_inlinks(self, weid, prefixes=None):
         return run_iterator(self.get_webentity_inlinks_iter(weid, prefixes))
 
-    def get_webentity_indegree(self, weid, prefixes):
+    def get_webentity_indegree(self, weid, prefixes=None):
         """
         Convenience method relying on get_webentity_inlinks (thus NOT more efficient)
         Note: the prefixes are supposed to match the webentity id. We do not check.
@@ -1013,7 +1392,7 @@ class Traph(object):
 
         return len(self.get_webentity_inlinks(weid, prefixes))  # type:ignore
 
-    def get_webentity_degree(self, weid, prefixes):
+    def get_webentity_degree(self, weid, prefixes=None):
         """
         Note: relies on get_webentity_inlinks() and get_webentity_outlinks(),
         thus not more efficient than calling these.
@@ -1272,17 +1651,24 @@ class Traph(object):
 
         return report
 
-    def add_pages(self, lrus, crawled=False):
+    def add_pages(self, lrus, crawled=False, sorted_batch=False):
+        """
+        If sorted_batch is True, the lrus are added to the trie in sorted order
+        so that each one only has to be walked down from the prefix it shares
+        with the previous one. The resulting report is the same.
+        """
         report = TraphWriteReport()
+        lrus = [self.__encode(lru) for lru in lrus]
 
-        for lru in lrus:
-            lru = self.__encode(lru)
+        if sorted_batch:
+            added_pages = self.__add_page_batch_iter([(lru, crawled) for lru in lrus])
+        else:
+            added_pages = (self.__add_page(lru, crawled=crawled) for lru in lrus)
 
-            node, page_report = self.__add_page(lru, crawled=crawled)
+        for node, page_report in added_pages:
             report += page_report
 
-            node.flag_as_crawled()
-            node.write()
+            self.lru_trie.flag_page_as_crawled(node)
 
         return report
 
@@ -1330,9 +1716,15 @@ class Traph(object):
 
         return report
 
-    def index_batch_crawl_iter(self, data, yield_frequency):
+    def index_batch_crawl_iter(self, data, yield_frequency, sorted_batch=False):
         """
         data must be a multimap 'source_lru' => 'target_lrus'
+
+        If sorted_batch is True, the batch's pages are added to the trie in
+        sorted order beforehand so that each one only has to be walked down
+        from the prefix it shares with the previous one. This is especially
+        efficient for crawls of large single sites & the resulting report is
+        the same.
         """
         store = self.link_store
         state = TraphIteratorState()
@@ -1340,7 +1732,37 @@ class Traph(object):
         pages = dict()
         inlinks = defaultdict(list)
 
-        for source_page, target_pages in data.items():
+        if sorted_batch:
+            batch = []
+
+            for source_page, target_pages in data.items():
+                source_page = self.__encode(source_page)
+                target_pages = [self.__encode(lru) for lru in target_pages]
+
+                batch.append((source_page, target_pages))
+
+                # Pages are added in the order the regular path would add them
+                if source_page not in pages:
+                    pages[source_page] = True
+
+                for target_page in target_pages:
+                    if target_page not in pages:
+                        pages[target_page] = False
+
+            added_pages = self.__add_page_batch_iter(list(pages.items()))
+
+            for page, (node, page_report) in zip(list(pages), added_pages):
+                report += page_report
+                pages[page] = node
+
+                if state.should_yield(yield_frequency):
+                    yield state
+
+            data = batch
+        else:
+            data = data.items()
+
+        for source_page, target_pages in data:
             source_page = self.__encode(source_page)
 
             # We need to add the page
@@ -1355,8 +1777,7 @@ class Traph(object):
 
                 if not source_node.is_crawled():
                     source_node.refresh()
-                    source_node.flag_as_crawled()
-                    source_node.write()
+                    self.lru_trie.flag_page_as_crawled(source_node)
 
             target_blocks = []
 
@@ -1392,20 +1813,55 @@ class Traph(object):
 
         yield state.finalize(report)
 
-    def index_batch_crawl(self, data, yield_frequency=50):
-        return run_iterator(self.index_batch_crawl_iter(data, yield_frequency))
+    def index_batch_crawl(self, data, yield_frequency=50, sorted_batch=False):
+        return run_iterator(
+            self.index_batch_crawl_iter(data, yield_frequency, sorted_batch)
+        )
+
+    def flush(self):
+        """
+        Writes every pending block to disk.
+        """
+        if self.in_memory:
+            return
+
+        self.__write_counters()
+
+        self.lru_trie_storage.flush()
+        self.links_store_storage.flush()
 
     def close(self):
+        # Persisting the counters, now flagged as exact
+        if not self.lru_trie_file or not self.lru_trie_file.closed:
+            self.__write_counters(close=True)
+            self.lru_trie.close_prefix_index()
+
+        # Flushing pending writes & releasing the storages
+        if not self.in_memory:
+            self.lru_trie_storage.close()
+            self.links_store_storage.close()
+
         # Cleanup
         if self.lru_trie_file:
             self.lru_trie_file.close()
 
+        if self.lru_trie_stems_file:
+            self.lru_trie_stems_file.close()
+
+        if self.lru_trie_counts_file:
+            self.lru_trie_counts_file.close()
+
+        if self.lru_trie_webentities_file:
+            self.lru_trie_webentities_file.close()
+
         if self.link_store_file:
             self.link_store_file.close()
 
     def clear(
         self, default_webentity_creation_rule=None, webentity_creation_rules=None
     ):
+        subtree_counters = self.lru_trie.subtree_counters is not None
+
         self.close()
 
         if self.in_memory:
@@ -1415,15 +1871,36 @@ class Traph(object):
             self.lru_trie_file = open(self.lru_trie_path, "wb+")
             self.link_store_file = open(self.link_store_path, "wb+")
 
-            self.lru_trie_storage.file = self.lru_trie_file
-            self.links_store_storage.file = self.link_store_file
+            if self.lru_trie_stems_file:
+                self.lru_trie_stems_file = open(self.lru_trie_stems_path, "wb+")
+
+                self.lru_trie_storage.reset(
+                    self.lru_trie_file, self.lru_trie_stems_file
+                )
+            else:
+                self.lru_trie_storage.reset(self.lru_trie_file)
+
+            self.links_store_storage.reset(self.link_store_file)
 
         # LRU Trie re-initialization
-        self.lru_trie = LRUTrie(self.lru_trie_storage, encoding=self.encoding)
+        self.lru_trie = LRUTrie(
+            self.lru_trie_storage,
+            encoding=self.encoding,
+            descent_cache_size=self.descent_cache_size,
+            windup_cache_size=self.windup_cache_size,
+            webentity_cache_size=self.webentity_cache_size,
+        )
+
+        if subtree_counters:
+            self.__use_subtree_counters(create=True)
+
+        self.__use_prefix_index(create=True)
 
         # Link Store re-initialization
         self.link_store = LinkStore(self.links_store_storage)
 
+        self.__open_counters()
+
         # Updating creation rules?
         # TODO: this code is basically duplicated from __init__ maybe refactor?
         if default_webentity_creation_rule is not None:
@@ -1437,6 +1914,128 @@ class Traph(object):
             for prefix, pattern in webentity_creation_rules.items():
                 self.add_webentity_creation_rule(prefix, pattern, True)
 
+    def compact(self, target_folder):
+        """
+        Rewrites the Traph's files into the given folder, with the trie's
+        nodes laid out in depth-first order, each one followed by its tail
+        blocks, and each page's link stubs stored contiguously, so that
+        traversals read the files mostly sequentially.
+
+        Returns the compacted Traph, the current one being left untouched.
+        """
+        lru_trie_path = os.path.join(target_folder, "lru_trie.dat")
+        link_store_path = os.path.join(target_folder, "link_store.dat")
+
+        if os.path.isfile(lru_trie_path) or os.path.isfile(link_store_path):
+            raise TraphException("Cannot compact into an existing Traph.")
+
+        # Ensuring the target folder exists
+        try:
+            os.makedirs(target_folder)
+        except OSError as exception:
+            if exception.errno == errno.EEXIST and os.path.isdir(target_folder):
+                pass
+            else:
+                raise
+
+        lru_trie_file = open(lru_trie_path, "wb+")
+        lru_trie_stems_file = None
+        link_store_file = open(link_store_path, "wb+")
+
+        # The compacted trie keeps the layout of the current one
+        if self.lru_trie_stems_file:
+            lru_trie_stems_file = open(
+                os.path.join(target_folder, "lru_trie.stems.dat"), "wb+"
+            )
+
+            lru_trie_storage = SplitStorage(
+                LRU_TRIE_NODE_BLOCK_SIZE,
+                LRU_TRIE_STEM_FIELD_SIZE,
+                lru_trie_file,
+                lru_trie_stems_file,
+            )
+        else:
+            lru_trie_storage = FileStorage(
+                LRU_TRIE_NODE_BLOCK_SIZE,
+                lru_trie_file,
+                buffer_size=COMPACTION_BUFFER_SIZE,
+            )
+
+        links_store_storage = FileStorage(
+            LINK_STORE_NODE_BLOCK_SIZE,
+            link_store_file,
+            buffer_size=COMPACTION_BUFFER_SIZE,
+        )
+
+        try:
+            compact(
+                self.lru_trie, self.link_store, lru_trie_storage, links_store_storage
+            )
+        finally:
+            lru_trie_storage.close()
+            links_store_storage.close()
+            lru_trie_file.close()
+            link_store_file.close()
+
+            if lru_trie_stems_file:
+                lru_trie_stems_file.close()
+
+        if self.debug:
+            return Traph(
+                folder=target_folder,
+                encoding=self.encoding,
+                debug=True,
+                storage=self.storage,
+                descent_cache_size=self.descent_cache_size,
+                windup_cache_size=self.windup_cache_size,
+                webentity_cache_size=self.webentity_cache_size,
+                subtree_counters=self.lru_trie.subtree_counters is not None,
+            )
+
+        default_webentity_creation_rule = self.default_webentity_creation_rule
+
+        return Traph(
+            folder=target_folder,
+            encoding=self.encoding,
+            default_webentity_creation_rule=default_webentity_creation_rule.pattern,
+            webentity_creation_rules={
+                prefix: regexp.pattern
+                for prefix, regexp in self.webentity_creation_rules.items()
+            },
+            storage=self.storage,
+            descent_cache_size=self.descent_cache_size,
+            windup_cache_size=self.windup_cache_size,
+            webentity_cache_size=self.webentity_cache_size,
+            subtree_counters=self.lru_trie.subtree_counters is not None,
+        )
+
+    def rebalance_iter(self, max_ratio=LRU_TRIE_MAX_BST_RATIO, yield_frequency=1000):
+        """
+        Rebuilds in place, as balanced trees, the sibling BSTs whose height
+        is more than max_ratio times the one of a balanced BST of the same
+        size, the rest of the trie being left untouched.
+
+        Since it yields every yield_frequency BSTs, it can be run in the
+        background, between batches. Note that pagination tokens issued
+        before a rebalancing cannot be resumed from afterwards.
+        """
+        state = TraphIteratorState()
+        report = {"nb_bst": 0, "nb_rebalanced_bst": 0}
+
+        for _, _, rebalanced in self.lru_trie.rebalance_iter(max_ratio):
+            report["nb_bst"] += 1
+
+            if rebalanced:
+                report["nb_rebalanced_bst"] += 1
+
+            if state.should_yield(yield_frequency):
+                yield state
+
+        yield state.finalize(report)
+
+    def rebalance(self, max_ratio=LRU_TRIE_MAX_BST_RATIO):
+        return run_iterator(self.rebalance_iter(max_ratio))
+
     # =========================================================================
     # Iteration methods
     # =========================================================================
@@ -1457,10 +2056,12 @@ class Traph(object):
         return self.lru_trie.webentity_prefix_iter()
 
     # TODO: weid arg useless
-    def webentity_page_nodes_iter(self, weid, prefixes):
+    def webentity_page_nodes_iter(self, weid, prefixes=None):
         """
         Note: the prefixes are supposed to match the webentity id. We do not check.
         """
+        prefixes = self.__webentity_prefixes(weid, prefixes)
+
         for prefix in prefixes:
             prefix = self.__encode(prefix)
 
@@ -1485,6 +2086,91 @@ class Traph(object):
     def count_links(self):
         return self.link_store.count_links()
 
+    # Method counting the pages & crawled pages found below the given prefix
+    def __count_webentity_prefix_pages(self, starting_node, prefix):
+        lru_trie = self.lru_trie
+
+        if lru_trie.subtree_counters is not None:
+            return {
+                "count": lru_trie.count_webentity_pages(starting_node),
+                "count_crawled": lru_trie.count_webentity_pages(
+                    starting_node, crawled=True
+                ),
+            }
+
+        count = 0
+        count_crawled = 0
+
+        for node, _ in lru_trie.webentity_dfs_iter(starting_node, prefix):
+            if node.is_page():
+                count += 1
+
+                if node.is_crawled():
+                    count_crawled += 1
+
+        return {"count": count, "count_crawled": count_crawled}
+
+    def count_webentity_pages(self, weid, prefixes=None):
+        """
+        Returns the number of pages & crawled pages of the webentity, read
+        from the subtree counters if the Traph maintains them.
+
+        Note: the prefixes are supposed to match the webentity id. We do not check.
+        """
+        prefixes = self.__webentity_prefixes(weid, prefixes)
+
+        count = 0
+        count_crawled = 0
+
+        for prefix in prefixes:
+            prefix = self.__encode(prefix)
+
+            starting_node = self.lru_trie.lru_node(prefix)
+
+            if not starting_node:
+                raise TraphException("LRU %s not in the traph" % (prefix))
+
+            counts = self.__count_webentity_prefix_pages(starting_node, prefix)
+
+            count += counts["count"]
+            count_crawled += counts["count_crawled"]
+
+        return {"count": count, "count_crawled": count_crawled}
+
+    def counters(self):
+        """
+        Returns the number of pages, crawled pages, nodes, tail nodes,
+        webentity prefixes & links of the Traph.
+
+        Those are read in constant time from the headers, unless the files
+        predate the counters or the Traph was not cleanly closed, in which
+        case they are computed by scanning the files: rebuild_counters must
+        then be run once to persist them again.
+        """
+        lru_trie = self.lru_trie
+
+        return {
+            "nb_pages": lru_trie.count_pages(),
+            "nb_crawled_pages": lru_trie.count_crawled_pages(),
+            "nb_nodes": lru_trie.count_nodes(),
+            "nb_tail_nodes": lru_trie.count_tail_nodes(),
+            "nb_webentity_prefixes": lru_trie.count_webentity_prefixes(),
+            "nb_links": self.link_store.count_links(),
+        }
+
+    def rebuild_counters(self):
+        """
+        Recomputes the counters by scanning the files once, e.g. for files
+        predating them or after a crash, and returns them.
+        """
+        self.lru_trie.rebuild_counters()
+        self.link_store.rebuild_counters()
+
+        if self.lru_trie.subtree_counters is not None:
+            self.lru_trie.rebuild_subtree_counters()
+
+        return self.counters()
+
     def links_metrics(self):
         max_inlinks_len = 0
         max_outlinks_len = 0
@@ -1518,6 +2204,42 @@ class Traph(object):
             "max_outlinks_lru": max_outlinks_lru,
         }
 
+    def cache_metrics(self):
+        """
+        Returns the hit/miss counters of the block caches, or None for each
+        file whose storage is not cached, along with the descent, windup &
+        webentity caches' ones.
+        """
+        descent_cache = self.lru_trie.descent_cache
+        windup_cache = self.lru_trie.windup_cache
+        webentity_cache = self.lru_trie.webentity_cache
+
+        metrics = {
+            "lru_trie": None,
+            "link_store": None,
+            "descent": descent_cache.metrics() if descent_cache is not None else None,
+            "windup": windup_cache.metrics() if windup_cache is not None else None,
+            "webentity": (
+                webentity_cache.metrics() if webentity_cache is not None else None
+            ),
+        }
+
+        if not self.in_memory and self.storage == "file":
+            metrics["lru_trie"] = self.lru_trie_storage.cache_metrics()
+            metrics["link_store"] = self.links_store_storage.cache_metrics()
+
+        return metrics
+
+    def write_metrics(self):
+        """
+        Returns the write counters of both storages, notably the number of
+        node writes which were skipped because nothing changed.
+        """
+        return {
+            "lru_trie": self.lru_trie_storage.counters.metrics(),
+            "link_store": self.links_store_storage.counters.metrics(),
+        }
+
     def metrics(self):
         return {
             "lru_trie": self.lru_trie.metrics(),
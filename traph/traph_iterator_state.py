@@ -6,6 +6,8 @@
 
 
 class TraphIteratorState(object):
+    __slots__ = ("done", "result", "n_iterations")
+
     def __init__(self):
         self.done = False
         self.result = None
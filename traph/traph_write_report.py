@@ -8,6 +8,8 @@
 
 
 class TraphWriteReport(object):
+    __slots__ = ("created_webentities", "nb_created_pages")
+
     def __init__(self):
         # Properties
         self.created_webentities = {}